@@ -0,0 +1,198 @@
+"""
+Async views for the ASGI deployment (mojprojekt/asgi.py).
+
+Login and passwords: hashing a password (PBKDF2) takes tens of ms of CPU; in a plain view under ASGI
+it blocks the event loop and every other request. Here the serializer validation (which hashes)
+goes to a bounded pool of PASSWORD_HASHER_POOL_SIZE threads, and the loop serves the rest meanwhile.
+hashlib releases the GIL, so the pool threads hash in parallel.
+
+Live changes (/api/live/, live.py): SSE stream, ASGI only.
+
+The login/password views replace the sync ones when ASYNC_AUTH_VIEWS = True (see urls.py). The journal
+endpoints stay sync views: the async ORM of Django 5.2 runs every query through sync_to_async, and
+async versions of them were no faster under ASGI (within 10% either way at 64 concurrent requests).
+"""
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import close_old_connections
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, QueryDict, StreamingHttpResponse
+from django.utils.module_loading import import_string
+from django.views import View
+from rest_framework import exceptions
+from rest_framework.settings import api_settings as api_settings_drf
+from rest_framework_simplejwt.settings import api_settings
+
+from .authentication import CachedJWTAuthentication
+from .live import aconsume_ticket, event_stream, live_hub, stream_authorization
+from .serializers import ChangePasswordSerializer, SetNewPasswordSerializer
+from .throttling import LoginRateThrottle, PasswordResetConfirmRateThrottle, TokenBucketThrottle
+
+User = get_user_model()
+
+PASSWORD_HASHER_POOL_SIZE = getattr(settings, 'PASSWORD_HASHER_POOL_SIZE', min(4, os.cpu_count() or 1))
+
+_hasher_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASHER_POOL_SIZE, thread_name_prefix='password-hasher')
+
+
+def _run_in_pool_thread(func):
+    # pool threads keep their own DB connections, they follow CONN_MAX_AGE like request threads
+    close_old_connections()
+    try:
+        return func()
+    finally:
+        close_old_connections()
+
+
+async def run_hashing(func, *args, **kwargs):
+    """
+    Runs func (hashing, possibly a write) in the hashing pool and waits without blocking the loop.
+    With the pool busy, further requests queue up instead of adding threads.
+    """
+    loop = asyncio.get_running_loop()
+    call = functools.partial(func, *args, **kwargs)
+    return await loop.run_in_executor(_hasher_pool, _run_in_pool_thread, call)
+
+
+def request_data(request):
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body or b'{}')
+        except ValueError as exc:
+            raise exceptions.ParseError(f'JSON parse error - {exc}')
+        return data if isinstance(data, dict) else {}
+    if request.method != 'POST' and request.content_type == 'application/x-www-form-urlencoded':
+        return QueryDict(request.body)
+    return request.POST
+
+
+class AsyncAPIView(View):
+    """
+    A minimal async counterpart of APIView: JSON, throttling, JWT and DRF errors as JSON.
+    """
+    throttle_classes = api_settings_drf.DEFAULT_THROTTLE_CLASSES
+    authentication_required = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        # token auth, no cookies, same as APIView
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            if self.authentication_required:
+                request.user = await self.authenticate(request)
+            if any(issubclass(throttle, TokenBucketThrottle) for throttle in self.throttle_classes):
+                # the token buckets live in a SQLite file
+                await sync_to_async(self.check_throttles)(request)
+            else:
+                self.check_throttles(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except exceptions.APIException as exc:
+            return self.handle_exception(exc)
+
+    async def authenticate(self, request):
+        result = await CachedJWTAuthentication().aauthenticate(request)
+        if result is None:
+            raise exceptions.NotAuthenticated()
+        return result[0]
+
+    def check_throttles(self, request):
+        for throttle_class in self.throttle_classes:
+            throttle = throttle_class()
+            if not throttle.allow_request(request, self):
+                raise exceptions.Throttled(throttle.wait())
+
+    def handle_exception(self, exc):
+        data = exc.detail if isinstance(exc.detail, (dict, list)) else {'detail': exc.detail}
+        response = JsonResponse(data, status=exc.status_code, safe=False)
+        if isinstance(exc, exceptions.Throttled) and exc.wait is not None:
+            response['Retry-After'] = '%d' % exc.wait
+        if isinstance(exc, (exceptions.NotAuthenticated, exceptions.AuthenticationFailed)):
+            response['WWW-Authenticate'] = 'Bearer realm="api"'
+            response.status_code = 401
+        return response
+
+
+# login: same request and response as TokenObtainPairView
+class AsyncTokenObtainPairView(AsyncAPIView):
+    throttle_classes = [LoginRateThrottle]
+
+    async def post(self, request):
+        serializer = import_string(api_settings.TOKEN_OBTAIN_SERIALIZER)(
+            data=request_data(request), context={'request': request},
+        )
+        # authenticate() checks the password hash, the token is signed in the same thread
+        await run_hashing(serializer.is_valid, raise_exception=True)
+        return JsonResponse(serializer.validated_data)
+
+
+class AsyncChangePasswordView(AsyncAPIView):
+    authentication_required = True
+
+    async def post(self, request):
+        serializer = ChangePasswordSerializer(data=request_data(request), context={'request': request})
+
+        def change():
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        await run_hashing(change)
+        return JsonResponse({"detail": "Password changed successfully."})
+
+
+class AsyncSetNewPasswordView(AsyncAPIView):
+    throttle_classes = [PasswordResetConfirmRateThrottle]
+
+    async def post(self, request):
+        serializer = SetNewPasswordSerializer(data=request_data(request))
+
+        def reset():
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        await run_hashing(reset)
+        return JsonResponse({"status": "password reset complete"})
+
+
+# --- live updates ---
+
+# /api/live/?ticket=<ticket from POST /api/live/ticket/> - EventSource stream of the user's journal changes (live.py)
+class LiveEventsView(AsyncAPIView):
+    authentication_required = True
+
+    async def authenticate(self, request):
+        # EventSource cannot send headers. Query strings end up in access logs, so the URL carries
+        # a single-use ticket valid for seconds, never the access token; other clients use the header
+        ticket = request.GET.get('ticket')
+        if not ticket:
+            return await super().authenticate(request)
+        user_id = await aconsume_ticket(ticket)
+        user = await User.objects.filter(pk=user_id, is_active=True).afirst() if user_id is not None else None
+        if user is None:
+            raise exceptions.AuthenticationFailed('Invalid or expired stream ticket.')
+        return user
+
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # a WSGI worker would be held by one endless response
+            return JsonResponse({'detail': 'Live updates need the ASGI server.'}, status=501)
+        last_event_id = request.headers.get('Last-Event-ID', '')
+        stream = event_stream(
+            live_hub, request.user.pk, int(last_event_id) if last_event_id.isdigit() else None,
+            authorized=stream_authorization(request.user),
+        )
+        response = StreamingHttpResponse(stream, content_type='text/event-stream')
+        response['Cache-Control'] = 'no-cache'
+        # nginx would buffer the stream otherwise
+        response['X-Accel-Buffering'] = 'no'
+        return response
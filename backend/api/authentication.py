@@ -0,0 +1,264 @@
+"""
+JWT authentication with a per-process cache of the user.
+
+JWTAuthentication reads the User row on every request, and ProfileView the profile as well.
+Here the User is read with its profile (and data version) in one query and kept for
+AUTH_USER_CACHE_TTL seconds. Tokens carry a hash of the password (SIMPLE_JWT CHECK_REVOKE_TOKEN),
+so a password change revokes the old ones and a new token with another hash forces a read.
+
+Writes of User/UserProfile drop the entry in their own process (signals, see signals.py); other
+processes see most changes within the TTL. A password change, a deactivation or a deletion is
+announced through AUTH_REVOCATIONS_PATH, a log of revoked user ids: every process stats it on
+each request and, when it changed, reads the new lines and drops those users, so revoked tokens
+stop working right after the commit. The file is local, so this only reaches the processes of one
+host; with several hosts the others see the change after AUTH_USER_CACHE_TTL. It is started anew
+(with a new first line, which makes readers drop their whole cache once) past AUTH_REVOCATIONS_MAX_SIZE.
+"""
+import copy
+import fcntl
+import os
+import secrets
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.fields.files import FieldFile
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .metrics import span
+from .models import UserDataVersion, UserProfile
+
+User = get_user_model()
+
+AUTH_USER_CACHE_TTL = getattr(settings, 'AUTH_USER_CACHE_TTL', 30)
+AUTH_USER_CACHE_SIZE = getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000)
+AUTH_REVOCATIONS_PATH = getattr(
+    settings, 'AUTH_REVOCATIONS_PATH', os.path.join(settings.BASE_DIR, 'auth_revocations'),
+)
+AUTH_REVOCATIONS_MAX_SIZE = getattr(settings, 'AUTH_REVOCATIONS_MAX_SIZE', 64 * 1024)
+
+
+class CachedUser:
+    def __init__(self, user):
+        self.user = user
+        try:
+            self.profile = user.profile
+        except UserProfile.DoesNotExist:
+            self.profile = None
+        try:
+            self.data_version = user.data_version.version
+        except UserDataVersion.DoesNotExist:
+            self.data_version = 0
+        self.password_hash = get_md5_hash_password(user.password)
+        self.loaded_at = time.monotonic()
+
+    def copy(self):
+        # every request gets its own instances linked to each other, changes made by a view never reach the cache
+        user = _detached(self.user)
+        if self.profile is not None:
+            # sets user.profile as well
+            _detached(self.profile).user = user
+        else:
+            # known to have none, no query on access
+            User.profile.related.set_cached_value(user, None)
+        user.cached_data_version = self.data_version
+        return user
+
+
+def _detached(instance):
+    # a shallow copy shares the cached related objects (profile.user is the cached User) and FieldFiles
+    # (bound to the cached instance) with the original; both are dropped, a file field is its name again
+    clone = copy.copy(instance)
+    clone._state.fields_cache = {}
+    for name, value in clone.__dict__.items():
+        if isinstance(value, FieldFile):
+            clone.__dict__[name] = value.name
+    return clone
+
+
+class UserCache:
+    """
+    User + UserProfile by user id, cached in the process memory.
+    """
+
+    def __init__(self, ttl=AUTH_USER_CACHE_TTL, size=AUTH_USER_CACHE_SIZE, revocations_path=AUTH_REVOCATIONS_PATH):
+        self.ttl = ttl
+        self.size = size
+        self.revocations_path = revocations_path
+        self.generation = 0
+        self._entries = {}
+        self._lock = threading.Lock()
+        # what this process has read of the revocation log: (stat key, first line, offset)
+        self._revocations = (None, None, 0)
+        self._read_revocations(initial=True)
+
+    def _revocations_stat(self):
+        try:
+            stat = os.stat(self.revocations_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_size, stat.st_mtime_ns
+
+    def _read_revocations(self, initial=False):
+        _, header, offset = self._revocations
+        # before reading: an append in between is read now and once more seen as a change, never missed
+        key = self._revocations_stat()
+        try:
+            with open(self.revocations_path, 'rb') as log:
+                current_header = log.readline()
+                if current_header != header:
+                    # a new log: whatever the old one said after our offset is gone
+                    if not initial:
+                        self.clear()
+                    header, offset = current_header, log.tell()
+                log.seek(offset)
+                new = log.read()
+        except FileNotFoundError:
+            self._revocations = (None, None, 0)
+            return
+        # a line being appended right now is read next time
+        new = new[:new.rfind(b'\n') + 1]
+        self._revocations = (key, header, offset + len(new))
+        if not initial:
+            for user_id in new.split():
+                self.invalidate(user_id.decode())
+
+    def get(self, user_id):
+        # a stat() per request instead of a query
+        if self._revocations_stat() != self._revocations[0]:
+            self._read_revocations()
+        # the token carries the id as a string, signals as an int
+        entry = self._entries.get(str(user_id))
+        if entry is None or time.monotonic() - entry.loaded_at > self.ttl:
+            return None
+        return entry
+
+    def load(self, user_id):
+        generation = self.generation
+        user = User.objects.select_related('profile', 'data_version').get(pk=user_id)
+        entry = CachedUser(user)
+        with self._lock:
+            # a concurrent invalidate() wins over what we just read
+            if generation == self.generation:
+                if len(self._entries) >= self.size:
+                    self._entries.pop(next(iter(self._entries)))
+                self._entries[str(user_id)] = entry
+        return entry
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self.generation += 1
+            self._entries.pop(str(user_id), None)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+
+    def revoke(self, user_id):
+        """
+        Drops the entry in every process of this host: call after committing a password change,
+        a deactivation or a deletion.
+        """
+        self.invalidate(user_id)
+        # writers take turns, nobody appends to a log that was just replaced
+        with open(f'{self.revocations_path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                size = os.stat(self.revocations_path).st_size
+            except FileNotFoundError:
+                size = 0
+            if not size or size > AUTH_REVOCATIONS_MAX_SIZE:
+                new_path = f'{self.revocations_path}.new'
+                with open(new_path, 'wb') as log:
+                    log.write(f'{secrets.token_hex(8)}\n'.encode())
+                os.replace(new_path, self.revocations_path)
+            with open(self.revocations_path, 'ab') as log:
+                log.write(f'{user_id}\n'.encode())
+
+
+user_cache = UserCache()
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that takes the user from user_cache; no queries in the common case.
+    """
+
+    def authenticate(self, request):
+        with span('auth'):
+            return super().authenticate(request)
+
+    def get_user(self, validated_token):
+        user = self.get_cached_user(validated_token)
+        if user is not None:
+            return user
+        # not cached, or a token issued after a password change elsewhere: re-read before rejecting it
+        try:
+            entry = user_cache.load(self.get_user_id(validated_token))
+        except User.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
+        return self.check(validated_token, entry)
+
+    async def aauthenticate(self, request):
+        """
+        authenticate() for async views: a cache hit without a hop to a thread.
+        """
+        with span('auth'):
+            header = self.get_header(request)
+            if header is None:
+                return None
+            raw_token = self.get_raw_token(header)
+            if raw_token is None:
+                return None
+            validated_token = self.get_validated_token(raw_token)
+            user = self.get_cached_user(validated_token)
+            if user is None:
+                user = await sync_to_async(self.get_user)(validated_token)
+            return user, validated_token
+
+    def get_user_id(self, validated_token):
+        try:
+            return validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+    def get_cached_user(self, validated_token):
+        entry = user_cache.get(self.get_user_id(validated_token))
+        if entry is None or self.revoked(validated_token, entry):
+            return None
+        return self.check(validated_token, entry)
+
+    def check(self, validated_token, entry):
+        if api_settings.CHECK_USER_IS_ACTIVE and not entry.user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        if self.revoked(validated_token, entry):
+            raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+        return entry.copy()
+
+    def revoked(self, validated_token, entry):
+        return (
+            api_settings.CHECK_REVOKE_TOKEN
+            and validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != entry.password_hash
+        )
+
+
+def get_profile(user, data_version=None):
+    """
+    Returns (user, profile, created) for the profile views. A cached user is read again
+    when its data version differs from `data_version` (a change made in another process).
+    """
+    cached_version = getattr(user, 'cached_data_version', None)
+    if cached_version is not None and data_version is not None and cached_version != data_version:
+        user = user_cache.load(user.pk).copy()
+    try:
+        return user, user.profile, False
+    except UserProfile.DoesNotExist:
+        profile, created = UserProfile.objects.get_or_create(user=user)
+        return user, profile, created
@@ -0,0 +1,1216 @@
+"""
+API benchmarks run by `python manage.py benchmark <scenario>`.
+Every scenario runs on a temporary test database, so db.sqlite3 is never touched.
+"""
+import asyncio
+import contextlib
+import datetime
+import gc
+import http.client
+import io
+import json
+import multiprocessing
+import os
+import random
+import socketserver
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+from unittest import mock
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.exceptions import ValidationError
+from django.core.wsgi import get_wsgi_application
+from django.db import OperationalError, connection, connections, transaction
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, Client, RequestFactory
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import path
+from django.utils import timezone
+from PIL import Image
+from django.test.utils import (
+    CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment,
+)
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.request import Request
+from rest_framework.throttling import AnonRateThrottle
+from rest_framework.views import APIView
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import media, passwords, purge, sync
+from .async_views import AsyncAPIView, AsyncTokenObtainPairView
+from .journal_io import export_journal, import_journal
+from .live import SQLiteNotifyBackend, live_hub
+from .recurrence import occurrence_cache
+from .reminders import ReminderScheduler, pending_reminders
+from .metrics import record_query
+from .models import DayEntry, Mood, OutgoingEmail, RecurringTodo, RecurringTodoOverride, StoredFile, TodoItem, UserProfile
+from .search import search_journal
+from .throttling import TokenBucketStore, TokenBucketThrottle
+from .views import DayEntryHistoryView, MoodListView, ThrottledTokenObtainPairView
+
+User = get_user_model()
+
+SCENARIOS = {}
+BENCH_PASSWORD = 'Bench-passw0rd!'
+
+
+def scenario(name):
+    def register(func):
+        SCENARIOS[name] = func
+        return func
+    return register
+
+
+@contextlib.contextmanager
+def isolated_database():
+    # every scenario gets its own database file: the threads of the local servers keep their
+    # connections open after the scenario, and a shared in-memory database would outlive it
+    setup_test_environment(debug=False)
+    old_name = connection.settings_dict['NAME']
+    old_test_name = connection.settings_dict['TEST'].get('NAME')
+    directory = tempfile.TemporaryDirectory(prefix='benchmark-')
+    connection.settings_dict['TEST']['NAME'] = os.path.join(directory.name, 'test.sqlite3')
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    rest_framework = {**settings.REST_FRAMEWORK, 'DEFAULT_THROTTLE_CLASSES': []}
+    try:
+        # views read their throttle classes at import time, so the override alone is not enough
+        with override_settings(REST_FRAMEWORK=rest_framework), \
+                mock.patch.object(APIView, 'throttle_classes', []), \
+                mock.patch.object(AsyncAPIView, 'throttle_classes', []), \
+                mock.patch.object(TokenBucketThrottle, 'get_rate', lambda self: None):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        connection.settings_dict['TEST']['NAME'] = old_test_name
+        directory.cleanup()
+        teardown_test_environment()
+
+
+def measure(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        'p50': pick(0.50),
+        'p95': pick(0.95),
+        'p99': pick(0.99),
+        'mean': statistics.fmean(ordered),
+    }
+
+
+def format_ms(stats):
+    return ' '.join(f"{key}={value * 1000:.2f}ms" for key, value in stats.items())
+
+
+def auth_client(user):
+    return Client(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+
+
+def seed_moods():
+    return list(Mood.objects.all()) or Mood.objects.bulk_create(
+        [Mood(name=name, icon=icon) for name, icon in (('happy', ':)'), ('ok', ':|'), ('sad', ':('))]
+    )
+
+
+def seed_journal(username, entries, todos_per_entry=0, start=datetime.date(2000, 1, 1)):
+    user = User.objects.create_user(username, f'{username}@example.com', BENCH_PASSWORD)
+    moods = seed_moods()
+    days = DayEntry.objects.bulk_create(
+        [
+            DayEntry(
+                user=user,
+                date=start + datetime.timedelta(days=i),
+                mood=moods[i % len(moods)],
+                description=f'Day {i}: walked the dog, read a book and planned the week.',
+            )
+            for i in range(entries)
+        ],
+        batch_size=1000,
+    )
+    if todos_per_entry:
+        TodoItem.objects.bulk_create(
+            [
+                TodoItem(user=user, day_entry=day, content=f'Task {j} for {day.date}', is_done=bool(j % 2))
+                for day in days
+                for j in range(todos_per_entry)
+            ],
+            batch_size=1000,
+        )
+    return user
+
+
+class _OffsetHistoryView(DayEntryHistoryView):
+    # the history as it was paginated before the keyset pagination, for comparison only
+    pagination_class = LimitOffsetPagination
+
+
+@scenario('history')
+def bench_history(out, scale=1.0):
+    """Keyset pagination: page N should cost the same as page 1 (OFFSET pages for comparison)."""
+    entries = int(10000 * scale)
+    user = seed_journal('history', entries)
+    client = auth_client(user)
+    url = '/api/days/history/?limit=50'
+
+    # walk the whole history once to collect the cursor of every page
+    links = [url]
+    while True:
+        response = client.get(links[-1])
+        assert response.status_code == 200, response.content
+        next_link = response.json()['next']
+        if not next_link:
+            break
+        links.append(next_link)
+    out(f"history: {entries} entries, {len(links)} pages of 50")
+
+    # both paginations through the same view: authentication, queries, serializer and rendering
+    factory = RequestFactory(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(user)}')
+    keyset_view, offset_view = DayEntryHistoryView.as_view(), _OffsetHistoryView.as_view()
+    last_offset = max(entries - 50, 0)
+    pages = (
+        ('keyset first', keyset_view, links[0]),
+        ('keyset middle', keyset_view, links[len(links) // 2]),
+        ('keyset last', keyset_view, links[-1]),
+        ('offset first', offset_view, f'{url}&offset=0'),
+        ('offset middle', offset_view, f'{url}&offset={last_offset // 2}'),
+        ('offset last', offset_view, f'{url}&offset={last_offset}'),
+    )
+    for label, view, link in pages:
+        stats = percentiles(measure(lambda: view(factory.get(link)).render(), repeat=30))
+        out(f"  {label:<14} {format_ms(stats)}")
+
+
+@scenario('export')
+def bench_export(out, scale=1.0):
+    """Streaming export: peak memory must not grow with history size."""
+    for entries in (int(10000 * scale), int(100000 * scale)):
+        user = seed_journal(f'export{entries}', entries, todos_per_entry=1)
+        for kind in ('ndjson', 'csv'):
+            tracemalloc.start()
+            started = time.perf_counter()
+            size = sum(len(chunk) for chunk in export_journal(user, kind))
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            out(
+                f"export {kind:<6} {entries:>7} entries: {size / 1e6:.1f} MB in {elapsed:.2f}s, "
+                f"peak python memory {peak / 1e6:.1f} MB"
+            )
+
+
+@scenario('import')
+def bench_import(out, scale=1.0):
+    """Batched import of NDJSON and CSV files."""
+    rows = int(100000 * scale)
+    seed_journal('moods', 0)
+    moods = ('happy', 'ok', 'sad')
+    start = datetime.date(1900, 1, 1)
+
+    ndjson = ''.join(
+        json.dumps({
+            'date': (start + datetime.timedelta(days=i)).isoformat(),
+            'mood': moods[i % 3],
+            'description': f'Imported day {i}',
+            'todos': [{'content': f'Task {i}', 'is_done': bool(i % 2)}],
+        }) + '\n'
+        for i in range(rows)
+    ).encode()
+    csv_data = ('date,mood,description,todo,todo_done\n' + ''.join(
+        f'{(start + datetime.timedelta(days=i)).isoformat()},{moods[i % 3]},Imported day {i},Task {i},false\n'
+        for i in range(rows)
+    )).encode()
+
+    for kind, data in (('ndjson', ndjson), ('csv', csv_data)):
+        user = User.objects.create_user(f'import-{kind}', f'import-{kind}@example.com', BENCH_PASSWORD)
+        started = time.perf_counter()
+        report = import_journal(user, io.BytesIO(data), kind)
+        elapsed = time.perf_counter() - started
+        out(
+            f"import {kind:<6} {rows} rows in {elapsed:.2f}s ({rows / elapsed:.0f} rows/s), "
+            f"{report['entries']} entries, {report['todos']} todos, {report['error_count']} errors"
+        )
+
+
+def zipf_sentences(rng):
+    """
+    Returns (sentence(length), vocabulary): a few frequent words and a long tail of rare ones (roughly Zipfian).
+    """
+    common = (
+        'walk dog run book read cook dinner meeting work gym swim call mom plan week shop market '
+        'garden clean paint write code review travel train bike coffee friend movie sleep yoga'
+    ).split()
+    vocabulary = common + [
+        ''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(4, 9))) for _ in range(20000)
+    ]
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+
+    def sentence(length):
+        return ' '.join(rng.choices(vocabulary, weights, k=length))
+
+    return sentence, vocabulary
+
+
+@scenario('search')
+def bench_search(out, scale=1.0):
+    """FTS5 search latency with ~1M indexed rows; per-user cost must not depend on the total."""
+    sentence, vocabulary = zipf_sentences(random.Random(42))
+    users_count, per_user = max(1, int(1000 * scale)), 500
+    users = User.objects.bulk_create([
+        User(username=f'search{i}', email=f'search{i}@example.com', password='!') for i in range(users_count)
+    ])
+    start = datetime.date(2000, 1, 1)
+    started = time.perf_counter()
+    for user in users:
+        days = DayEntry.objects.bulk_create([
+            DayEntry(user_id=user.pk, date=start + datetime.timedelta(days=i), description=sentence(20))
+            for i in range(per_user)
+        ])
+        TodoItem.objects.bulk_create([
+            TodoItem(user_id=user.pk, day_entry_id=day.pk, content=sentence(4)) for day in days
+        ])
+    out(f"search: indexed {users_count * per_user * 2} rows in {time.perf_counter() - started:.1f}s")
+
+    user = users[len(users) // 2]
+    for query in ('dog', 'wal', 'coffee friend', 'yoga sw', vocabulary[500]):
+        stats = percentiles(measure(lambda: search_journal(user.pk, query), repeat=50))
+        out(f"  q={query!r:<16} {format_ms(stats)}")
+
+
+class _BenchBucketThrottle(TokenBucketThrottle):
+    scope = 'bench'
+    rate = '100/hour'
+
+
+class _BenchCacheThrottle(AnonRateThrottle):
+    # DRF's history list in the default (per-process LocMem) cache
+    scope = 'bench'
+    rate = '100/hour'
+
+
+def _throttle_worker(args):
+    throttle_class, attempts = args
+    request = Request(RequestFactory().post('/api/token/', REMOTE_ADDR='203.0.113.7'))
+    allowed, started = 0, time.perf_counter()
+    for _ in range(attempts):
+        allowed += throttle_class().allow_request(request, None)
+    return allowed, (time.perf_counter() - started) / attempts
+
+
+@scenario('throttle')
+def bench_throttle(out, scale=1.0):
+    """Login throttle from several processes at once: the limit must hold globally."""
+    processes, attempts = 8, max(1, int(500 * scale))
+    with tempfile.TemporaryDirectory() as directory:
+        _BenchBucketThrottle.store = TokenBucketStore(os.path.join(directory, 'throttle.sqlite3'))
+        context = multiprocessing.get_context('fork')
+        for label, throttle_class in (('token bucket', _BenchBucketThrottle), ('drf cache', _BenchCacheThrottle)):
+            with context.Pool(processes) as pool:
+                results = pool.map(_throttle_worker, [(throttle_class, attempts)] * processes)
+            allowed = sum(count for count, _ in results)
+            per_check = statistics.fmean(seconds for _, seconds in results)
+            verdict = 'ok' if allowed <= 100 + 1 else 'LIMIT EXCEEDED'
+            out(
+                f"throttle {label:<12} {processes} processes x {attempts} attempts, limit 100/hour: "
+                f"{allowed} allowed ({verdict}), {per_check * 1e6:.0f}us per check"
+            )
+
+
+async def _login_burst(logins, probes):
+    client = AsyncClient()
+    latencies = []
+
+    async def login():
+        response = await client.post(
+            '/login/', {'username': 'burst', 'password': BENCH_PASSWORD}, content_type='application/json',
+        )
+        assert response.status_code == 200, response.content
+
+    async def probe():
+        await asyncio.sleep(0.05)
+        for _ in range(probes):
+            started = time.perf_counter()
+            await client.get('/api/moods/')
+            latencies.append(time.perf_counter() - started)
+            await asyncio.sleep(0.02)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)), probe())
+    return time.perf_counter() - started, latencies
+
+
+@scenario('login_burst')
+def bench_login_burst(out, scale=1.0):
+    """Burst of logins under ASGI: unrelated requests must not queue behind password hashing."""
+    logins, probes = max(1, int(16 * scale)), 20
+    User.objects.create_user('burst', 'burst@example.com', BENCH_PASSWORD)
+    seed_journal('moods', 0)
+    views = (
+        ('sync view', ThrottledTokenObtainPairView.as_view(throttle_classes=[])),
+        ('async view', AsyncTokenObtainPairView.as_view(throttle_classes=[])),
+    )
+    for label, view in views:
+        urlconf = ModuleType('login_burst_urls')
+        urlconf.urlpatterns = [path('login/', view), path('api/moods/', MoodListView.as_view())]
+        with override_settings(ROOT_URLCONF=urlconf):
+            elapsed, latencies = async_to_sync(_login_burst)(logins, probes)
+        out(f"login burst {label:<10} {logins} logins in {elapsed:.2f}s, /api/moods/ meanwhile: {format_ms(percentiles(latencies))}")
+
+
+# SQL queries allowed per request in the 'api' suite; they do not depend on the seeded history,
+# so an N+1 (e.g. the todos of DayEntrySerializer without prefetch_related) fails the run
+API_QUERY_BUDGETS = {
+    'POST /api/token/': 1,
+    'POST /api/register/': 11,
+    'GET /api/profile/': 2,
+    'PATCH /api/profile/': 6,
+    'GET /api/days/ (month)': 3,
+    'POST /api/days/': 7,
+    'PATCH /api/days/<pk>/': 7,
+    'GET /api/days/history/': 2,
+    'GET /api/todos/?day_entry=': 1,
+    'POST /api/todos/': 7,
+    'POST /api/days/<pk>/todos/bulk/': 22,
+    'GET /api/moods/': 0,
+    'GET /api/stats/': 2,
+    'GET /api/search/': 6,
+    'GET /api/export/ndjson/': 2,
+    'GET /api/sync/ (delta)': 4,
+}
+# password hashing dominates these, a few samples are enough
+API_SLOW_ENDPOINTS = {'POST /api/token/', 'POST /api/register/'}
+
+
+def seed_users(count, days, sentence, rng, start=datetime.date(2024, 1, 1)):
+    """
+    `count` users with `days` days of journal, 0-5 todos per day and sentences from zipf_sentences.
+    """
+    password = make_password(BENCH_PASSWORD)
+    users = User.objects.bulk_create([
+        User(username=f'user{i}', email=f'user{i}@example.com', password=password) for i in range(count)
+    ])
+    moods = seed_moods() + [None]
+    for user in users:
+        entries = DayEntry.objects.bulk_create(
+            [
+                DayEntry(
+                    user_id=user.pk,
+                    date=start + datetime.timedelta(days=i),
+                    mood=rng.choice(moods),
+                    description=sentence(rng.randint(5, 30)),
+                )
+                for i in range(days)
+            ],
+            batch_size=1000,
+        )
+        TodoItem.objects.bulk_create(
+            [
+                TodoItem(user_id=user.pk, day_entry_id=day.pk, content=sentence(rng.randint(2, 6)), is_done=rng.random() < 0.6)
+                for day in entries
+                for _ in range(rng.randint(0, 5))
+            ],
+            batch_size=1000,
+        )
+    return users
+
+
+def api_endpoints(user, day_entry, todo):
+    """
+    (name, method, url(i), body(i), authenticated?) for the 'api' scenario; `i` makes the written data unique.
+    """
+    month = f'from={day_entry.date.replace(day=1)}&to={day_entry.date.replace(day=28)}'
+    # a device that synced just now, it gets the writes of the endpoints above
+    since = sync.encode_token({kind: (timezone.now(), 0) for kind in sync.KINDS})
+    return [
+        ('POST /api/token/', 'post', lambda i: '/api/token/',
+         lambda i: {'username': user.username, 'password': BENCH_PASSWORD}, False),
+        ('POST /api/register/', 'post', lambda i: '/api/register/',
+         lambda i: {'username': f'new{i}', 'email': f'new{i}@example.com', 'password': BENCH_PASSWORD}, False),
+        ('GET /api/profile/', 'get', lambda i: '/api/profile/', None, True),
+        ('PATCH /api/profile/', 'patch', lambda i: '/api/profile/', lambda i: {'email': f'{user.username}.{i}@example.com'}, True),
+        ('GET /api/days/ (month)', 'get', lambda i: f'/api/days/?{month}', None, True),
+        ('POST /api/days/', 'post', lambda i: '/api/days/',
+         lambda i: {'date': str(datetime.date(2100, 1, 1) + datetime.timedelta(days=i)), 'description': f'new day {i}'}, True),
+        ('PATCH /api/days/<pk>/', 'patch', lambda i: f'/api/days/{day_entry.pk}/', lambda i: {'description': f'edited {i}'}, True),
+        ('GET /api/days/history/', 'get', lambda i: '/api/days/history/?limit=50', None, True),
+        ('GET /api/todos/?day_entry=', 'get', lambda i: f'/api/todos/?day_entry={day_entry.pk}', None, True),
+        ('POST /api/todos/', 'post', lambda i: '/api/todos/', lambda i: {'content': f'todo {i}', 'day_entry': day_entry.pk}, True),
+        ('POST /api/days/<pk>/todos/bulk/', 'post', lambda i: f'/api/days/{day_entry.pk}/todos/bulk/',
+         lambda i: {'create': [{'content': f'bulk {i}'}], 'update': [{'id': todo.pk, 'is_done': bool(i % 2)}]}, True),
+        ('GET /api/moods/', 'get', lambda i: '/api/moods/', None, False),
+        ('GET /api/stats/', 'get', lambda i: '/api/stats/?period=month', None, True),
+        ('GET /api/search/', 'get', lambda i: '/api/search/?q=walk', None, True),
+        ('GET /api/export/ndjson/', 'get', lambda i: '/api/export/ndjson/', None, True),
+        ('GET /api/sync/ (delta)', 'get', lambda i: f'/api/sync/?since={since}', None, True),
+    ]
+
+
+def call(client, method, url, body=None):
+    if body is None:
+        response = getattr(client, method)(url)
+    else:
+        response = getattr(client, method)(url, body, content_type='application/json')
+    if response.streaming:
+        b''.join(response.streaming_content)
+    return response
+
+
+class _ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class _QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def wsgi_server():
+    server = make_server(
+        '127.0.0.1', 0, get_wsgi_application(),
+        server_class=_ThreadingWSGIServer, handler_class=_QuietWSGIRequestHandler,
+    )
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1']):
+            yield server.server_port
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@contextlib.contextmanager
+def asgi_server():
+    import uvicorn
+    from django.core.asgi import get_asgi_application
+
+    server = uvicorn.Server(uvicorn.Config(get_asgi_application(), host='127.0.0.1', port=0, lifespan='off', log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, '127.0.0.1']):
+            yield server.servers[0].sockets[0].getsockname()[1]
+    finally:
+        server.should_exit = True
+        thread.join()
+
+
+def http_load(port, url, headers, total, concurrency):
+    """
+    `total` GET requests to a local server from `concurrency` threads; returns (time, latencies, errors).
+    """
+    errors = []
+
+    def send(i):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+        started = time.perf_counter()
+        try:
+            conn.request('GET', url(i), headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status >= 400:
+                errors.append(response.status)
+        finally:
+            conn.close()
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(send, range(total)))
+    return time.perf_counter() - started, latencies, errors
+
+
+@scenario('api')
+def bench_api(out, scale=1.0):
+    """Main endpoints: p50/p95/p99, req/s and SQL queries per request (budgets), test client and local servers."""
+    rng = random.Random(7)
+    sentence, _ = zipf_sentences(rng)
+    users_count, days, repeat = max(2, int(20 * scale)), 365, 30
+    started = time.perf_counter()
+    users = seed_users(users_count, days, sentence, rng)
+    out(f"api: seeded {users_count} users x {days} days in {time.perf_counter() - started:.1f}s")
+
+    user = users[0]
+    day_entry = DayEntry.objects.filter(user=user).order_by('date')[days // 2]
+    todo = TodoItem.objects.create(user=user, day_entry=day_entry, content='bench todo')
+    endpoints = api_endpoints(user, day_entry, todo)
+    clients = {False: Client(), True: auth_client(user)}
+    failures = []
+
+    out(f"  test client, {repeat} requests per endpoint (budget: queries per request)")
+    for name, method, url, body, authenticated in endpoints:
+        client = clients[authenticated]
+        requests_count = max(3, repeat // 6) if name in API_SLOW_ENDPOINTS else repeat
+        status_codes = set()
+
+        def send(i):
+            response = call(client, method, url(i), body(i) if body else None)
+            status_codes.add(response.status_code)
+
+        send(0)  # warm-up: user cache, mood catalog, prepared statements
+        with CaptureQueriesContext(connection) as queries:
+            send(1)
+        # the next request resets the query log the context slices
+        query_count = len(queries)
+        latencies = []
+        for i in range(2, requests_count + 2):
+            started = time.perf_counter()
+            send(i)
+            latencies.append(time.perf_counter() - started)
+        budget = API_QUERY_BUDGETS[name]
+        verdict = 'ok' if query_count <= budget else 'OVER BUDGET'
+        if query_count > budget:
+            failures.append(f"{name}: {query_count} queries, budget {budget}")
+        if max(status_codes) >= 400:
+            failures.append(f"{name}: unexpected status {sorted(status_codes)}")
+        out(
+            f"  {name:<32} {query_count:>2}/{budget:<2} queries {verdict:<11} "
+            f"{len(latencies) / sum(latencies):6.0f} req/s {format_ms(percentiles(latencies))}"
+        )
+
+    total, concurrency = max(20, int(200 * scale)), 8
+    headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+    servers = [('wsgi', wsgi_server)]
+    try:
+        import uvicorn  # noqa: F401
+        servers.append(('asgi', asgi_server))
+    except ImportError:
+        out("  asgi server skipped: uvicorn is not installed")
+    for label, server in servers:
+        out(f"  {label} server, {total} GET requests per endpoint at concurrency {concurrency}")
+        with server() as port:
+            for name, method, url, body, authenticated in endpoints:
+                if method != 'get':
+                    continue
+                elapsed, latencies, errors = http_load(port, url, headers if authenticated else {}, total, concurrency)
+                if errors:
+                    failures.append(f"{label} {name}: {len(errors)} failed requests, e.g. status {errors[0]}")
+                out(f"  {name:<32} {total / elapsed:6.0f} req/s {format_ms(percentiles(latencies))}")
+    return failures
+
+
+# extra time per request the metrics middleware may add, it stays on in production: 100us, or 1% of
+# slower requests, where the paired difference of a 10ms+ request varies by about that much between runs
+METRICS_OVERHEAD_BUDGET = 0.0001
+METRICS_OVERHEAD_SHARE = 0.01
+
+
+@contextlib.contextmanager
+def without_request_metrics():
+    middleware = [name for name in settings.MIDDLEWARE if name != 'api.metrics.RequestMetricsMiddleware']
+    connection.execute_wrappers.remove(record_query)
+    try:
+        with override_settings(MIDDLEWARE=middleware):
+            yield
+    finally:
+        connection.execute_wrappers.append(record_query)
+
+
+@scenario('metrics')
+def bench_metrics(out, scale=1.0):
+    """Overhead of the Server-Timing/metrics middleware and the query timer per request."""
+    pairs = max(100, int(1000 * scale))
+    user = seed_journal('metrics', 365, todos_per_entry=3)
+    # a client loads the middleware chain on its first request and keeps it
+    clients = {'on': auth_client(user), 'off': auth_client(user)}
+    clients['on'].get('/api/moods/')
+    with without_request_metrics():
+        clients['off'].get('/api/moods/')
+    failures = []
+
+    def timed_get(mode, url):
+        # the 'off' client has no metrics middleware, only the query timer has to go for its requests
+        if mode == 'off':
+            connection.execute_wrappers.remove(record_query)
+        try:
+            started = time.perf_counter()
+            clients[mode].get(url)
+            return time.perf_counter() - started
+        finally:
+            if mode == 'off':
+                connection.execute_wrappers.append(record_query)
+
+    for name, url in (('GET /api/moods/', '/api/moods/'), ('GET /api/days/ (month)', '/api/days/?from=2000-03-01&to=2000-03-28')):
+        timed_get('on', url), timed_get('off', url)
+        samples = {'on': [], 'off': []}
+        # one request of each mode per pair, in alternating order: drift (caches, WAL checkpoints,
+        # CPU frequency) hits both sides of a pair alike and drops out of the difference. A collection
+        # lands on one side only and costs more than the middleware (±60us between two identical
+        # clients with the collector on, ±6us with it off), so it is paused for the pairs.
+        gc.collect()
+        gc.disable()
+        try:
+            for i in range(pairs):
+                for mode in (('on', 'off') if i % 2 else ('off', 'on')):
+                    samples[mode].append(timed_get(mode, url))
+        finally:
+            gc.enable()
+        on, off = statistics.median(samples['on']), statistics.median(samples['off'])
+        overhead = statistics.median(a - b for a, b in zip(samples['on'], samples['off']))
+        budget = max(METRICS_OVERHEAD_BUDGET, off * METRICS_OVERHEAD_SHARE)
+        if overhead > budget:
+            failures.append(f"metrics {name}: {overhead * 1e6:.0f}us overhead, budget {budget * 1e6:.0f}us")
+        out(
+            f"metrics {name:<24} median on={on * 1000:.3f}ms off={off * 1000:.3f}ms "
+            f"overhead={overhead * 1e6:.0f}us ({overhead / off:.1%})"
+        )
+    return failures
+
+
+@contextlib.contextmanager
+def sqlite_alias(path, options):
+    """
+    A temporary database alias on the file `path` with the given OPTIONS; every thread gets its own connection.
+    """
+    alias = f'bench_sqlite_{len(connections.settings)}'
+    connections.settings[alias] = {**connections['default'].settings_dict, 'NAME': path, 'OPTIONS': options}
+    try:
+        yield alias
+    finally:
+        # the wrapper of this thread is cached under the alias, the next config reuses the name
+        connections[alias].close()
+        del connections[alias]
+        del connections.settings[alias]
+
+
+def _sqlite_writer(alias, stop, result):
+    conn = connections[alias]
+    try:
+        while not stop.is_set():
+            try:
+                # read-modify-write, like a view that checks something before saving
+                with transaction.atomic(using=alias), conn.cursor() as cursor:
+                    cursor.execute('SELECT total FROM bench_counter WHERE id = 1')
+                    total = cursor.fetchone()[0]
+                    time.sleep(0.001)
+                    cursor.execute('UPDATE bench_counter SET total = %s WHERE id = 1', [total + 1])
+                    cursor.executemany('INSERT INTO bench_log (body) VALUES (%s)', [[f'row {total} {i}'] for i in range(20)])
+                result['commits'] += 1
+            except OperationalError:
+                result['errors'] += 1
+    finally:
+        conn.close()
+
+
+def _sqlite_reader(alias, stop, result):
+    conn = connections[alias]
+    try:
+        while not stop.is_set():
+            started = time.perf_counter()
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute('SELECT count(*), max(id) FROM bench_log WHERE id > (SELECT max(id) - 100 FROM bench_log)')
+                    cursor.fetchone()
+                result['latencies'].append(time.perf_counter() - started)
+            except OperationalError:
+                result['errors'] += 1
+    finally:
+        conn.close()
+
+
+@scenario('sqlite')
+def bench_sqlite(out, scale=1.0):
+    """Concurrent writers and readers on a file database: default SQLite vs the DATABASES OPTIONS."""
+    writers, readers, seconds = 4, 4, max(1.0, 5 * scale)
+    configs = (
+        ('default', {}),
+        ('tuned', settings.DATABASES['default'].get('OPTIONS', {})),
+    )
+    for label, options in configs:
+        with tempfile.TemporaryDirectory() as directory, sqlite_alias(os.path.join(directory, 'bench.sqlite3'), options) as alias:
+            conn = connections[alias]
+            with conn.cursor() as cursor:
+                cursor.execute('CREATE TABLE bench_counter (id INTEGER PRIMARY KEY, total INTEGER NOT NULL)')
+                cursor.execute('CREATE TABLE bench_log (id INTEGER PRIMARY KEY, body TEXT NOT NULL)')
+                cursor.execute('INSERT INTO bench_counter VALUES (1, 0)')
+
+            stop = threading.Event()
+            write_results = [{'commits': 0, 'errors': 0} for _ in range(writers)]
+            read_results = [{'latencies': [], 'errors': 0} for _ in range(readers)]
+            threads = [threading.Thread(target=_sqlite_writer, args=(alias, stop, result)) for result in write_results]
+            threads += [threading.Thread(target=_sqlite_reader, args=(alias, stop, result)) for result in read_results]
+            for thread in threads:
+                thread.start()
+            time.sleep(seconds)
+            stop.set()
+            for thread in threads:
+                thread.join()
+
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT total FROM bench_counter WHERE id = 1')
+                total = cursor.fetchone()[0]
+            commits = sum(result['commits'] for result in write_results)
+            write_errors = sum(result['errors'] for result in write_results)
+            latencies = [latency for result in read_results for latency in result['latencies']]
+            read_errors = sum(result['errors'] for result in read_results)
+            out(
+                f"sqlite {label:<8} {writers} writers: {commits / seconds:6.0f} commits/s, {write_errors} 'database is locked', "
+                f"counter {total}/{commits}"
+            )
+            out(
+                f"sqlite {label:<8} {readers} readers: {len(latencies) / seconds:6.0f} reads/s, {read_errors} errors, "
+                f"{format_ms(percentiles(latencies or [0.0]))}"
+            )
+
+
+async def _sse_connection(app, token, events, disconnect):
+    """
+    One SSE connection straight to the ASGI app; `events` gets the arrival time of every event.
+    """
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/api/live/', 'raw_path': b'/api/live/', 'query_string': b'', 'root_path': '',
+        'headers': [(b'host', b'testserver'), (b'authorization', f'Bearer {token}'.encode())],
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    }
+    requested = False
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        await disconnect.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.body' and message.get('body', b'').startswith((b'retry', b'id:')):
+            events.put_nowait(time.perf_counter())
+
+    await app(scope, receive, send)
+
+
+@scenario('live')
+def bench_live(out, scale=1.0):
+    """Idle SSE connections: memory and CPU per connection, fan-out latency, compared with polling."""
+    from django.core.asgi import get_asgi_application
+
+    connections_count, users_count, poll_every = max(10, int(2000 * scale)), 10, 10
+    users = [seed_journal(f'live{i}', 7, todos_per_entry=3) for i in range(users_count)]
+    tokens = [str(AccessToken.for_user(user)) for user in users]
+    day_entry = DayEntry.objects.filter(user=users[0]).first()
+    failures = []
+
+    async def run():
+        app = get_asgi_application()
+        disconnect = asyncio.Event()
+        queues = [asyncio.Queue() for _ in range(connections_count)]
+        tracemalloc.start()
+        tasks = [
+            asyncio.create_task(_sse_connection(app, tokens[i % users_count], queues[i], disconnect))
+            for i in range(connections_count)
+        ]
+        await asyncio.gather(*(queue.get() for queue in queues))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        out(f"live: {live_hub.connection_count()} open connections, {memory / connections_count / 1024:.1f} KiB each")
+
+        cpu, wall = time.process_time(), time.perf_counter()
+        await asyncio.sleep(3)
+        idle = (time.process_time() - cpu) / (time.perf_counter() - wall)
+        out(f"  idle: {idle:.1%} of a CPU for all {connections_count} connections")
+
+        started = time.perf_counter()
+        await sync_to_async(TodoItem.objects.create)(user=users[0], day_entry=day_entry, content='from another device')
+        receivers = queues[::users_count]
+        arrivals = await asyncio.wait_for(asyncio.gather(*(queue.get() for queue in receivers)), 10)
+        out(
+            f"  fan-out to {len(receivers)} connections of one user: "
+            f"{format_ms(percentiles([arrival - started for arrival in arrivals]))}"
+        )
+        disconnect.set()
+        await asyncio.gather(*tasks)
+
+    with tempfile.TemporaryDirectory() as directory, \
+            mock.patch.object(live_hub, 'backend', SQLiteNotifyBackend(os.path.join(directory, 'live.sqlite3'))):
+        async_to_sync(run)()
+        left = live_hub.connection_count()
+        if left:
+            failures.append(f"live: {left} connections still subscribed after disconnect")
+    out(f"  after disconnect: {left} connections subscribed")
+
+    # the same devices polling the todo list instead
+    client = auth_client(users[0])
+    url = f'/api/todos/?day_entry={day_entry.pk}'
+    client.get(url)
+    cost = statistics.fmean(measure(lambda: client.get(url), repeat=50))
+    out(
+        f"  polling every {poll_every}s instead: {connections_count / poll_every:.0f} req/s x {cost * 1000:.2f}ms "
+        f"= {connections_count / poll_every * cost:.0%} of a CPU"
+    )
+    return failures
+
+
+@scenario('sync')
+def bench_sync(out, scale=1.0):
+    """Delta sync: the reconnect cost follows the number of changes, not the length of the history."""
+    client_changes, repeat = 10, 30
+    failures, delta_queries = [], set()
+    with mock.patch.object(sync, 'SYNC_SETTLE_SECONDS', 0):
+        for days in (max(10, int(30 * scale)), max(10, int(365 * scale)), max(10, int(3650 * scale))):
+            user = seed_journal(f'sync{days}', days, todos_per_entry=3)
+            client = auth_client(user)
+
+            started = time.perf_counter()
+            pages, token = 0, ''
+            while True:
+                data = client.get('/api/sync/', {'since': token, 'limit': sync.SYNC_MAX_BATCH_SIZE}).json()
+                pages, token = pages + 1, data['next']
+                if not data['has_more']:
+                    break
+            full = time.perf_counter() - started
+
+            # another device edits a few days and todos, then this one reconnects
+            for entry in DayEntry.objects.filter(user=user).order_by('?')[:client_changes // 2]:
+                entry.description += ' (edited)'
+                entry.save()
+            for todo in TodoItem.objects.filter(user=user).order_by('?')[:client_changes // 2]:
+                todo.is_done = not todo.is_done
+                todo.save()
+            client.get('/api/sync/', {'since': token})
+            with CaptureQueriesContext(connection) as queries:
+                data = client.get('/api/sync/', {'since': token}).json()
+            # the next request resets the query log the context slices
+            query_count = len(queries)
+            delta_queries.add(query_count)
+            changed = len(data['days']) + len(data['todos'])
+            if changed != client_changes:
+                failures.append(f"sync: {changed} changed rows after {client_changes} edits ({days} days)")
+            delta = percentiles(measure(lambda: client.get('/api/sync/', {'since': token}), repeat))
+            out(
+                f"sync: {days:>5} days x 3 todos  full sync {pages:>2} pages {full * 1000:8.1f}ms  "
+                f"delta of {changed} rows {query_count} queries {format_ms(delta)}"
+            )
+    if len(delta_queries) > 1:
+        failures.append(f"sync: delta query count depends on the history size: {sorted(delta_queries)}")
+    return failures
+
+
+@scenario('recurrence')
+def bench_recurrence(out, scale=1.0):
+    """Repeating todos: a year of occurrences for hundreds of rules, cold and cached, without writes."""
+    rules_count, repeat = max(10, int(300 * scale)), 30
+    rng = random.Random(21)
+    user = User.objects.create_user('recurring', 'recurring@example.com', BENCH_PASSWORD)
+    start = datetime.date(2020, 1, 1)
+    rules = RecurringTodo.objects.bulk_create([
+        RecurringTodo(
+            user=user,
+            content=f'Repeating task {i}',
+            freq=rng.choice([RecurringTodo.FREQ_DAILY, RecurringTodo.FREQ_WEEKLY, RecurringTodo.FREQ_MONTHLY]),
+            interval=rng.choice([1, 1, 2, 3]),
+            start_date=start + datetime.timedelta(days=rng.randint(0, 1500)),
+            weekdays=rng.randint(0, 127),
+            count=rng.choice([None, None, None, rng.randint(10, 500)]),
+        )
+        for i in range(rules_count)
+    ])
+    for rule in rules:
+        if rule.freq != RecurringTodo.FREQ_WEEKLY:
+            rule.weekdays = 0
+    RecurringTodo.objects.bulk_update(rules, ['weekdays'])
+    year = (datetime.date(2025, 1, 1), datetime.date(2025, 12, 31))
+    RecurringTodoOverride.objects.bulk_create([
+        RecurringTodoOverride(rule=rule, date=year[0] + datetime.timedelta(days=rng.randint(0, 364)), is_done=True)
+        for rule in rules
+    ], ignore_conflicts=True)
+    client = auth_client(user)
+    url = f'/api/recurring/occurrences/?from={year[0]}&to={year[1]}'
+    failures = []
+
+    client.get(url)  # warm-up: user cache, data version row
+    occurrence_cache.clear()
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get(url)
+    # the next request resets the query log the context slices
+    writes = [query['sql'] for query in queries if not query['sql'].startswith('SELECT')]
+    query_count = len(queries)
+    occurrences = len(response.json())
+    if writes:
+        failures.append(f"recurrence: expanding occurrences wrote to the database: {writes[0][:80]}")
+
+    def cold():
+        occurrence_cache.clear()
+        client.get(url)
+
+    cold_stats = percentiles(measure(cold, repeat))
+    warm_stats = percentiles(measure(lambda: client.get(url), repeat))
+    engine_stats = percentiles(measure(lambda: (occurrence_cache.clear(), occurrence_cache.occurrences(user.pk, 0, *year)), repeat))
+    out(f"recurrence: {rules_count} rules, {occurrences} occurrences in {year[0].year} ({query_count} queries, no rows stored)")
+    out(f"  API cold      {format_ms(cold_stats)}")
+    out(f"  API cached    {format_ms(warm_stats)}")
+    out(f"  engine only   {format_ms(engine_stats)}")
+    return failures
+
+
+@scenario('reminders')
+def bench_reminders(out, scale=1.0):
+    """Reminder scheduler: window loads from the partial index, idle ticks, catch-up after downtime, crash safety."""
+    pending, sent, overdue = max(1000, int(200000 * scale)), max(500, int(100000 * scale)), max(100, int(5000 * scale))
+    rng = random.Random(22)
+    now = timezone.now()
+    users = User.objects.bulk_create([
+        User(username=f'remind{i}', email=f'remind{i}@example.com', password='!') for i in range(50)
+    ])
+    started = time.perf_counter()
+    TodoItem.objects.bulk_create(
+        [
+            TodoItem(user=rng.choice(users), content=f'Reminder {i}', remind_at=now + datetime.timedelta(seconds=rng.randint(60, 30 * 86400)))
+            for i in range(pending)
+        ]
+        + [
+            TodoItem(user=rng.choice(users), content=f'Overdue {i}', remind_at=now - datetime.timedelta(seconds=rng.randint(1, 86400)))
+            for i in range(overdue)
+        ]
+        + [
+            TodoItem(user=rng.choice(users), content=f'Sent {i}', remind_at=now - datetime.timedelta(days=1), reminder_sent_at=now)
+            for i in range(sent)
+        ],
+        batch_size=2000,
+    )
+    out(
+        f"reminders: {pending} pending, {overdue} overdue, {sent} sent reminders "
+        f"seeded in {time.perf_counter() - started:.1f}s"
+    )
+    failures = []
+
+    plan = pending_reminders().filter(remind_at__lte=now).order_by('remind_at').values_list('pk', 'remind_at').explain()
+    if 'todoitem_reminder_due_idx' not in plan:
+        failures.append(f"reminders: the window query does not use the partial index: {plan}")
+
+    # a crash between claiming and queueing the emails leaves nothing half done
+    scheduler = ReminderScheduler()
+    with mock.patch.object(OutgoingEmail.objects, 'bulk_create', side_effect=OperationalError('crash')):
+        try:
+            scheduler.tick(now)
+        except OperationalError:
+            pass
+    if pending_reminders().filter(remind_at__lte=now).count() != overdue or OutgoingEmail.objects.exists():
+        failures.append("reminders: a failed batch left reminders marked as sent")
+
+    # catch-up after downtime: a fresh process finds every overdue reminder
+    scheduler = ReminderScheduler()
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        delivered = scheduler.tick(now)
+        elapsed = time.perf_counter() - started
+    query_count = len(queries)
+    emails = OutgoingEmail.objects.count()
+    if delivered != overdue or emails != overdue:
+        failures.append(f"reminders: {overdue} overdue, {delivered} delivered, {emails} emails queued")
+    out(
+        f"  catch-up: {delivered} overdue reminders into the outbox in {elapsed * 1000:.0f}ms "
+        f"({delivered / elapsed:.0f}/s, {query_count} queries incl. the window load)"
+    )
+    out(f"  heap after the first load: {len(scheduler.heap)} reminders due within {scheduler.window}")
+
+    load_stats = percentiles(measure(lambda: ReminderScheduler().load(now), 10))
+    out(f"  window load: {format_ms(load_stats)}")
+    with CaptureQueriesContext(connection) as queries:
+        for second in range(1, 30):
+            scheduler.run_pending(now + datetime.timedelta(seconds=second))
+    idle_queries = len(queries)
+    # nothing is due in the first minute (seeded from now + 60s), the table is not read between reloads
+    if idle_queries:
+        failures.append(f"reminders: {idle_queries} queries in 30 idle seconds")
+    out(f"  30 idle ticks between reloads: {idle_queries} queries")
+    poll = percentiles(measure(lambda: list(
+        TodoItem.objects.filter(remind_at__lte=now).exclude(reminder_sent_at__isnull=False).values_list('pk')
+    ), 10))
+    out(f"  for comparison, one poll of the whole table without the index: {format_ms(poll)}")
+    return failures
+
+
+@scenario('purge')
+def bench_purge(out, scale=1.0):
+    """Account deletion: DELETE /api/profile/ returns at once, the purge holds the write lock one batch at a time."""
+    entries = max(100, int(3650 * scale))
+    inline = seed_journal('purge_inline', entries, todos_per_entry=5)
+    closed = seed_journal('purge_closed', entries, todos_per_entry=5)
+    bystander = seed_journal('purge_bystander', 30, todos_per_entry=2)
+    rows = DayEntry.objects.filter(user=closed).count() + TodoItem.objects.filter(user=closed).count()
+    out(f"purge: two users with {entries} days and {rows} journal rows each")
+    failures = []
+
+    # the previous behaviour: one cascade in one transaction
+    started = time.perf_counter()
+    with transaction.atomic():
+        inline.delete()
+    out(f"  inline user.delete(): {(time.perf_counter() - started) * 1000:.0f}ms in one transaction")
+
+    client = auth_client(closed)
+    with CaptureQueriesContext(connection) as queries:
+        started = time.perf_counter()
+        response = client.delete('/api/profile/')
+        elapsed = time.perf_counter() - started
+    query_count = len(queries)
+    if response.status_code != 204:
+        failures.append(f"purge: DELETE /api/profile/ returned {response.status_code}")
+    out(f"  DELETE /api/profile/: {elapsed * 1000:.1f}ms, {query_count} queries")
+
+    batches = []
+    delete_batch = purge._delete_batch
+
+    def timed_batch(queryset, batch_size):
+        started = time.perf_counter()
+        count = delete_batch(queryset, batch_size)
+        batches.append(time.perf_counter() - started)
+        return count
+
+    with mock.patch.object(purge, '_delete_batch', timed_batch):
+        started = time.perf_counter()
+        stats = purge.run_purges(pause=0)
+        elapsed = time.perf_counter() - started
+    out(
+        f"  purge_accounts: {stats['rows']} rows in {elapsed * 1000:.0f}ms, {len(batches)} transactions, "
+        f"longest {max(batches) * 1000:.1f}ms {format_ms(percentiles(batches))}"
+    )
+    if stats['accounts'] != 1 or User.objects.filter(pk=closed.pk).exists():
+        failures.append(f"purge: the closed account was not purged ({stats})")
+    if TodoItem.objects.filter(user=bystander).count() != 60 or DayEntry.objects.filter(user=bystander).count() != 30:
+        failures.append("purge: another user's journal changed")
+    return failures
+
+
+@scenario('media')
+def bench_media(out, scale=1.0):
+    """Content-addressed avatars: disk use of repeated uploads, files left after replacing, cache headers."""
+    users_count = max(20, int(300 * scale))
+    rng = random.Random(24)
+    # a few popular pictures (default-like icons, memes) and a long tail of unique ones
+    pool = []
+    for i in range(40):
+        buffer = io.BytesIO()
+        Image.frombytes('RGB', (96, 96), rng.randbytes(96 * 96 * 3)).save(buffer, 'PNG')
+        pool.append(buffer.getvalue())
+    weights = [1 / (rank + 1) for rank in range(len(pool))]
+    users = User.objects.bulk_create([User(username=f'avatar{i}', email=f'avatar{i}@example.com') for i in range(users_count)])
+    failures = []
+
+    with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root), \
+            mock.patch('api.thumbnails.submit'), mock.patch.object(media, 'MEDIA_GC_GRACE_SECONDS', 0):
+        uploaded, latencies = 0, []
+        # everyone uploads a picture, then half of them replace it
+        for user in users + users[::2]:
+            image = rng.choices(pool, weights)[0]
+            client = auth_client(user)
+            started = time.perf_counter()
+            # Client.patch() does not encode multipart bodies itself
+            body = encode_multipart(BOUNDARY, {'profile_picture': SimpleUploadedFile('avatar.png', image)})
+            response = client.patch('/api/profile/', body, content_type=MULTIPART_CONTENT)
+            latencies.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                failures.append(f"media: PATCH /api/profile/ returned {response.status_code}")
+                break
+            uploaded += len(image)
+        files = [os.path.join(root, name) for root, _, names in os.walk(media_root) for name in names]
+        on_disk = sum(os.path.getsize(path) for path in files)
+        referenced = set(UserProfile.objects.values_list('profile_picture', flat=True))
+        out(
+            f"media: {len(latencies)} uploads by {users_count} users, {uploaded / 1e6:.1f} MB uploaded, "
+            f"{on_disk / 1e6:.2f} MB in {len(files)} files on disk"
+        )
+        out(f"  upload {format_ms(percentiles(latencies))}")
+        if len(files) != len(referenced):
+            failures.append(f"media: {len(files)} files on disk for {len(referenced)} referenced pictures")
+        counted = sum(StoredFile.objects.values_list('refcount', flat=True))
+        if counted != users_count:
+            failures.append(f"media: reference counts add up to {counted}, {users_count} profiles")
+
+        url = response.json()['profile_picture'].split('testserver', 1)[1]
+        client = Client()
+        response = client.get(url)
+        cache_control = response.get('Cache-Control', '')
+        out(f"  GET {url[:40]}...: {response.status_code}, Cache-Control: {cache_control}")
+        if 'immutable' not in cache_control:
+            failures.append(f"media: avatar served without immutable caching ({cache_control})")
+        stats = percentiles(measure(lambda: b''.join(client.get(url).streaming_content), 30))
+        out(f"  fetch from the server (first load only) {format_ms(stats)}")
+    return failures
+
+
+@scenario('passwords')
+def bench_passwords(out, scale=1.0):
+    """Breached passwords filter: build time, size, lookup latency, memory and false positive rate."""
+    count = max(10000, int(500000 * scale))
+    rng = random.Random(25)
+    breached = [f'{rng.getrandbits(40):x}Aa1!' for _ in range(count)]
+    failures = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'breached.bloom')
+        started = time.perf_counter()
+        stats = passwords.build_bloom_filter((passwords.password_digest(word) for word in breached), count, path)
+        out(
+            f"passwords: {count} breached passwords, filter of {stats['bytes'] / 1e6:.2f} MB with "
+            f"{stats['hashes']} hashes built in {time.perf_counter() - started:.1f}s"
+        )
+
+        tracemalloc.start()
+        validator = passwords.BreachedPasswordValidator(path)
+        validator.passwords.get()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # the previous check: Django's list of 20k common passwords, loaded into every process
+        tracemalloc.start()
+        common = CommonPasswordValidator()
+        common_memory = tracemalloc.get_traced_memory()[0]
+        in_memory = {passwords.password_digest(word) for word in breached}
+        set_memory = tracemalloc.get_traced_memory()[0] - common_memory
+        tracemalloc.stop()
+        del common, in_memory
+        out(
+            f"  Python heap per process: {memory / 1e3:.1f} kB for the mapped filter, "
+            f"{set_memory / 1e6:.1f} MB for a set of the same digests, "
+            f"{common_memory / 1e6:.1f} MB for CommonPasswordValidator (20k passwords)"
+        )
+
+        sample = rng.sample(breached, min(count, 20000))
+        missed = sum(word not in validator.passwords for word in sample)
+        if missed:
+            failures.append(f"passwords: {missed} breached passwords not found")
+
+        def check(word):
+            try:
+                validator.validate(word)
+            except ValidationError:
+                pass
+
+        latencies = []
+        for word in sample[:2000] + [f'{i}-Fresh-passw0rd' for i in range(2000)]:
+            started = time.perf_counter()
+            check(word)
+            latencies.append(time.perf_counter() - started)
+        out("  validate() " + ' '.join(f"{key}={value * 1e6:.1f}us" for key, value in percentiles(latencies).items()))
+
+        trials = 100000
+        false_positives = sum(f'{i}-Fresh-passw0rd' in validator.passwords for i in range(trials))
+        rate = false_positives / trials
+        out(f"  false positives: {rate:.4%} (target {passwords.BREACHED_PASSWORDS_FP_RATE:.2%})")
+        if rate > passwords.BREACHED_PASSWORDS_FP_RATE * 2:
+            failures.append(f"passwords: false positive rate {rate:.4%}")
+    return failures
@@ -0,0 +1,84 @@
+import hashlib
+import json
+import threading
+import time
+
+from django.conf import settings
+
+from .models import Mood
+
+# other workers only see mood changes after this many seconds
+MOOD_CATALOG_TTL = getattr(settings, 'MOOD_CATALOG_TTL', 300)
+# a lookup that misses reloads the catalog, at most once per this many seconds:
+# the mood may have been added through another worker
+MOOD_CATALOG_MISS_RELOAD = getattr(settings, 'MOOD_CATALOG_MISS_RELOAD', 1)
+
+
+class CatalogSnapshot:
+    def __init__(self, version, moods):
+        self.version = version
+        self.moods = {mood.pk: mood for mood in moods}
+        self.data = [{'id': mood.pk, 'name': mood.name, 'icon': mood.icon} for mood in moods]
+        self.by_id = {item['id']: item for item in self.data}
+        self.by_name = {mood.name.strip().lower(): mood for mood in moods}
+        payload = json.dumps(self.data, sort_keys=True, ensure_ascii=False).encode()
+        self.etag = '"%s"' % hashlib.sha256(payload).hexdigest()[:32]
+        self.loaded_at = time.monotonic()
+
+
+class MoodCatalog:
+    """
+    The Mood table, cached in the process memory.
+    Reloaded after a Mood change (signals, see signals.py), after MOOD_CATALOG_TTL, or when a lookup
+    misses. Other workers only learn about a change from the last two: a new mood is found at once,
+    a renamed one keeps its old name until the TTL, a deleted one is caught by the FK check of the
+    write that uses it (DayEntryWriteSerializer.save).
+    """
+
+    def __init__(self, ttl=MOOD_CATALOG_TTL):
+        self.ttl = ttl
+        self.version = 0
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def snapshot(self):
+        snapshot = self._snapshot
+        if snapshot is None or time.monotonic() - snapshot.loaded_at > self.ttl:
+            with self._lock:
+                snapshot = self._snapshot
+                if snapshot is None or time.monotonic() - snapshot.loaded_at > self.ttl:
+                    version = self.version
+                    snapshot = CatalogSnapshot(version, list(Mood.objects.order_by('id')))
+                    # a concurrent invalidate() wins over what we just read
+                    if version == self.version:
+                        self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+            self._snapshot = None
+
+    def reload(self):
+        self.invalidate()
+        return self.snapshot()
+
+    def _lookup(self, index, key):
+        snapshot = self.snapshot()
+        found = getattr(snapshot, index).get(key)
+        if found is None and time.monotonic() - snapshot.loaded_at > MOOD_CATALOG_MISS_RELOAD:
+            found = getattr(self.reload(), index).get(key)
+        return found
+
+    def get(self, pk):
+        return self._lookup('moods', pk)
+
+    def get_by_name(self, name):
+        return self._lookup('by_name', name.strip().lower())
+
+    def representation(self, pk):
+        item = self._lookup('by_id', pk)
+        return dict(item) if item is not None else None
+
+
+mood_catalog = MoodCatalog()
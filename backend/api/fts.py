@@ -0,0 +1,49 @@
+"""
+Triggers that keep the full-text search table api_journal_fts (search.py, migration 0007) in sync
+with api_dayentry and api_todoitem.
+
+SQLite drops a table's triggers whenever a migration rebuilds the table (e.g. to add a column), so every
+such migration creates them again. Migrations carry a frozen copy of the SQL; TRIGGERS is the current
+definition, which a new migration copies and which the tests compare the migrated database with.
+
+rowid = user_id << USER_SHIFT | id << 1 | kind (0 = DayEntry, 1 = TodoItem). Rowids are signed 64-bit,
+so rows with an id from MAX_ID or a user id from MAX_USER_ID on do not fit and are not indexed.
+"""
+
+USER_SHIFT = 36
+MAX_ID = 1 << (USER_SHIFT - 1)
+MAX_USER_ID = 1 << (63 - USER_SHIFT)
+
+
+def _rowid(row, kind):
+    return f'({row}.user_id << {USER_SHIFT}) | ({row}.id << 1) | {kind}'
+
+
+def _fits(row):
+    return f'{row}.id < {MAX_ID} AND {row}.user_id < {MAX_USER_ID}'
+
+
+def _table_triggers(table, column, kind):
+    return [
+        f"""
+        CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table}
+        WHEN new.{column} != '' AND {_fits('new')} BEGIN
+            INSERT INTO api_journal_fts (rowid, body) VALUES ({_rowid('new', kind)}, new.{column});
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {column}, user_id ON {table} BEGIN
+            DELETE FROM api_journal_fts WHERE rowid = {_rowid('old', kind)};
+            INSERT INTO api_journal_fts (rowid, body)
+                SELECT {_rowid('new', kind)}, new.{column} WHERE new.{column} != '' AND {_fits('new')};
+        END
+        """,
+        f"""
+        CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+            DELETE FROM api_journal_fts WHERE rowid = {_rowid('old', kind)};
+        END
+        """,
+    ]
+
+
+TRIGGERS = _table_triggers('api_dayentry', 'description', 0) + _table_triggers('api_todoitem', 'content', 1)
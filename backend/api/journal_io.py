@@ -0,0 +1,323 @@
+"""
+Export and import of a user's journal: DayEntry with its mood and its TodoItems.
+
+Formats:
+- ndjson: one entry per line, todos nested in "todos",
+- csv: one row per todo (an entry without todos is one row with empty todo columns).
+"""
+import csv
+import datetime
+import io
+import json
+from collections import defaultdict
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+
+from .catalog import mood_catalog
+from .models import DayEntry, TodoItem, Tombstone
+from .signals import bulk_write
+from .sync import delete_with_tombstones
+
+EXPORT_CHUNK_SIZE = getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+EXPORT_BUFFER_BYTES = 64 * 1024
+IMPORT_BATCH_SIZE = getattr(settings, 'IMPORT_BATCH_SIZE', 2000)
+IMPORT_MAX_REPORTED_ERRORS = 1000
+
+CSV_COLUMNS = ['date', 'mood', 'description', 'todo', 'todo_done']
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def export_entries(user):
+    """
+    Yields (date, mood_id, description, todos) for every entry, ordered by date.
+    Entries are read in chunks of EXPORT_CHUNK_SIZE, the todos with one query per chunk,
+    without creating model instances.
+    """
+    entries = (
+        DayEntry.objects
+        .filter(user=user)
+        .order_by('date', 'id')
+        .values_list('id', 'date', 'mood_id', 'description')
+        .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    )
+    while True:
+        chunk = list(islice(entries, EXPORT_CHUNK_SIZE))
+        if not chunk:
+            return
+        todos = defaultdict(list)
+        rows = (
+            TodoItem.objects
+            .filter(day_entry_id__in=[pk for pk, *_ in chunk])
+            .order_by('id')
+            .values_list('day_entry_id', 'content', 'is_done')
+        )
+        for day_entry_id, content, is_done in rows:
+            todos[day_entry_id].append((content, is_done))
+        for pk, date, mood_id, description in chunk:
+            yield date, mood_id, description, todos.get(pk, ())
+
+
+def mood_name(mood_id):
+    mood = mood_catalog.representation(mood_id) if mood_id else None
+    return mood['name'] if mood else None
+
+
+def iter_ndjson(user):
+    for date, mood_id, description, todos in export_entries(user):
+        yield json.dumps({
+            'date': date.isoformat(),
+            'mood': mood_name(mood_id),
+            'description': description,
+            'todos': [{'content': content, 'is_done': is_done} for content, is_done in todos],
+        }, ensure_ascii=False) + '\n'
+
+
+class _Echo:
+    # csv.writer needs a file-like object, this one just hands the line back
+    def write(self, value):
+        return value
+
+
+def iter_csv(user):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_COLUMNS)
+    for date, mood_id, description, todos in export_entries(user):
+        row = [date.isoformat(), mood_name(mood_id) or '', description]
+        if not todos:
+            yield writer.writerow(row + ['', ''])
+        for content, is_done in todos:
+            yield writer.writerow(row + [content, 'true' if is_done else 'false'])
+
+
+def buffered(lines, size=EXPORT_BUFFER_BYTES):
+    # fewer, bigger chunks for the server than one write per row
+    buffer, length = [], 0
+    for line in lines:
+        buffer.append(line)
+        length += len(line)
+        if length >= size:
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def export_journal(user, kind):
+    lines = iter_ndjson(user) if kind == 'ndjson' else iter_csv(user)
+    return buffered(lines)
+
+
+async def aiterate(chunks):
+    """
+    Async iterator over a sync generator of chunks, pulled one chunk per hop to the sync thread.
+    Under ASGI, StreamingHttpResponse consumes a sync iterator with sync_to_async(list),
+    i.e. it builds the whole export in memory before the first byte goes out.
+    """
+    pull = sync_to_async(next, thread_sensitive=True)
+    try:
+        while True:
+            chunk = await pull(chunks, None)
+            if chunk is None:
+                return
+            yield chunk
+    finally:
+        # client went away: the generator closes its DB cursor in the thread that opened it
+        await sync_to_async(chunks.close, thread_sensitive=True)()
+
+
+# --- import ---
+
+class ImportRowError(ValueError):
+    pass
+
+
+def parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value or '').strip().lower()
+    if value in ('true', '1', 'yes', 'y', 'x'):
+        return True
+    if value in ('false', '0', 'no', 'n', ''):
+        return False
+    raise ImportRowError(f"Invalid boolean value '{value}'.")
+
+
+def parse_record(record):
+    """
+    Turns a raw record (from NDJSON or a CSV row) into (date, mood, description, todos).
+    """
+    if not isinstance(record, dict):
+        raise ImportRowError("Expected an object.")
+    try:
+        date = datetime.date.fromisoformat(str(record.get('date') or '').strip())
+    except ValueError:
+        raise ImportRowError(f"Invalid date '{record.get('date')}'.")
+
+    mood = None
+    name = (record.get('mood') or '').strip()
+    if name:
+        mood = mood_catalog.get_by_name(name)
+        if mood is None:
+            raise ImportRowError(f"Unknown mood '{name}'.")
+
+    description = record.get('description') or ''
+    if not isinstance(description, str):
+        raise ImportRowError("Description must be a string.")
+
+    todos = []
+    for todo in record.get('todos') or []:
+        if not isinstance(todo, dict) or not str(todo.get('content') or '').strip():
+            raise ImportRowError("Each todo needs a content.")
+        content = str(todo['content']).strip()
+        if len(content) > 255:
+            raise ImportRowError("Todo content cannot be longer than 255 characters.")
+        todos.append((content, parse_bool(todo.get('is_done'))))
+    return date, mood, description, todos
+
+
+def read_ndjson(lines):
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as exc:
+            yield number, ImportRowError(f"Invalid JSON: {exc}")
+
+
+def read_csv(lines):
+    reader = csv.DictReader(lines)
+    for row in reader:
+        todo = (row.get('todo') or '').strip()
+        record = {
+            'date': row.get('date'),
+            'mood': row.get('mood'),
+            'description': row.get('description'),
+            'todos': [{'content': todo, 'is_done': row.get('todo_done')}] if todo else [],
+        }
+        yield reader.line_num, record
+
+
+class JournalImporter:
+    """
+    Imports entries in chunks of IMPORT_BATCH_SIZE, each chunk in its own transaction:
+    DayEntry is upserted on (user, date) with one INSERT ... ON CONFLICT, todos with bulk_create.
+    Invalid rows are skipped and reported, and so is a chunk the database rejects; the import goes on.
+
+    A day that has todos in the file gets exactly those (importing the same file twice duplicates nothing);
+    days without todos in the file keep the ones they have.
+    """
+
+    def __init__(self, user, batch_size=IMPORT_BATCH_SIZE):
+        self.user = user
+        self.batch_size = batch_size
+        self.rows = 0
+        self.todos = 0
+        self.error_count = 0
+        self.errors = []
+        self._seen_dates = set()
+        self._replaced_todo_dates = set()
+
+    def add_error(self, line, message):
+        self.error_count += 1
+        if len(self.errors) < IMPORT_MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'error': message})
+
+    def run(self, records):
+        with bulk_write(DayEntry, self.user.pk) as dates:
+            batch = []
+            for line, record in records:
+                self.rows += 1
+                try:
+                    if isinstance(record, ImportRowError):
+                        raise record
+                    batch.append((line, parse_record(record)))
+                except ImportRowError as exc:
+                    self.add_error(line, str(exc))
+                    continue
+                if len(batch) >= self.batch_size:
+                    self.flush(batch)
+                    batch = []
+            if batch:
+                self.flush(batch)
+            dates.update(self._seen_dates)
+        return self.report()
+
+    def flush(self, batch):
+        try:
+            self.write(batch)
+        except DatabaseError as exc:
+            if isinstance(exc, IntegrityError):
+                # most likely a mood another worker deleted, the next chunks look them up again
+                mood_catalog.invalidate()
+            # the chunk's transaction is rolled back, the chunks before and after it still count
+            first, last = batch[0][0], batch[-1][0]
+            self.add_error(first, f"Lines {first}-{last} were not imported: {exc}")
+
+    def write(self, batch):
+        # rows of the same day (CSV has one per todo) are merged, the last mood/description wins
+        days = {}
+        for _, (date, mood, description, todos) in batch:
+            day = days.setdefault(date, {'mood': None, 'description': '', 'todos': []})
+            if mood is not None:
+                day['mood'] = mood
+            if description:
+                day['description'] = description
+            day['todos'].extend(todos)
+
+        with transaction.atomic():
+            entries = DayEntry.objects.bulk_create(
+                [
+                    DayEntry(user_id=self.user.pk, date=date, mood=day['mood'], description=day['description'])
+                    for date, day in days.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['user', 'date'],
+                update_fields=['mood', 'description', 'updated_at'],
+            )
+            # only days that bring todos replace theirs, the first time the file has some for that day
+            replaced = [
+                entry for entry in entries
+                if days[entry.date]['todos'] and entry.date not in self._replaced_todo_dates
+            ]
+            if replaced:
+                delete_with_tombstones(
+                    TodoItem.objects.filter(day_entry_id__in=[entry.pk for entry in replaced]), Tombstone.KIND_TODO,
+                )
+            todos = TodoItem.objects.bulk_create(
+                [
+                    TodoItem(user_id=self.user.pk, day_entry_id=entry.pk, content=content, is_done=is_done)
+                    for entry in entries
+                    for content, is_done in days[entry.date]['todos']
+                ],
+                batch_size=self.batch_size,
+            )
+
+        self._seen_dates.update(days)
+        self._replaced_todo_dates.update(entry.date for entry in replaced)
+        self.todos += len(todos)
+
+    def report(self):
+        return {
+            'rows': self.rows,
+            'entries': len(self._seen_dates),
+            'todos': self.todos,
+            'error_count': self.error_count,
+            'errors': self.errors,
+        }
+
+
+def import_journal(user, stream, kind, batch_size=IMPORT_BATCH_SIZE):
+    """
+    Imports a file (a byte stream) in the 'ndjson' or 'csv' format, reading it line by line.
+    """
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    records = read_ndjson(lines) if kind == 'ndjson' else read_csv(lines)
+    return JournalImporter(user, batch_size).run(records)
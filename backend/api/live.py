@@ -0,0 +1,388 @@
+"""
+Live journal changes (Server-Sent Events, /api/live/) for all open devices of a user.
+
+The DayEntry/TodoItem signals (signals.py) call live_hub.publish() after the commit. The backend carries
+the event to the processes with open connections:
+- 'local': directly, within one process only,
+- 'sqlite': a live_event table in the shared file LIVE_DB_PATH, read by every process each
+  LIVE_POLL_INTERVAL (one query per process, not per connection); it keeps events for
+  LIVE_RETENTION seconds, so a reconnecting client gets what it missed (Last-Event-ID).
+  Every process that writes uses it (WSGI workers, management commands), not only the ASGI ones.
+  A live_listener table says which users have a stream open somewhere, so writes for everybody
+  else cost one read instead of an insert.
+
+One thread per process fans events and heartbeats out to the connection queues and renews the
+listener rows; an idle connection is only a queue and a suspended generator, no timers and no queries.
+On every heartbeat a stream checks that its user may still read (stream_authorization()), a password
+change, a deactivation or a deletion closes it within LIVE_HEARTBEAT seconds.
+"""
+import asyncio
+import datetime
+import hashlib
+import itertools
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from .authentication import user_cache
+from .models import LiveTicket
+
+User = get_user_model()
+
+# 'local' only works when one process serves every request: writes elsewhere never reach its streams
+LIVE_BACKEND = getattr(settings, 'LIVE_BACKEND', 'sqlite')
+LIVE_DB_PATH = getattr(settings, 'LIVE_DB_PATH', os.path.join(settings.BASE_DIR, 'live.sqlite3'))
+LIVE_POLL_INTERVAL = getattr(settings, 'LIVE_POLL_INTERVAL', 0.2)
+LIVE_HEARTBEAT = getattr(settings, 'LIVE_HEARTBEAT', 15)
+LIVE_RETENTION = getattr(settings, 'LIVE_RETENTION', 300)
+# a listener row outlives a crashed process by this long; live ones are renewed every heartbeat
+LIVE_LISTENER_TTL = 3 * LIVE_HEARTBEAT
+# a client this far behind gets 'resync' and refetches instead of an ever growing queue
+LIVE_QUEUE_SIZE = 100
+LIVE_PRUNE_EVERY = 1000
+# EventSource reconnect delay, ms
+LIVE_RETRY = 3000
+# a stream ticket has to be used within this many seconds
+LIVE_TICKET_TTL = getattr(settings, 'LIVE_TICKET_TTL', 30)
+
+PING = object()
+OVERFLOW = object()
+
+
+class Subscription:
+    __slots__ = ('user_id', 'loop', 'queue')
+
+    def __init__(self, user_id, loop):
+        self.user_id = user_id
+        self.loop = loop
+        self.queue = asyncio.Queue(LIVE_QUEUE_SIZE)
+
+    def put(self, event):
+        # runs on the subscription's event loop
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            if event is not PING:
+                while not self.queue.empty():
+                    self.queue.get_nowait()
+                self.queue.put_nowait(OVERFLOW)
+
+
+class LocalBackend:
+    """
+    Events within the current process only (a single worker, tests).
+    """
+    poll_interval = None
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+
+    def publish(self, hub, user_id, kind, data):
+        hub.deliver(user_id, (next(self._ids), kind, data))
+
+    def listening(self, hub, user_id):
+        return hub.has_subscribers(user_id)
+
+    def listen(self, process, user_ids, replace=False):
+        pass
+
+    def last_id(self):
+        return 0
+
+    def poll(self, after_id):
+        return []
+
+    def replay(self, user_id, after_id):
+        return []
+
+
+class SQLiteNotifyBackend:
+    """
+    An event table in a shared SQLite file: written by the process that changed the data,
+    read by every process with open connections.
+    """
+    poll_interval = LIVE_POLL_INTERVAL
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        # one connection per thread, opened again after a fork
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS live_event ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, kind TEXT NOT NULL, '
+                'payload TEXT NOT NULL, created_at REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS live_event_user ON live_event (user_id, id)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS live_listener ('
+                'user_id INTEGER NOT NULL, process TEXT NOT NULL, expires_at REAL NOT NULL, '
+                'PRIMARY KEY (user_id, process)) WITHOUT ROWID'
+            )
+            local.conn, local.pid, local.calls = conn, os.getpid(), 0
+        return local.conn
+
+    def listening(self, hub, user_id):
+        row = self.connection().execute(
+            'SELECT 1 FROM live_listener WHERE user_id = ? AND expires_at > ? LIMIT 1', [user_id, time.time()],
+        ).fetchone()
+        return row is not None
+
+    def listen(self, process, user_ids, replace=False):
+        """
+        Marks `user_ids` as having a stream open in `process`; with `replace` they are all it has.
+        """
+        conn = self.connection()
+        expires_at = time.time() + LIVE_LISTENER_TTL
+        with conn:
+            conn.execute('BEGIN IMMEDIATE')
+            if replace:
+                conn.execute('DELETE FROM live_listener WHERE process = ? OR expires_at <= ?', [process, time.time()])
+            conn.executemany(
+                'INSERT OR REPLACE INTO live_listener (user_id, process, expires_at) VALUES (?, ?, ?)',
+                [(user_id, process, expires_at) for user_id in user_ids],
+            )
+
+    def publish(self, hub, user_id, kind, data):
+        conn = self.connection()
+        now = time.time()
+        conn.execute(
+            'INSERT INTO live_event (user_id, kind, payload, created_at) VALUES (?, ?, ?, ?)',
+            [user_id, kind, json.dumps(data, default=str), now],
+        )
+        self._local.calls += 1
+        if self._local.calls % LIVE_PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM live_event WHERE created_at < ?', [now - LIVE_RETENTION])
+
+    def last_id(self):
+        return self.connection().execute('SELECT coalesce(max(id), 0) FROM live_event').fetchone()[0]
+
+    def poll(self, after_id):
+        rows = self.connection().execute(
+            'SELECT id, user_id, kind, payload FROM live_event WHERE id > ? ORDER BY id LIMIT 1000', [after_id],
+        )
+        return [(user_id, (event_id, kind, json.loads(payload))) for event_id, user_id, kind, payload in rows]
+
+    def replay(self, user_id, after_id):
+        rows = self.connection().execute(
+            'SELECT id, kind, payload FROM live_event WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?',
+            [user_id, after_id, LIVE_QUEUE_SIZE],
+        )
+        return [(event_id, kind, json.loads(payload)) for event_id, kind, payload in rows]
+
+
+LIVE_BACKENDS = {'local': LocalBackend, 'sqlite': lambda: SQLiteNotifyBackend(LIVE_DB_PATH)}
+
+
+class BroadcastHub:
+    """
+    The SSE connections of this process by user id, and the thread that fans events out to them.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+        # listener rows are written in the order the subscriptions changed
+        self._listen_lock = threading.Lock()
+        self._thread = None
+
+    def publish(self, user_id, kind, data):
+        self.backend.publish(self, user_id, kind, data)
+
+    def listening(self, user_id):
+        # writers skip publishing when nobody can receive the event
+        return self.backend.listening(self, user_id)
+
+    def has_subscribers(self, user_id):
+        return user_id in self._subscriptions
+
+    def process(self):
+        return str(os.getpid())
+
+    def _listen(self, user_id=None):
+        # the one user that just subscribed, or all users of this process (renewal, unsubscribed ones drop out)
+        with self._listen_lock:
+            if user_id is not None:
+                self.backend.listen(self.process(), [user_id])
+            else:
+                with self._lock:
+                    user_ids = list(self._subscriptions)
+                self.backend.listen(self.process(), user_ids, replace=True)
+
+    async def subscribe(self, user_id):
+        after_id = None
+        if self._thread is None:
+            # events published from here on reach this subscription; SQLite I/O, off the event loop
+            after_id = await sync_to_async(self.backend.last_id, thread_sensitive=False)()
+        subscription = Subscription(user_id, asyncio.get_running_loop())
+        with self._lock:
+            first = user_id not in self._subscriptions
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+            if self._thread is None:
+                # None if the thread stopped after the check above, it reads the last id itself then
+                self._thread = threading.Thread(target=self._run, args=(after_id,), name='live-events', daemon=True)
+                self._thread.start()
+        if first:
+            # after adding it: a renewal that runs meanwhile keeps the row
+            await sync_to_async(self._listen, thread_sensitive=False)(user_id)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def connection_count(self):
+        with self._lock:
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+    def deliver(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        self._send(subscriptions, event)
+
+    def _send(self, subscriptions, event):
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription.put, event)
+            except RuntimeError:
+                # the loop is gone (server shutdown), its generators never finish
+                self.unsubscribe(subscription)
+
+    def _run(self, after_id):
+        backend = self.backend
+        if after_id is None:
+            after_id = backend.last_id()
+        interval = backend.poll_interval or LIVE_HEARTBEAT
+        next_beat = time.monotonic() + LIVE_HEARTBEAT
+        while True:
+            time.sleep(interval)
+            with self._lock:
+                if not self._subscriptions:
+                    # started again by the next subscribe()
+                    self._thread = None
+                    stopped = True
+                else:
+                    stopped = False
+            if stopped:
+                self._listen()
+                return
+            for user_id, event in backend.poll(after_id):
+                after_id = event[0]
+                self.deliver(user_id, event)
+            if time.monotonic() >= next_beat:
+                next_beat = time.monotonic() + LIVE_HEARTBEAT
+                self._listen()
+                with self._lock:
+                    subscriptions = [s for subscriptions in self._subscriptions.values() for s in subscriptions]
+                self._send(subscriptions, PING)
+
+
+live_hub = BroadcastHub(LIVE_BACKENDS[LIVE_BACKEND]())
+
+
+def _ticket_key(ticket):
+    return hashlib.sha256(ticket.encode()).hexdigest()
+
+
+def issue_ticket(user):
+    """
+    Returns a new stream ticket for `user`. EventSource cannot send an Authorization header,
+    so the stream URL carries this ticket instead of the access token: it is valid for
+    LIVE_TICKET_TTL seconds and opens a single stream.
+    """
+    now = timezone.now()
+    LiveTicket.objects.filter(expires_at__lte=now).delete()
+    ticket = secrets.token_urlsafe(32)
+    LiveTicket.objects.create(
+        key=_ticket_key(ticket), user=user, expires_at=now + datetime.timedelta(seconds=LIVE_TICKET_TTL),
+    )
+    return ticket
+
+
+async def aconsume_ticket(ticket):
+    """
+    Returns the id of the ticket's user and invalidates the ticket, None if it is unknown, expired or used.
+    """
+    key = _ticket_key(ticket)
+    user_id = await (
+        LiveTicket.objects.filter(key=key, expires_at__gt=timezone.now()).values_list('user_id', flat=True).afirst()
+    )
+    # only the request that deletes the row gets in
+    if user_id is None or (await LiveTicket.objects.filter(key=key).adelete())[0] != 1:
+        return None
+    return user_id
+
+
+def stream_authorization(user):
+    """
+    The check event_stream() runs on every heartbeat: False once `user` is deactivated or deleted,
+    or has changed the password (which revokes the token the stream was opened with, see authentication.py).
+    """
+    password_hash = get_md5_hash_password(user.password)
+
+    async def authorized():
+        # changes in other processes reach user_cache through the revocation file
+        entry = user_cache.get(user.pk)
+        if entry is None:
+            try:
+                entry = await sync_to_async(user_cache.load)(user.pk)
+            except User.DoesNotExist:
+                return False
+        return entry.user.is_active and entry.password_hash == password_hash
+
+    return authorized
+
+
+def format_event(event_id, kind, data):
+    return f'id: {event_id}\nevent: {kind}\ndata: {json.dumps(data, default=str)}\n\n'
+
+
+async def event_stream(hub, user_id, last_event_id=None, authorized=None):
+    """
+    The SSE stream of one connection: missed events first (Last-Event-ID), then live ones.
+    It ends with a 'revoked' event when `authorized` (see stream_authorization()) turns False.
+    """
+    # subscribed when the server starts sending, a response that is never sent leaves nothing behind
+    subscription = await hub.subscribe(user_id)
+    try:
+        yield f'retry: {LIVE_RETRY}\n\n'
+        last_id = 0
+        if last_event_id is not None:
+            replay = await sync_to_async(hub.backend.replay, thread_sensitive=False)(user_id, last_event_id)
+            for event in replay:
+                last_id = event[0]
+                yield format_event(*event)
+        while True:
+            event = await subscription.queue.get()
+            if event is PING:
+                if authorized is not None and not await authorized():
+                    yield 'event: revoked\ndata: {}\n\n'
+                    return
+                yield ': ping\n\n'
+            elif event is OVERFLOW:
+                yield 'event: resync\ndata: {}\n\n'
+                return
+            elif event[0] > last_id:
+                yield format_event(*event)
+    finally:
+        hub.unsubscribe(subscription)
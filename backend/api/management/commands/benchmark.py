@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = "Runs API benchmarks against a throwaway test database."
+
+    def add_arguments(self, parser):
+        parser.add_argument('scenarios', nargs='*', help="Scenarios to run (default: all).")
+        parser.add_argument('--scale', type=float, default=1.0, help="Multiplier for the seeded data size.")
+        parser.add_argument('--list', action='store_true', help="List available scenarios.")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, func in benchmarks.SCENARIOS.items():
+                self.stdout.write(f"{name:<12} {(func.__doc__ or '').strip()}")
+            return
+
+        names = options['scenarios'] or list(benchmarks.SCENARIOS)
+        unknown = set(names) - benchmarks.SCENARIOS.keys()
+        if unknown:
+            raise CommandError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+        failures = []
+        for name in names:
+            with benchmarks.isolated_database():
+                # scenarios with budgets return what exceeded them
+                failures += benchmarks.SCENARIOS[name](self.stdout.write, scale=options['scale']) or []
+        if failures:
+            raise CommandError("Benchmark budgets exceeded:\n" + '\n'.join(failures))
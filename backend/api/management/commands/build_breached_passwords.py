@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import passwords
+
+
+class Command(BaseCommand):
+    help = "Builds the breached passwords filter (BREACHED_PASSWORDS_FILE) from a local list, one entry per line."
+
+    def add_arguments(self, parser):
+        parser.add_argument('source', help="Text file (.gz too) with one password per line.")
+        parser.add_argument('--sha1', action='store_true', help="Lines are SHA-1 hashes, HEX[:count] as in Pwned Passwords.")
+        parser.add_argument('--output', default=passwords.BREACHED_PASSWORDS_FILE)
+        parser.add_argument('--fp-rate', type=float, default=passwords.BREACHED_PASSWORDS_FP_RATE,
+                            help="Share of other passwords rejected by mistake.")
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        # sized up front, a filter cannot grow
+        with passwords.open_list(options['source']) as source:
+            count = sum(chunk.count(b'\n') for chunk in iter(lambda: source.read(1 << 20), b'')) + 1
+        stats = passwords.build_bloom_filter(
+            passwords.read_digests(options['source'], sha1=options['sha1']), count, options['output'], options['fp_rate'],
+        )
+        self.stdout.write(
+            f"Wrote {options['output']}: {stats['entries']} passwords, {stats['bytes'] / 1e6:.1f} MB, "
+            f"{stats['hashes']} hashes, in {time.perf_counter() - started:.1f}s"
+        )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from api import media
+
+
+class Command(BaseCommand):
+    help = "Deletes profile pictures no profile points at, which were not deleted right away."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace', type=int, default=media.MEDIA_GC_GRACE_SECONDS,
+                            help="Keep files saved in the last N seconds, they may be uploads in progress.")
+
+    def handle(self, *args, **options):
+        deleted = media.collect_unused(options['grace'])
+        self.stdout.write(f"Deleted {deleted} unused files.")
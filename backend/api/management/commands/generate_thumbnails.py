@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F
+
+from api.models import DEFAULT_AVATAR, UserProfile
+from api.thumbnails import generate_thumbnails, process_profile_picture
+
+
+class Command(BaseCommand):
+    help = "Pre-generates thumbnails of the default avatar and of profile pictures that have none yet."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--default-only', action='store_true', help="Only generate the default avatar variants.")
+
+    def handle(self, *args, **options):
+        # the storage profile pictures are read and their thumbnails served from, not necessarily the default one
+        storage = UserProfile._meta.get_field('profile_picture').storage
+        if storage.exists(DEFAULT_AVATAR):
+            generate_thumbnails(DEFAULT_AVATAR, storage)
+            self.stdout.write(f"Generated thumbnails for {DEFAULT_AVATAR}")
+        else:
+            self.stderr.write(f"{DEFAULT_AVATAR} not found in media storage, skipped.")
+
+        if options['default_only']:
+            return
+
+        pending = (
+            UserProfile.objects
+            .exclude(profile_picture=DEFAULT_AVATAR)
+            .exclude(profile_picture='')
+            .exclude(thumbnails_for=F('profile_picture'))
+            .values_list('pk', 'profile_picture')
+        )
+        count = failed = 0
+        for pk, name in pending.iterator():
+            if not process_profile_picture(pk, name):
+                failed += 1
+            count += 1
+        self.stdout.write(f"Processed {count} profile pictures, {failed} failed.")
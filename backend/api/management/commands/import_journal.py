@@ -0,0 +1,34 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.journal_io import EXPORT_FORMATS, IMPORT_BATCH_SIZE, import_journal
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Imports a journal file (NDJSON or CSV, same layout as the export) for a user."
+
+    def add_arguments(self, parser):
+        parser.add_argument('username')
+        parser.add_argument('path')
+        parser.add_argument('--kind', choices=list(EXPORT_FORMATS), help="File format (default: from extension).")
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"User '{options['username']}' does not exist.")
+
+        path = options['path']
+        kind = options['kind'] or ('csv' if path.lower().endswith('.csv') else 'ndjson')
+        with open(path, 'rb') as stream:
+            report = import_journal(user, stream, kind, batch_size=options['batch_size'])
+
+        for error in report['errors']:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(
+            f"{report['rows']} rows: {report['entries']} entries, {report['todos']} todos imported, "
+            f"{report['error_count']} errors."
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api import sync
+
+
+class Command(BaseCommand):
+    help = "Deletes delta sync tombstones older than SYNC_TOMBSTONE_DAYS (clients that far behind resync)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=sync.SYNC_TOMBSTONE_DAYS)
+
+    def handle(self, *args, **options):
+        deleted = sync.prune_tombstones(options['days'])
+        self.stdout.write(f"Deleted {deleted} tombstones.")
@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import purge
+
+
+class Command(BaseCommand):
+    help = "Deletes the data of accounts closed through DELETE /api/profile/, in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=purge.ACCOUNT_PURGE_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep running and poll for closed accounts.")
+        parser.add_argument('--interval', type=float, default=10.0, help="Seconds between polls in --loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = purge.run_purges(batch_size=options['batch_size'])
+            if stats['accounts'] or stats['failed']:
+                self.stdout.write(
+                    f"purged={stats['accounts']} rows={stats['rows']} failed={stats['failed']}"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api import purge
+
+
+class Command(BaseCommand):
+    help = "Deletes registrations that were never activated, older than UNACTIVATED_ACCOUNT_DAYS."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=purge.UNACTIVATED_ACCOUNT_DAYS)
+        parser.add_argument('--batch-size', type=int, default=purge.ACCOUNT_PURGE_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        queued = purge.enqueue_unactivated(options['days'])
+        # also finishes closed accounts that are still queued
+        stats = purge.run_purges(batch_size=options['batch_size'])
+        self.stdout.write(
+            f"Queued {queued} unactivated accounts, purged {stats['accounts']} accounts, {stats['failed']} failed."
+        )
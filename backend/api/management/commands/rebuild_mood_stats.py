@@ -0,0 +1,26 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from api.stats import rebuild_user_stats
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the MoodStat rollup from DayEntry and TodoItem."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Only rebuild this username.")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['user']:
+            users = users.filter(username=options['user'])
+            if not users.exists():
+                raise CommandError(f"User '{options['user']}' does not exist.")
+
+        count = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            rebuild_user_stats(user_id)
+            count += 1
+        self.stdout.write(f"Rebuilt mood stats for {count} users.")
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api import reminders
+
+
+class Command(BaseCommand):
+    help = "Queues todo reminders in the outbox when they are due (run next to send_outbox_emails --loop)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Queue the reminders due now and exit.")
+        parser.add_argument('--batch-size', type=int, default=reminders.REMINDER_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        scheduler = reminders.ReminderScheduler(batch_size=options['batch_size'])
+        if options['once']:
+            self.stdout.write(f"Queued {scheduler.tick()} reminders.")
+            return
+        try:
+            scheduler.run(on_delivered=lambda count: self.stdout.write(f"Queued {count} reminders."))
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import outbox
+
+
+class Command(BaseCommand):
+    help = "Sends queued emails (activation, password reset) from the outbox."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=outbox.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--loop', action='store_true', help="Keep running and poll the outbox.")
+        parser.add_argument('--interval', type=float, default=2.0, help="Seconds between polls in --loop mode.")
+
+    def handle(self, *args, **options):
+        while True:
+            stats = outbox.drain(batch_size=options['batch_size'])
+            if stats['sent'] or stats['failed']:
+                self.stdout.write(
+                    f"sent={stats['sent']} failed={stats['failed']} "
+                    f"in {stats['seconds']:.2f}s ({stats['rate']:.1f} msg/s)"
+                )
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,129 @@
+"""
+Reference counts and cleanup of content-addressed files (storage.py).
+
+StoredFile.refcount counts the profiles pointing at a file; the UserProfile signals (signals.py) call retain()
+for a new picture and release() for a replaced or deleted one. After the commit release() tries to delete
+a file nothing points at any more right away, together with its thumbnails.
+
+The count is only a hint: before deleting, collect() checks again that no profile points at the file
+and that it was not saved within the last MEDIA_GC_GRACE_SECONDS (being uploaded by someone else).
+`python manage.py collect_media` recounts and deletes what was not deleted right away,
+files without a StoredFile row as well (e.g. after a failed profile save).
+"""
+import logging
+import posixpath
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import StoredFile, UserProfile
+from .storage import avatar_storage, is_content_addressed
+
+logger = logging.getLogger(__name__)
+
+MEDIA_GC_GRACE_SECONDS = getattr(settings, 'MEDIA_GC_GRACE_SECONDS', 600)
+MEDIA_GC_BATCH_SIZE = getattr(settings, 'MEDIA_GC_BATCH_SIZE', 500)
+
+
+def _tracked(name):
+    # the default avatar and pictures uploaded before content addressing are not counted
+    return is_content_addressed(name)
+
+
+def retain(name):
+    if not _tracked(name):
+        return
+    updated = StoredFile.objects.filter(name=name).update(refcount=F('refcount') + 1)
+    if not updated:
+        size = avatar_storage.size(name) if avatar_storage.exists(name) else 0
+        _, created = StoredFile.objects.get_or_create(name=name, defaults={'size': size, 'refcount': 1})
+        if not created:
+            StoredFile.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+
+def release(name):
+    if not _tracked(name):
+        return
+    StoredFile.objects.filter(name=name, refcount__gt=0).update(refcount=F('refcount') - 1)
+    # a failure only leaves the file for collect_media
+    transaction.on_commit(lambda: collect(name), robust=True)
+
+
+def collect(name, grace=None):
+    """
+    Deletes an unused file and its derived files. Returns True if it was deleted.
+    """
+    grace = MEDIA_GC_GRACE_SECONDS if grace is None else grace
+    with transaction.atomic():
+        # BEGIN IMMEDIATE: no profile can start pointing at the file while it is checked
+        stored = StoredFile.objects.filter(name=name, refcount=0).first()
+        if stored is None or UserProfile.objects.filter(profile_picture=name).exists():
+            return False
+        exists = avatar_storage.exists(name)
+        if exists and avatar_storage.age(name) < grace:
+            return False
+        for target in avatar_storage.derived_names(name) + ([name] if exists else []):
+            avatar_storage.delete(target)
+        stored.delete()
+    return True
+
+
+def recount(batch_size=None):
+    """
+    Sets the counts from the profiles. Returns the number of corrected rows.
+    """
+    batch_size = batch_size or MEDIA_GC_BATCH_SIZE
+    fixed, last_pk = 0, 0
+    while True:
+        batch = list(StoredFile.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            return fixed
+        last_pk = batch[-1].pk
+        counts = dict(
+            UserProfile.objects.filter(profile_picture__in=[stored.name for stored in batch])
+            .values_list('profile_picture').annotate(Count('pk'))
+        )
+        changed = [stored for stored in batch if stored.refcount != counts.get(stored.name, 0)]
+        for stored in changed:
+            stored.refcount = counts.get(stored.name, 0)
+        StoredFile.objects.bulk_update(changed, ['refcount'])
+        fixed += len(changed)
+
+
+def orphaned_files(grace=None):
+    """
+    Content-addressed files without a StoredFile row and without a profile, older than grace.
+    """
+    grace = MEDIA_GC_GRACE_SECONDS if grace is None else grace
+    root = UserProfile._meta.get_field('profile_picture').upload_to.rstrip('/')
+    try:
+        shards, _ = avatar_storage.listdir(root)
+    except FileNotFoundError:
+        return
+    for shard in shards:
+        directory = posixpath.join(root, shard)
+        _, files = avatar_storage.listdir(directory)
+        names = [posixpath.join(directory, file) for file in files if is_content_addressed(file) and '_' not in file]
+        known = set(StoredFile.objects.filter(name__in=names).values_list('name', flat=True))
+        known |= set(UserProfile.objects.filter(profile_picture__in=names).values_list('profile_picture', flat=True))
+        for name in names:
+            if name not in known and avatar_storage.age(name) >= grace:
+                yield name
+
+
+def collect_unused(grace=None, batch_size=None):
+    """
+    Cleanup for collect_media. Returns the number of deleted files (thumbnails not counted).
+    """
+    fixed = recount(batch_size)
+    if fixed:
+        logger.warning("Corrected %s media reference counts", fixed)
+    deleted = 0
+    for name in list(StoredFile.objects.filter(refcount=0).values_list('name', flat=True).iterator()):
+        deleted += collect(name, grace)
+    for name in orphaned_files(grace):
+        for target in avatar_storage.derived_names(name) + [name]:
+            avatar_storage.delete(target)
+        deleted += 1
+    return deleted
@@ -0,0 +1,227 @@
+"""
+Request timing: Prometheus histograms (/metrics) and an optional Server-Timing header.
+
+RequestMetricsMiddleware times the whole request and, during it (a ContextVar, so also in
+the sync_to_async threads of async views), collects:
+- db: number and time of queries, a wrapper installed on every connection (connection.execute_wrappers),
+- auth: CachedJWTAuthentication,
+- serialize: `.data` of the serializers that build response bodies (TimedSerializerMixin, TimedListSerializer),
+- app: the rest, i.e. views, input validation and rendering.
+Time spent in queries inside auth or serialize counts as db only. Nothing is patched: the serializers
+opt in through the mixin, queries are timed by a wrapper installed on every connection.
+
+Histograms live in process memory; every worker serves its own, Prometheus sums them over instances.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework import serializers
+
+# internal timings are for developers, not for every client
+SERVER_TIMING_HEADER = getattr(settings, 'SERVER_TIMING_HEADER', False)
+METRICS_TOKEN = getattr(settings, 'METRICS_TOKEN', None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SPANS = ('auth', 'serialize')
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('queries', 'db', 'auth', 'serialize', '_depth')
+
+    def __init__(self):
+        self.queries = 0
+        self.db = self.auth = self.serialize = 0.0
+        self._depth = 0
+
+
+@contextmanager
+def span(name):
+    """
+    Adds the time spent in the block, minus its queries, to `name` (one of SPANS) of the current request;
+    nested blocks count once.
+    """
+    timings = _current.get()
+    if timings is None or timings._depth:
+        yield
+        return
+    timings._depth += 1
+    started, db = time.perf_counter(), timings.db
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started - (timings.db - db)
+        setattr(timings, name, getattr(timings, name) + elapsed)
+        timings._depth -= 1
+
+
+class TimedListSerializer(serializers.ListSerializer):
+    # Meta.list_serializer_class of the serializers with TimedSerializerMixin
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class TimedSerializerMixin:
+    """
+    For serializers whose `.data` goes into responses: it is timed as the serialize span. Set
+    Meta.list_serializer_class = TimedListSerializer as well, so that many=True is timed too.
+    """
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+def record_query(execute, sql, params, many, context):
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db += time.perf_counter() - started
+        timings.queries += 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    # connection_created receiver: every connection, in every thread, reports to the current request
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label)
+            if series is None:
+                series = self._series[label] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self, label_name):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = sorted((label, list(counts), total) for label, (counts, total) in self._series.items())
+        for label, counts, total in series:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_name}="{label}",le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_name}="{label}"}} {total}')
+            lines.append(f'{self.name}_count{{{label_name}="{label}"}} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {
+            'total': Histogram('api_request_duration_seconds', 'Time spent in Django per request.', DURATION_BUCKETS),
+            'db': Histogram('api_request_db_seconds', 'Time spent in SQL queries per request.', DURATION_BUCKETS),
+            'queries': Histogram('api_request_db_queries', 'SQL queries per request.', QUERY_COUNT_BUCKETS),
+            'auth': Histogram('api_request_auth_seconds', 'Time spent authenticating per request.', DURATION_BUCKETS),
+            'serialize': Histogram(
+                'api_request_serialize_seconds', 'Time spent serializing response data per request.', DURATION_BUCKETS,
+            ),
+            'app': Histogram(
+                'api_request_app_seconds', 'Time spent outside SQL, authentication and serializers per request.',
+                DURATION_BUCKETS,
+            ),
+        }
+
+    def observe(self, view, timings, total):
+        histograms = self.histograms
+        histograms['total'].observe(view, total)
+        histograms['db'].observe(view, timings.db)
+        histograms['queries'].observe(view, timings.queries)
+        histograms['auth'].observe(view, timings.auth)
+        histograms['serialize'].observe(view, timings.serialize)
+        histograms['app'].observe(view, app_time(timings, total))
+
+    def render(self):
+        lines = []
+        for histogram in self.histograms.values():
+            lines += histogram.render('view')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def view_label(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+def app_time(timings, total):
+    return max(total - timings.db - timings.auth - timings.serialize, 0.0)
+
+
+def server_timing(timings, total):
+    return (
+        f'db;dur={timings.db * 1000:.2f};desc="{timings.queries} queries", '
+        f'auth;dur={timings.auth * 1000:.2f}, serialize;dur={timings.serialize * 1000:.2f}, '
+        f'app;dur={app_time(timings, total) * 1000:.2f}, '
+        f'total;dur={total * 1000:.2f}'
+    )
+
+
+class RequestMetricsMiddleware:
+    """
+    Histograms per URL name, Server-Timing if enabled. Streaming responses are timed to the first byte.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    async def __acall__(self, request):
+        timings = RequestTimings()
+        token = _current.set(timings)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, timings, time.perf_counter() - started)
+
+    def finish(self, request, response, timings, total):
+        registry.observe(view_label(request), timings, total)
+        if SERVER_TIMING_HEADER:
+            response['Server-Timing'] = server_timing(timings, total)
+        return response
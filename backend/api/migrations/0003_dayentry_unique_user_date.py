@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:11
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def merge_duplicate_entries(apps, schema_editor):
+    # older databases can hold several entries for one day; the oldest one keeps the todos,
+    # the descriptions and the first mood of the others, which are then deleted
+    DayEntry = apps.get_model('api', 'DayEntry')
+    TodoItem = apps.get_model('api', 'TodoItem')
+    duplicates = (
+        DayEntry.objects.values('user_id', 'date')
+        .annotate(entries=Count('id'))
+        .filter(entries__gt=1)
+    )
+    for key in duplicates.iterator():
+        kept, *others = DayEntry.objects.filter(user_id=key['user_id'], date=key['date']).order_by('id')
+        descriptions = [entry.description for entry in [kept, *others] if entry.description]
+        kept.description = '\n\n'.join(descriptions)
+        if kept.mood_id is None:
+            kept.mood_id = next((entry.mood_id for entry in others if entry.mood_id), None)
+        kept.save(update_fields=['description', 'mood'])
+        other_ids = [entry.pk for entry in others]
+        TodoItem.objects.filter(day_entry_id__in=other_ids).update(day_entry=kept)
+        DayEntry.objects.filter(pk__in=other_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_outgoingemail'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_entries, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dayentry',
+            constraint=models.UniqueConstraint(fields=('user', 'date'), name='unique_user_date'),
+        ),
+    ]
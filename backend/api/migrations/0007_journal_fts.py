@@ -0,0 +1,91 @@
+# Full-text search index over DayEntry.description and TodoItem.content (SQLite FTS5).
+# rowid = user_id << 36 | id << 1 | kind (0 = DayEntry, 1 = TodoItem), so one user's rows are
+# a contiguous rowid range, see api/search.py.
+
+from django.db import migrations
+
+FORWARD_SQL = [
+    """
+    CREATE VIRTUAL TABLE api_journal_fts USING fts5(
+        body, tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+    )
+    """,
+    # DayEntry
+    """
+    CREATE TRIGGER api_dayentry_fts_insert AFTER INSERT ON api_dayentry
+    WHEN new.description != '' BEGIN
+        INSERT INTO api_journal_fts (rowid, body) VALUES ((new.user_id << 36) | (new.id << 1), new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER api_dayentry_fts_update AFTER UPDATE OF description, user_id ON api_dayentry BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1);
+        INSERT INTO api_journal_fts (rowid, body)
+            SELECT (new.user_id << 36) | (new.id << 1), new.description WHERE new.description != '';
+    END
+    """,
+    """
+    CREATE TRIGGER api_dayentry_fts_delete AFTER DELETE ON api_dayentry BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1);
+    END
+    """,
+    # TodoItem
+    """
+    CREATE TRIGGER api_todoitem_fts_insert AFTER INSERT ON api_todoitem
+    WHEN new.content != '' BEGIN
+        INSERT INTO api_journal_fts (rowid, body) VALUES ((new.user_id << 36) | (new.id << 1) | 1, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_update AFTER UPDATE OF content, user_id ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+        INSERT INTO api_journal_fts (rowid, body)
+            SELECT (new.user_id << 36) | (new.id << 1) | 1, new.content WHERE new.content != '';
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_delete AFTER DELETE ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+    END
+    """,
+    # existing rows
+    """
+    INSERT INTO api_journal_fts (rowid, body)
+        SELECT (user_id << 36) | (id << 1), description FROM api_dayentry WHERE description != ''
+    """,
+    """
+    INSERT INTO api_journal_fts (rowid, body)
+        SELECT (user_id << 36) | (id << 1) | 1, content FROM api_todoitem WHERE content != ''
+    """,
+]
+
+REVERSE_SQL = [
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_insert",
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_update",
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_delete",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_insert",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_update",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_delete",
+    "DROP TABLE IF EXISTS api_journal_fts",
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite only, other backends simply have no search index
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_moodstat'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_sqlite(FORWARD_SQL), run_sqlite(REVERSE_SQL)),
+    ]
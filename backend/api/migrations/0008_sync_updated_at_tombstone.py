@@ -0,0 +1,123 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:19
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+# SQLite rebuilds api_dayentry/api_todoitem to add a column and the rebuild drops their
+# full-text search triggers (0007), so they are created again after the new columns
+
+TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_insert",
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_update",
+    "DROP TRIGGER IF EXISTS api_dayentry_fts_delete",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_insert",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_update",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_delete",
+    """
+    CREATE TRIGGER api_dayentry_fts_insert AFTER INSERT ON api_dayentry
+    WHEN new.description != '' BEGIN
+        INSERT INTO api_journal_fts (rowid, body) VALUES ((new.user_id << 36) | (new.id << 1), new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER api_dayentry_fts_update AFTER UPDATE OF description, user_id ON api_dayentry BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1);
+        INSERT INTO api_journal_fts (rowid, body)
+            SELECT (new.user_id << 36) | (new.id << 1), new.description WHERE new.description != '';
+    END
+    """,
+    """
+    CREATE TRIGGER api_dayentry_fts_delete AFTER DELETE ON api_dayentry BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1);
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_insert AFTER INSERT ON api_todoitem
+    WHEN new.content != '' BEGIN
+        INSERT INTO api_journal_fts (rowid, body) VALUES ((new.user_id << 36) | (new.id << 1) | 1, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_update AFTER UPDATE OF content, user_id ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+        INSERT INTO api_journal_fts (rowid, body)
+            SELECT (new.user_id << 36) | (new.id << 1) | 1, new.content WHERE new.content != '';
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_delete AFTER DELETE ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+    END
+    """,
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite only, other backends simply have no search index
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_journal_fts'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # backwards: the columns are gone (another rebuild), put the triggers back
+        migrations.RunPython(migrations.RunPython.noop, run_sqlite(TRIGGERS_SQL)),
+        migrations.CreateModel(
+            name='Tombstone',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('day', 'Day entry'), ('todo', 'Todo')], max_length=4)),
+                ('object_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='dayentry',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='todoitem',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddField(
+            model_name='userprofile',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True),
+        ),
+        migrations.AddIndex(
+            model_name='dayentry',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='dayentry_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='todoitem',
+            index=models.Index(fields=['user', 'updated_at', 'id'], name='todoitem_sync_idx'),
+        ),
+        migrations.AddField(
+            model_name='tombstone',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tombstones', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_sync_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tombstone',
+            index=models.Index(fields=['deleted_at'], name='tombstone_prune_idx'),
+        ),
+        migrations.RunPython(run_sqlite(TRIGGERS_SQL), migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+# adding the columns rebuilds api_todoitem on SQLite, which drops its full-text search triggers (0007)
+
+TRIGGERS_SQL = [
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_insert",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_update",
+    "DROP TRIGGER IF EXISTS api_todoitem_fts_delete",
+    """
+    CREATE TRIGGER api_todoitem_fts_insert AFTER INSERT ON api_todoitem
+    WHEN new.content != '' BEGIN
+        INSERT INTO api_journal_fts (rowid, body) VALUES ((new.user_id << 36) | (new.id << 1) | 1, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_update AFTER UPDATE OF content, user_id ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+        INSERT INTO api_journal_fts (rowid, body)
+            SELECT (new.user_id << 36) | (new.id << 1) | 1, new.content WHERE new.content != '';
+    END
+    """,
+    """
+    CREATE TRIGGER api_todoitem_fts_delete AFTER DELETE ON api_todoitem BEGIN
+        DELETE FROM api_journal_fts WHERE rowid = (old.user_id << 36) | (old.id << 1) | 1;
+    END
+    """,
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        # FTS5 is SQLite only, other backends simply have no search index
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_recurring_todo'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # backwards: the columns are gone (another rebuild), put the triggers back
+        migrations.RunPython(migrations.RunPython.noop, run_sqlite(TRIGGERS_SQL)),
+        migrations.AddField(
+            model_name='todoitem',
+            name='remind_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='todoitem',
+            name='reminder_sent_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='todoitem',
+            index=models.Index(condition=models.Q(('remind_at__isnull', False), ('reminder_sent_at__isnull', True)), fields=['remind_at'], name='todoitem_reminder_due_idx'),
+        ),
+        migrations.RunPython(run_sqlite(TRIGGERS_SQL), migrations.RunPython.noop),
+    ]
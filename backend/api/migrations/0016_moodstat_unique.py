@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:31
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+
+
+def merge_duplicate_stats(apps, schema_editor):
+    # concurrent first writes could create the same counter twice, each holding a part of the deltas:
+    # the oldest row gets the sums, the others are deleted
+    MoodStat = apps.get_model('api', 'MoodStat')
+    duplicates = (
+        MoodStat.objects.values('user_id', 'period', 'period_start', 'mood_id')
+        .annotate(rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for key in duplicates.iterator():
+        rows = MoodStat.objects.filter(
+            user_id=key['user_id'], period=key['period'], period_start=key['period_start'], mood_id=key['mood_id'],
+        )
+        totals = rows.aggregate(entries=Sum('entries'), todos_total=Sum('todos_total'), todos_done=Sum('todos_done'))
+        kept = rows.order_by('id').first()
+        rows.exclude(pk=kept.pk).delete()
+        MoodStat.objects.filter(pk=kept.pk).update(**totals)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_liveticket'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_stats, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='moodstat',
+            constraint=models.UniqueConstraint(condition=models.Q(('mood__isnull', False)), fields=('user', 'period', 'period_start', 'mood'), name='unique_moodstat'),
+        ),
+        migrations.AddConstraint(
+            model_name='moodstat',
+            constraint=models.UniqueConstraint(condition=models.Q(('mood__isnull', True)), fields=('user', 'period', 'period_start'), name='unique_moodstat_no_mood'),
+        ),
+    ]
@@ -1,6 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.utils import timezone
+
+from .storage import avatar_storage
+
+DEFAULT_AVATAR = 'avatars/default-avatar-icon.jpg'
 
 class Mood(models.Model):
     name = models.CharField(max_length=50)
@@ -14,6 +19,17 @@ class DayEntry(models.Model):
     date = models.DateField()
     mood = models.ForeignKey(Mood, on_delete=models.SET_NULL, null=True, blank=True)
     description = models.TextField(blank=True)
+    # delta sync (sync.py); bulk_update()/update() callers set it themselves
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # one entry per user per day, also the index used by date range queries
+            models.UniqueConstraint(fields=['user', 'date'], name='unique_user_date'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'], name='dayentry_sync_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.date}"
@@ -23,6 +39,21 @@ class TodoItem(models.Model):
     day_entry = models.ForeignKey(DayEntry, on_delete=models.CASCADE, related_name='todos', null=True, blank=True)
     content = models.CharField(max_length=255)
     is_done = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(auto_now=True)
+    # emailed by `run_reminders` (reminders.py); a new remind_at clears reminder_sent_at
+    remind_at = models.DateTimeField(null=True, blank=True)
+    reminder_sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'], name='todoitem_sync_idx'),
+            # only pending reminders, the scheduler reads it in remind_at order
+            models.Index(
+                fields=['remind_at'],
+                name='todoitem_reminder_due_idx',
+                condition=models.Q(remind_at__isnull=False, reminder_sent_at__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return self.content
@@ -31,15 +62,213 @@ class UserProfile(models.Model):
     user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='profile')
     profile_picture = models.ImageField(
         upload_to='profile_pictures/',
-        default='avatars/default-avatar-icon.jpg',
+        # named by content hash, shared between profiles (storage.py, media.py)
+        storage=avatar_storage,
+        db_index=True,
+        default=DEFAULT_AVATAR,
         null=True,
         blank=True
     )
+    # name of the picture the current thumbnails were generated from, see thumbnails.py
+    thumbnails_for = models.CharField(max_length=255, blank=True)
+    # also touched when username/email change (signals.py), they are part of the synced profile
+    updated_at = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         if not self.profile_picture or self.profile_picture.name == '':
-            self.profile_picture = 'avatars/default-avatar-icon.jpg'
+            self.profile_picture = DEFAULT_AVATAR
         super().save(*args, **kwargs)
 
     def __str__(self):
-        return self.user.username
\ No newline at end of file
+        return self.user.username
+
+class StoredFile(models.Model):
+    # a content-addressed media file (storage.py) and the number of profiles pointing at it, see media.py
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['name'], name='storedfile_unused_idx', condition=models.Q(refcount=0)),
+        ]
+
+    def __str__(self):
+        return f"{self.name} x{self.refcount}"
+
+class UserDataVersion(models.Model):
+    # bumped on every write to the user's profile/journal, see versioning.py
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='data_version')
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.user_id} v{self.version}"
+
+class Tombstone(models.Model):
+    # deleted journal rows for delta sync (sync.py), kept SYNC_TOMBSTONE_DAYS
+    KIND_DAY = 'day'
+    KIND_TODO = 'todo'
+    KIND_CHOICES = [
+        (KIND_DAY, 'Day entry'),
+        (KIND_TODO, 'Todo'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='tombstones')
+    kind = models.CharField(max_length=4, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'], name='tombstone_sync_idx'),
+            models.Index(fields=['deleted_at'], name='tombstone_prune_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.kind} {self.object_id} deleted {self.deleted_at}"
+
+class RecurringTodo(models.Model):
+    # a repeating todo, its occurrences are computed for the requested dates (recurrence.py), never stored
+    FREQ_DAILY = 'daily'
+    FREQ_WEEKLY = 'weekly'
+    FREQ_MONTHLY = 'monthly'
+    FREQ_CHOICES = [
+        (FREQ_DAILY, 'Daily'),
+        (FREQ_WEEKLY, 'Weekly'),
+        (FREQ_MONTHLY, 'Monthly'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='recurring_todos')
+    content = models.CharField(max_length=255)
+    freq = models.CharField(max_length=7, choices=FREQ_CHOICES)
+    interval = models.PositiveSmallIntegerField(default=1)
+    start_date = models.DateField()
+    # at most one of them, like UNTIL/COUNT of an RRULE
+    until = models.DateField(null=True, blank=True)
+    count = models.PositiveIntegerField(null=True, blank=True)
+    # weekly only: bit 0 = Monday ... bit 6 = Sunday, 0 = the weekday of start_date
+    weekdays = models.PositiveSmallIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'start_date'], name='recurring_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.content} ({self.freq}/{self.interval} from {self.start_date})"
+
+class RecurringTodoOverride(models.Model):
+    # one occurrence that differs from its rule: done, edited or skipped (an RRULE exception)
+    rule = models.ForeignKey(RecurringTodo, on_delete=models.CASCADE, related_name='overrides')
+    date = models.DateField()
+    is_done = models.BooleanField(default=False)
+    is_skipped = models.BooleanField(default=False)
+    # null = the rule's content
+    content = models.CharField(max_length=255, null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['rule', 'date'], name='unique_rule_date'),
+        ]
+
+    def __str__(self):
+        return f"{self.rule_id} {self.date}"
+
+class AccountPurge(models.Model):
+    # a deactivated account waiting for `purge_accounts` (purge.py), removed with the user
+    REASON_DELETED = 'deleted'
+    REASON_UNACTIVATED = 'unactivated'
+    REASON_CHOICES = [
+        (REASON_DELETED, 'Deleted by the user'),
+        (REASON_UNACTIVATED, 'Never activated'),
+    ]
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='purge')
+    reason = models.CharField(max_length=11, choices=REASON_CHOICES)
+    requested_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.user_id} ({self.reason}) requested {self.requested_at}"
+
+class LiveTicket(models.Model):
+    # single-use ticket that opens one /api/live/ stream (live.py); only its SHA-256 is stored
+    key = models.CharField(max_length=64, primary_key=True)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='live_tickets')
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} until {self.expires_at}"
+
+class MoodStat(models.Model):
+    # rollup maintained by stats.py, one row per (user, period, mood)
+    PERIOD_WEEK = 'week'
+    PERIOD_MONTH = 'month'
+    PERIOD_YEAR = 'year'
+    PERIOD_CHOICES = [
+        (PERIOD_WEEK, 'Week'),
+        (PERIOD_MONTH, 'Month'),
+        (PERIOD_YEAR, 'Year'),
+    ]
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='mood_stats')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    mood = models.ForeignKey(Mood, on_delete=models.CASCADE, null=True, blank=True)
+    entries = models.IntegerField(default=0)
+    todos_total = models.IntegerField(default=0)
+    todos_done = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'period', 'period_start'], name='moodstat_lookup_idx'),
+        ]
+        constraints = [
+            # one row per counter, a concurrent first write of the same one fails instead of adding a twin;
+            # NULLs are distinct in a unique index, entries without a mood get their own
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start', 'mood'], name='unique_moodstat',
+                condition=models.Q(mood__isnull=False),
+            ),
+            models.UniqueConstraint(
+                fields=['user', 'period', 'period_start'], name='unique_moodstat_no_mood',
+                condition=models.Q(mood__isnull=True),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.user_id} {self.period} {self.period_start} {self.mood_id}: {self.entries}"
+
+class OutgoingEmail(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_DEAD, 'Dead'),
+    ]
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True)
+    to = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    # worker currently sending it (outbox.claim_emails); next_attempt_at is the end of its lease
+    claim = models.CharField(max_length=32, blank=True, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.to)} ({self.status})"
@@ -0,0 +1,139 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail
+
+# retry policy, can be overridden in settings
+OUTBOX_BATCH_SIZE = getattr(settings, 'OUTBOX_BATCH_SIZE', 100)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 6)
+OUTBOX_RETRY_BASE_SECONDS = getattr(settings, 'OUTBOX_RETRY_BASE_SECONDS', 30)
+OUTBOX_RETRY_MAX_SECONDS = getattr(settings, 'OUTBOX_RETRY_MAX_SECONDS', 3600)
+# how long a claimed batch belongs to one worker; unsent rows of a crashed worker are due again after it
+OUTBOX_LEASE_SECONDS = getattr(settings, 'OUTBOX_LEASE_SECONDS', 300)
+
+
+def enqueue_email(subject, message, recipient_list, from_email=None):
+    """
+    Stores the message in the outbox instead of sending it during the request.
+    `python manage.py send_outbox_emails` sends it.
+    """
+    return OutgoingEmail.objects.create(
+        subject=subject,
+        body=message,
+        from_email=from_email or '',
+        to=list(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    # exponential backoff: 30s, 60s, 120s, ... capped
+    delay = OUTBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, OUTBOX_RETRY_MAX_SECONDS))
+
+
+def claim_emails(batch_size=None, now=None):
+    """
+    Claims a batch of due messages for this worker and returns it.
+    Other workers skip claimed messages for OUTBOX_LEASE_SECONDS.
+    """
+    now = now or timezone.now()
+    claim = uuid.uuid4().hex
+    with transaction.atomic():
+        ids = list(
+            OutgoingEmail.objects
+            .filter(status=OutgoingEmail.STATUS_PENDING, next_attempt_at__lte=now)
+            .order_by('next_attempt_at', 'id')
+            .values_list('id', flat=True)[:batch_size or OUTBOX_BATCH_SIZE]
+        )
+        # conditional: rows another worker claimed in the meantime no longer match
+        OutgoingEmail.objects.filter(
+            id__in=ids, status=OutgoingEmail.STATUS_PENDING, next_attempt_at__lte=now,
+        ).update(claim=claim, next_attempt_at=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+    return list(OutgoingEmail.objects.filter(claim=claim).order_by('id'))
+
+
+def send_batch(emails, connection):
+    """
+    Sends claimed messages over one (open) SMTP connection.
+    Each one is marked right after it is sent, so a crash halfway through the batch
+    does not send the earlier ones again. Returns (sent, failed).
+    """
+    sent = failed = 0
+    for email in emails:
+        now = timezone.now()
+        if now >= email.next_attempt_at:
+            # the lease ran out, another worker may be sending the rest already
+            break
+        message = EmailMessage(
+            email.subject,
+            email.body,
+            email.from_email or None,
+            email.to,
+            connection=connection,
+        )
+        try:
+            message.send()
+        except Exception as exc:
+            email.last_error = f"{exc.__class__.__name__}: {exc}"
+            email.attempts += 1
+            if email.attempts >= OUTBOX_MAX_ATTEMPTS:
+                email.status = OutgoingEmail.STATUS_DEAD
+            email.next_attempt_at = now + retry_delay(email.attempts)
+            failed += 1
+        else:
+            email.status = OutgoingEmail.STATUS_SENT
+            email.attempts += 1
+            email.sent_at = timezone.now()
+            email.last_error = ''
+            sent += 1
+        OutgoingEmail.objects.filter(pk=email.pk, claim=email.claim).update(
+            status=email.status,
+            attempts=email.attempts,
+            sent_at=email.sent_at,
+            next_attempt_at=email.next_attempt_at,
+            last_error=email.last_error,
+            claim='',
+        )
+    return sent, failed
+
+
+def drain(batch_size=None, connection=None):
+    """
+    Sends every message of the outbox that is due.
+    The SMTP connection is opened once and used for all batches.
+    Returns a dict of statistics (msgs/s among them).
+    """
+    connection = connection or get_connection()
+    stats = {'sent': 0, 'failed': 0, 'seconds': 0.0}
+    started = time.monotonic()
+    opened = False
+    try:
+        while True:
+            emails = claim_emails(batch_size)
+            if not emails:
+                break
+            if not opened:
+                try:
+                    connection.open()
+                    opened = True
+                except Exception:
+                    # every message will record the connection error itself
+                    pass
+            sent, failed = send_batch(emails, connection)
+            stats['sent'] += sent
+            stats['failed'] += failed
+            if not sent:
+                # the whole batch failed, most likely the mail server is down
+                break
+    finally:
+        if opened:
+            connection.close()
+    stats['seconds'] = time.monotonic() - started
+    stats['rate'] = stats['sent'] / stats['seconds'] if stats['seconds'] else 0.0
+    return stats
@@ -0,0 +1,231 @@
+"""
+Password validators (AUTH_PASSWORD_VALIDATORS) shared by registration, password reset and password change.
+
+PasswordRulesValidator holds the rules the serializers used to check. BreachedPasswordValidator rejects
+passwords from breach lists: `python manage.py build_breached_passwords list.txt` builds a Bloom filter
+of them (BREACHED_PASSWORDS_FILE), and processes map the file read-only. Its pages are shared by all
+workers (page cache) and a check touches k of them in a few microseconds, so even a filter of hundreds
+of millions of passwords adds nothing to the RSS of the workers. Building one is pure Python, about
+10 µs per password: minutes for tens of millions, hours for the full Pwned Passwords list.
+
+The filter is keyed by the SHA-1 of the password, so it can also be built from lists of SHA-1 hashes
+(e.g. Pwned Passwords, `--sha1`). It sometimes rejects a password that is not listed
+(BREACHED_PASSWORDS_FP_RATE), it never accepts one that is. Until a filter is built, Django's list of
+common passwords is checked instead.
+"""
+import gzip
+import hashlib
+import logging
+import math
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+
+from django.conf import settings
+from django.contrib.auth.password_validation import CommonPasswordValidator
+from django.core.exceptions import ValidationError
+
+logger = logging.getLogger(__name__)
+
+BREACHED_PASSWORDS_FILE = getattr(
+    settings, 'BREACHED_PASSWORDS_FILE', os.path.join(settings.BASE_DIR, 'breached_passwords.bloom'),
+)
+BREACHED_PASSWORDS_FP_RATE = getattr(settings, 'BREACHED_PASSWORDS_FP_RATE', 0.001)
+
+# magic, bits, hash functions, entries; the bit array starts at HEADER_SIZE
+HEADER = struct.Struct('<8sQIQ')
+HEADER_SIZE = 32
+MAGIC = b'PWBLOOM1'
+
+PASSWORD_RULES = [
+    (lambda value: len(value) >= 8, "Password must be at least 8 characters long.", 'password_too_short'),
+    (lambda value: re.search(r'[A-Z]', value), "Password must contain an uppercase letter.", 'password_no_upper'),
+    (lambda value: re.search(r'[a-z]', value), "Password must contain a lowercase letter.", 'password_no_lower'),
+    (lambda value: re.search(r'\d', value), "Password must contain a digit.", 'password_no_digit'),
+    (lambda value: re.search(r'[^\w\s]', value), "Password must contain a special character.", 'password_no_special'),
+]
+
+
+class PasswordRulesValidator:
+    """
+    Length and character classes; reports the first rule that is not met.
+    """
+
+    def validate(self, password, user=None):
+        for rule, message, code in PASSWORD_RULES:
+            if not rule(password):
+                raise ValidationError(message, code=code)
+
+    def get_help_text(self):
+        return (
+            "Your password must be at least 8 characters long and contain an uppercase letter, "
+            "a lowercase letter, a digit and a special character."
+        )
+
+
+def bloom_parameters(count, fp_rate):
+    # optimal bit count and number of hash functions for `count` entries
+    count = max(count, 1)
+    bits = max(8, math.ceil(-count * math.log(fp_rate) / math.log(2) ** 2))
+    return bits, max(1, round(bits / count * math.log(2)))
+
+
+def _probes(digest, bits, hashes):
+    # double hashing over two 64-bit halves of the digest (Kirsch-Mitzenmacher)
+    first = int.from_bytes(digest[:8], 'little')
+    step = int.from_bytes(digest[8:16], 'little') | 1
+    return ((first + i * step) % bits for i in range(hashes))
+
+
+def password_digest(password):
+    return hashlib.sha1(password.encode('utf-8')).digest()
+
+
+class BloomFilter:
+    """
+    Bloom filter read from a file mapped read-only.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.bits, self.hashes, self.count = HEADER.unpack_from(self.data)
+        if magic != MAGIC or len(self.data) < HEADER_SIZE + (self.bits + 7) // 8:
+            self.data.close()
+            raise ValueError(f"{path} is not a breached passwords filter")
+
+    def __contains__(self, password):
+        return self.contains_digest(password_digest(password))
+
+    def contains_digest(self, digest):
+        data = self.data
+        for bit in _probes(digest, self.bits, self.hashes):
+            if not data[HEADER_SIZE + (bit >> 3)] >> (bit & 7) & 1:
+                return False
+        return True
+
+    def close(self):
+        self.data.close()
+
+
+def build_bloom_filter(digests, count, path, fp_rate=None):
+    """
+    Writes a filter of `count` SHA-1 digests (an iterator) to `path`. The bits are set in a map of the
+    new file, so a filter larger than the memory costs page cache rather than RSS. The file is replaced
+    atomically, processes with the old one mapped keep reading it until they notice the new one.
+    """
+    bits, hashes = bloom_parameters(count, fp_rate or BREACHED_PASSWORDS_FP_RATE)
+    size = HEADER_SIZE + (bits + 7) // 8
+    added = 0
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temporary = tempfile.mkstemp(dir=directory, prefix='.bloom-')
+    try:
+        with os.fdopen(fd, 'w+b') as file:
+            # sparse, zero filled
+            file.truncate(size)
+            with mmap.mmap(file.fileno(), size) as array:
+                for digest in digests:
+                    for bit in _probes(digest, bits, hashes):
+                        array[HEADER_SIZE + (bit >> 3)] |= 1 << (bit & 7)
+                    added += 1
+                # the header last: an interrupted build never looks complete
+                array[:HEADER_SIZE] = HEADER.pack(MAGIC, bits, hashes, added).ljust(HEADER_SIZE, b'\0')
+                array.flush()
+        os.chmod(temporary, 0o644)
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+    return {'entries': added, 'bits': bits, 'hashes': hashes, 'bytes': size}
+
+
+def open_list(path):
+    return gzip.open(path, 'rb') if str(path).endswith('.gz') else open(path, 'rb')
+
+
+def read_digests(path, sha1=False):
+    """
+    Digests of the passwords of a list with one per line: passwords or (sha1=True) HEX[:count].
+    """
+    with open_list(path) as lines:
+        for line in lines:
+            line = line.rstrip(b'\r\n')
+            if not line:
+                continue
+            if sha1:
+                yield bytes.fromhex(line[:40].decode('ascii'))
+            else:
+                yield hashlib.sha1(line).digest()
+
+
+class BreachedPasswords:
+    """
+    The filter of BREACHED_PASSWORDS_FILE in this process; opened again when the file is replaced.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.filter = None
+        self.previous = None
+        self.file_key = None
+
+    def get(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if key != self.file_key:
+            with self.lock:
+                if key != self.file_key:
+                    self.file_key = key
+                    # a check in another thread may still be reading the current map, it is closed
+                    # one replacement later; rebuilds are hours apart, checks take microseconds
+                    if self.previous is not None:
+                        self.previous.close()
+                    self.previous = self.filter
+                    try:
+                        self.filter = BloomFilter(self.path)
+                    except (OSError, ValueError, struct.error):
+                        logger.exception("Breached passwords filter %s cannot be read, not checking", self.path)
+                        self.filter = None
+        return self.filter
+
+    def __contains__(self, password):
+        bloom = self.get()
+        return bloom is not None and password in bloom
+
+
+class BreachedPasswordValidator:
+    """
+    Rejects passwords from breach lists (Bloom filter, see above), the common ones until a filter is built.
+    """
+
+    def __init__(self, path=None):
+        self.passwords = BreachedPasswords(path or BREACHED_PASSWORDS_FILE)
+        self._common = None
+
+    @property
+    def common(self):
+        # loaded on first use: a process with a filter never keeps Django's 20k passwords in memory
+        if self._common is None:
+            self._common = CommonPasswordValidator()
+        return self._common
+
+    def validate(self, password, user=None):
+        bloom = self.passwords.get()
+        if bloom is None:
+            self.common.validate(password, user)
+        elif password in bloom:
+            raise ValidationError(
+                "This password has appeared in a data breach, please choose another one.",
+                code='password_breached',
+            )
+
+    def get_help_text(self):
+        return "Your password can't be one that has appeared in a data breach."
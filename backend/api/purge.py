@@ -0,0 +1,155 @@
+"""
+Account deletion in the background.
+
+DELETE /api/profile/ only deactivates the account (with an unusable password, and the user caches of all
+workers drop it after the commit, so its tokens stop working everywhere) and records an AccountPurge.
+`python manage.py purge_accounts` then deletes the data in batches of ACCOUNT_PURGE_BATCH_SIZE rows, each
+batch in its own short transaction, so other writers wait for one batch at most rather than for the
+cascade of a whole journal. Finally it deletes the profile picture files (media.py releases shared ones)
+and the user itself (the AccountPurge goes with it).
+
+Every step deletes whatever is left, so an interrupted purge simply resumes on the next run.
+`purge_unactivated_accounts` deletes registrations nobody activated the same way.
+"""
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef
+from django.utils import timezone
+
+from .models import (
+    DEFAULT_AVATAR, AccountPurge, DayEntry, MoodStat, RecurringTodo, RecurringTodoOverride, Tombstone,
+    TodoItem, UserProfile,
+)
+from .signals import purging_account
+from .storage import is_content_addressed
+from .thumbnails import THUMBNAIL_SIZES, thumbnail_name
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+ACCOUNT_PURGE_BATCH_SIZE = getattr(settings, 'ACCOUNT_PURGE_BATCH_SIZE', 500)
+# pause between batches, lets queued writers take the lock
+ACCOUNT_PURGE_PAUSE = getattr(settings, 'ACCOUNT_PURGE_PAUSE', 0.05)
+UNACTIVATED_ACCOUNT_DAYS = getattr(settings, 'UNACTIVATED_ACCOUNT_DAYS', 7)
+
+# children before parents, so no delete cascades further than its own batch
+PURGE_STEPS = [
+    (TodoItem, 'user_id'),
+    (RecurringTodoOverride, 'rule__user_id'),
+    (RecurringTodo, 'user_id'),
+    (DayEntry, 'user_id'),
+    (MoodStat, 'user_id'),
+    (Tombstone, 'user_id'),
+]
+
+
+def request_account_deletion(user):
+    """
+    Deactivates the account at once and queues the deletion of its data.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        # the tokens carry a hash of the password (CHECK_REVOKE_TOKEN); after the commit the user cache of
+        # every worker drops the account (signals.revoke_cached_user), so its tokens stop working at once
+        user.set_unusable_password()
+        user.save(update_fields=['is_active', 'password'])
+        AccountPurge.objects.get_or_create(user=user, defaults={'reason': AccountPurge.REASON_DELETED})
+
+
+def _delete_batch(queryset, batch_size):
+    with transaction.atomic(), purging_account():
+        ids = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if ids:
+            queryset.model.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _delete_media(user_id):
+    profile = UserProfile.objects.filter(user_id=user_id).first()
+    if profile is None:
+        return
+    name = profile.profile_picture.name
+    if not name or name == DEFAULT_AVATAR or is_content_addressed(name):
+        # shared pictures are released with the profile (media.py)
+        return
+    storage = profile.profile_picture.storage
+    # missing files are fine, an interrupted purge deletes them again
+    for target in [name] + [thumbnail_name(name, size) for size in THUMBNAIL_SIZES]:
+        storage.delete(target)
+
+
+def purge_account(user_id, batch_size=None, pause=None):
+    """
+    Deletes the account's data in batches, then its files and the user. Returns the number of deleted journal rows.
+    """
+    if not AccountPurge.objects.filter(user_id=user_id).exists():
+        # only accounts queued for deletion, never an active one
+        return 0
+    batch_size = batch_size or ACCOUNT_PURGE_BATCH_SIZE
+    pause = ACCOUNT_PURGE_PAUSE if pause is None else pause
+    deleted = 0
+    for model, lookup in PURGE_STEPS:
+        queryset = model.objects.filter(**{lookup: user_id})
+        while True:
+            count = _delete_batch(queryset, batch_size)
+            deleted += count
+            if count < batch_size:
+                break
+            if pause:
+                time.sleep(pause)
+    _delete_media(user_id)
+    # what is left is one row each: profile, data version, the purge job; deleted through the
+    # instance, so the signal handlers see a User origin and skip the cascade (signals._skip)
+    user = User.objects.filter(pk=user_id, purge__isnull=False).first()
+    if user is not None:
+        user.delete()
+    return deleted
+
+
+def run_purges(batch_size=None, pause=None, limit=None):
+    """
+    Runs the queued deletions, oldest first. A failing account does not stop the others,
+    it stays queued for the next run. Returns statistics.
+    """
+    stats = {'accounts': 0, 'rows': 0, 'failed': 0}
+    jobs = AccountPurge.objects.order_by('requested_at').values_list('user_id', flat=True)
+    for user_id in list(jobs[:limit] if limit else jobs):
+        try:
+            stats['rows'] += purge_account(user_id, batch_size, pause)
+        except Exception as exc:
+            logger.exception("Purging account %s failed", user_id)
+            AccountPurge.objects.filter(user_id=user_id).update(
+                attempts=F('attempts') + 1, last_error=f"{exc.__class__.__name__}: {exc}",
+            )
+            stats['failed'] += 1
+        else:
+            stats['accounts'] += 1
+    return stats
+
+
+def unactivated_accounts(days=None):
+    """
+    Registrations not activated for `days` days: inactive, never logged in, without a profile or entries.
+    An account deactivated by an administrator usually has data, so it is not mistaken for a new one.
+    """
+    cutoff = timezone.now() - datetime.timedelta(days=UNACTIVATED_ACCOUNT_DAYS if days is None else days)
+    return User.objects.filter(
+        is_active=False, last_login__isnull=True, date_joined__lt=cutoff, purge__isnull=True, profile__isnull=True,
+    ).exclude(Exists(DayEntry.objects.filter(user=OuterRef('pk'))))
+
+
+def enqueue_unactivated(days=None):
+    """
+    Queues the deletion of unactivated accounts. Returns their number.
+    """
+    jobs = [
+        AccountPurge(user_id=user_id, reason=AccountPurge.REASON_UNACTIVATED)
+        for user_id in unactivated_accounts(days).values_list('pk', flat=True).iterator()
+    ]
+    AccountPurge.objects.bulk_create(jobs, batch_size=ACCOUNT_PURGE_BATCH_SIZE, ignore_conflicts=True)
+    return len(jobs)
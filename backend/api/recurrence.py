@@ -0,0 +1,276 @@
+"""
+Repeating todos: RecurringTodo rules, expanded into occurrences only for the requested period.
+
+A rule (daily/weekly/monthly, interval, until or count, weekdays) has no stored occurrences;
+occurrence_dates() computes the first occurrence of the window arithmetically, so the cost depends on the
+length of the window, not on the age of the rule. Only occurrences that differ from the rule are stored
+(RecurringTodoOverride: done, other content, skipped).
+
+Expanded months are kept in the process memory by (user, data version, month); every write of a rule
+or an override bumps the data version (signals.py), so stale entries stop matching by themselves.
+"""
+import calendar
+import datetime
+import math
+import threading
+from collections import OrderedDict
+from operator import itemgetter
+
+from django.conf import settings
+
+from .models import RecurringTodo, RecurringTodoOverride
+
+RECURRENCE_CACHE_SIZE = getattr(settings, 'RECURRENCE_CACHE_SIZE', 2048)
+
+WEEK = datetime.timedelta(days=7)
+
+
+def weekday_list(rule):
+    if rule.weekdays:
+        return [day for day in range(7) if rule.weekdays & (1 << day)]
+    return [rule.start_date.weekday()]
+
+
+def add_months(date, months):
+    # first day of the month `months` after date's month
+    month = date.month - 1 + months
+    return datetime.date(date.year + month // 12, month % 12 + 1, 1)
+
+
+def month_end(month):
+    return add_months(month, 1) - datetime.timedelta(days=1)
+
+
+def has_day(month, day):
+    return calendar.monthrange(month.year, month.month)[1] >= day
+
+
+def _daily(rule, start):
+    # (index, date) from the first occurrence on or after start
+    step = rule.interval
+    index = max(0, -(-(start - rule.start_date).days // step))
+    while True:
+        yield index, rule.start_date + datetime.timedelta(days=index * step)
+        index += 1
+
+
+def _weekly(rule, start):
+    days = weekday_list(rule)
+    first_week = [day for day in days if day >= rule.start_date.weekday()]
+    week0 = rule.start_date - datetime.timedelta(days=rule.start_date.weekday())
+    period = max(0, (start - week0).days // (7 * rule.interval))
+    # occurrences before the period: the partial first week, then full weeks
+    index = 0 if period == 0 else len(first_week) + (period - 1) * len(days)
+    while True:
+        monday = week0 + period * rule.interval * WEEK
+        for day in (first_week if period == 0 else days):
+            yield index, monday + datetime.timedelta(days=day)
+            index += 1
+        period += 1
+
+
+def _first_term(first, step, modulus, residue):
+    # (j, period): first + j * step ≡ residue (mod modulus) for j, j + period, j + 2 * period, ...; None if never
+    g = math.gcd(step, modulus)
+    if (residue - first) % g:
+        return None
+    period = modulus // g
+    return (residue - first) // g * pow(step // g, -1, period) % period, period
+
+
+def _count_terms(first, step, n, modulus, residue=0):
+    # how many of first + j * step, 0 <= j < n, are ≡ residue (mod modulus)
+    term = _first_term(first, step, modulus, residue)
+    if term is None or term[0] >= n:
+        return 0
+    j, period = term
+    return (n - 1 - j) // period + 1
+
+
+def _months_without_day(rule, periods, day):
+    # how many of the first `periods` months of a monthly rule have no day `day` (29-31), counted arithmetically:
+    # the months are the progression start + p * interval, and so are the years of its Februaries
+    first, step = rule.start_date.year * 12 + rule.start_date.month - 1, rule.interval
+    skipped = 0
+    if day == 31:
+        skipped += sum(_count_terms(first, step, periods, 12, month - 1) for month in (4, 6, 9, 11))
+    februaries = _count_terms(first, step, periods, 12, 1)
+    if day == 29 and februaries:
+        j, period = _first_term(first, step, 12, 1)
+        year, years = (first + j * step) // 12, period * step // 12
+        leap = (
+            _count_terms(year, years, februaries, 4)
+            - _count_terms(year, years, februaries, 100)
+            + _count_terms(year, years, februaries, 400)
+        )
+        februaries -= leap
+    return skipped + februaries
+
+
+def _monthly(rule, start):
+    # on the day of the month of start_date, months without that day are skipped (as in RFC 5545)
+    day = rule.start_date.day
+    months = (start.year - rule.start_date.year) * 12 + start.month - rule.start_date.month
+    period = max(0, months // rule.interval)
+    index = period if day <= 28 else period - _months_without_day(rule, period, day)
+    while True:
+        month = add_months(rule.start_date, period * rule.interval)
+        if has_day(month, day):
+            yield index, month.replace(day=day)
+            index += 1
+        period += 1
+
+
+EXPANDERS = {
+    RecurringTodo.FREQ_DAILY: _daily,
+    RecurringTodo.FREQ_WEEKLY: _weekly,
+    RecurringTodo.FREQ_MONTHLY: _monthly,
+}
+
+
+def occurrence_dates(rule, start, end):
+    """
+    Dates of the rule's occurrences in [start, end], honouring until/count; stores nothing.
+    """
+    if rule.until is not None:
+        end = min(end, rule.until)
+    start = max(start, rule.start_date)
+    if start > end:
+        return
+    for index, date in EXPANDERS[rule.freq](rule, start):
+        if date > end or (rule.count is not None and index >= rule.count):
+            return
+        if date >= start:
+            yield date
+
+
+def is_occurrence(rule, date):
+    return next(occurrence_dates(rule, date, date), None) is not None
+
+
+def expand(rules, overrides, start, end):
+    """
+    Occurrences of the rules in [start, end] sorted by (date, rule id), with the overrides applied;
+    `overrides` is {(rule_id, date): RecurringTodoOverride}. Dates are ISO strings already (ready for JSON).
+    """
+    overridden = {rule_id for rule_id, _ in overrides}
+    occurrences = []
+    for rule in rules:
+        pk, content = rule.pk, rule.content
+        for date in occurrence_dates(rule, start, end):
+            override = overrides.get((pk, date)) if pk in overridden else None
+            if override is None:
+                occurrences.append({
+                    'rule': pk, 'date': date.isoformat(), 'content': content, 'is_done': False, 'overridden': False,
+                })
+            elif not override.is_skipped:
+                occurrences.append({
+                    'rule': pk,
+                    'date': date.isoformat(),
+                    'content': content if override.content is None else override.content,
+                    'is_done': override.is_done,
+                    'overridden': True,
+                })
+    occurrences.sort(key=itemgetter('date', 'rule'))
+    return occurrences
+
+
+def override_occurrence(rule, date, changes):
+    """
+    Changes one occurrence (is_done/is_skipped/content); an override is stored only if the result
+    differs from the rule. Returns the occurrence like expand(), or None if it is skipped.
+    """
+    override = RecurringTodoOverride.objects.filter(rule=rule, date=date).first()
+    if override is None:
+        override = RecurringTodoOverride(rule=rule, date=date)
+    for field, value in changes.items():
+        setattr(override, field, value)
+    if override.content == rule.content:
+        override.content = None
+    if override.is_done or override.is_skipped or override.content is not None:
+        override.save()
+        overrides = {(rule.pk, date): override}
+    else:
+        if override.pk is not None:
+            override.delete()
+        overrides = {}
+    occurrences = expand([rule], overrides, date, date)
+    return occurrences[0] if occurrences else None
+
+
+def load_month_occurrences(user_id, months):
+    """
+    Expands the given months (their first days) with two queries: the rules and the overrides of the whole range.
+    Returns {month: occurrences}.
+    """
+    start, end = months[0], month_end(months[-1])
+    rules = list(
+        RecurringTodo.objects.filter(user_id=user_id, start_date__lte=end)
+        .exclude(until__lt=start)
+        .order_by('id')
+    )
+    overrides = {}
+    if rules:
+        overrides = {
+            (override.rule_id, override.date): override
+            for override in RecurringTodoOverride.objects.filter(
+                rule_id__in=[rule.pk for rule in rules], date__range=(start, end),
+            )
+        }
+    # one pass over the whole span, split into months afterwards (ISO dates: 'YYYY-MM' prefix)
+    result = {month: [] for month in months}
+    by_prefix = {month.isoformat()[:7]: occurrences for month, occurrences in result.items()}
+    for occurrence in expand(rules, overrides, start, end):
+        bucket = by_prefix.get(occurrence['date'][:7])
+        if bucket is not None:
+            bucket.append(occurrence)
+    return result
+
+
+class OccurrenceCache:
+    """
+    Expanded months by (user_id, data version, month), an LRU in the process memory.
+    """
+
+    def __init__(self, size=RECURRENCE_CACHE_SIZE):
+        self.size = size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def occurrences(self, user_id, version, start, end):
+        months, month = [], start.replace(day=1)
+        while month <= end:
+            months.append(month)
+            month = add_months(month, 1)
+        found, missing = {}, []
+        with self._lock:
+            for month in months:
+                entry = self._entries.get((user_id, version, month))
+                if entry is None:
+                    missing.append(month)
+                else:
+                    self._entries.move_to_end((user_id, version, month))
+                    found[month] = entry
+        if missing:
+            # rules and overrides of all missing months in one go
+            loaded = load_month_occurrences(user_id, missing)
+            with self._lock:
+                for month, entry in loaded.items():
+                    self._entries[(user_id, version, month)] = entry
+                while len(self._entries) > self.size:
+                    self._entries.popitem(last=False)
+            found.update(loaded)
+        start, end = start.isoformat(), end.isoformat()
+        return [
+            occurrence
+            for month in months
+            for occurrence in found[month]
+            if start <= occurrence['date'] <= end
+        ]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+occurrence_cache = OccurrenceCache()
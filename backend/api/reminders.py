@@ -0,0 +1,146 @@
+"""
+Todo reminders (TodoItem.remind_at), sent by `python manage.py run_reminders`.
+
+The process keeps a heap (heapq) of the reminders of the next REMINDER_WINDOW seconds in memory, read
+from the partial index todoitem_reminder_due_idx (unsent ones only), sleeps until the nearest one
+and hands due reminders in batches to the outbox (outbox.py), from which send_outbox_emails sends
+them with retries. The window is read again every REMINDER_RELOAD_SECONDS, so new and moved
+reminders arrive with that delay at most, and the cost depends on the number of reminders in the
+window, not on the size of the table.
+
+reminder_sent_at and the outbox message are written in one transaction: after a crash a reminder is
+neither lost nor sent twice, with several processes too. After downtime the first window holds all overdue ones.
+"""
+import datetime
+import heapq
+import logging
+import threading
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .models import OutgoingEmail, TodoItem
+
+logger = logging.getLogger(__name__)
+
+REMINDER_WINDOW = getattr(settings, 'REMINDER_WINDOW', 3600)
+REMINDER_RELOAD_SECONDS = getattr(settings, 'REMINDER_RELOAD_SECONDS', 30)
+REMINDER_BATCH_SIZE = getattr(settings, 'REMINDER_BATCH_SIZE', 500)
+# upper bound of the heap, a fuller window is read further on the next reloads
+REMINDER_LOAD_LIMIT = getattr(settings, 'REMINDER_LOAD_LIMIT', 50000)
+
+
+def pending_reminders():
+    # matches the condition of todoitem_reminder_due_idx, so only that index is read
+    return TodoItem.objects.filter(remind_at__isnull=False, reminder_sent_at__isnull=True)
+
+
+def reminder_email(todo):
+    remind_at = timezone.localtime(todo.remind_at)
+    return OutgoingEmail(
+        subject=f"Reminder: {todo.content}",
+        body=f"Hi {todo.user.username},\n\nthis is your reminder for {remind_at:%Y-%m-%d %H:%M}:\n\n{todo.content}\n",
+        to=[todo.user.email],
+    )
+
+
+def claim_and_enqueue(todo_ids, now):
+    """
+    Marks due reminders as sent and puts their emails into the outbox in one transaction.
+    Skips todos that were deleted, already sent or moved to later. Returns the number of handled reminders.
+    """
+    with transaction.atomic():
+        # BEGIN IMMEDIATE (settings.py): no other process claims the same rows in between
+        todos = list(
+            pending_reminders().filter(pk__in=todo_ids, remind_at__lte=now).select_related('user')
+        )
+        if not todos:
+            return 0
+        TodoItem.objects.filter(pk__in=[todo.pk for todo in todos]).update(reminder_sent_at=now)
+        # inactive users and users without an address are marked as well, there is nobody to tell
+        OutgoingEmail.objects.bulk_create(
+            [reminder_email(todo) for todo in todos if todo.user.is_active and todo.user.email]
+        )
+    return len(todos)
+
+
+class ReminderScheduler:
+    """
+    A heap of (remind_at, todo id) over the window of the nearest reminders; run() works until `stop` is set.
+    """
+
+    def __init__(self, window=REMINDER_WINDOW, reload_seconds=REMINDER_RELOAD_SECONDS,
+                 batch_size=REMINDER_BATCH_SIZE, load_limit=REMINDER_LOAD_LIMIT):
+        self.window = datetime.timedelta(seconds=window)
+        self.reload_every = datetime.timedelta(seconds=reload_seconds)
+        self.batch_size = batch_size
+        self.load_limit = load_limit
+        self.heap = []
+        # id -> remind_at of its live heap entry; entries that differ are stale and skipped when popped
+        self.queued = {}
+        self.next_reload = None
+
+    def load(self, now):
+        """
+        Adds the reminders up to now + window (overdue ones too) to the heap. Returns the number of rows read.
+        """
+        rows = list(
+            pending_reminders()
+            .filter(remind_at__lte=now + self.window)
+            .order_by('remind_at')
+            .values_list('pk', 'remind_at')[:self.load_limit]
+        )
+        for pk, remind_at in rows:
+            if self.queued.get(pk) != remind_at:
+                # new, or moved since the last load
+                self.queued[pk] = remind_at
+                heapq.heappush(self.heap, (remind_at, pk))
+        self.next_reload = now + self.reload_every
+        if len(rows) == self.load_limit:
+            # cut off: read on once the heap is through them, at once when catching up after downtime
+            self.next_reload = min(self.next_reload, rows[-1][1])
+        return len(rows)
+
+    def run_pending(self, now):
+        """
+        Hands every reminder of the heap due at or before now to the outbox, in batches of batch_size.
+        """
+        delivered = 0
+        while self.heap and self.heap[0][0] <= now:
+            batch = []
+            while self.heap and self.heap[0][0] <= now and len(batch) < self.batch_size:
+                remind_at, pk = heapq.heappop(self.heap)
+                if self.queued.get(pk) == remind_at:
+                    del self.queued[pk]
+                    batch.append(pk)
+            if batch:
+                delivered += claim_and_enqueue(batch, now)
+        return delivered
+
+    def seconds_to_wakeup(self, now):
+        wakeup = self.next_reload
+        if self.heap:
+            wakeup = min(wakeup, self.heap[0][0])
+        return max(0.0, (wakeup - now).total_seconds())
+
+    def tick(self, now=None):
+        now = now or timezone.now()
+        if self.next_reload is None or now >= self.next_reload:
+            self.load(now)
+        return self.run_pending(now)
+
+    def run(self, stop=None, on_delivered=None):
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                delivered = self.tick()
+            except Exception:
+                # popped reminders are still pending in the table, the next reload queues them again
+                logger.exception("Reminder delivery failed")
+                self.next_reload = timezone.now()
+                stop.wait(self.reload_every.total_seconds())
+                continue
+            if delivered and on_delivered:
+                on_delivered(delivered)
+            stop.wait(self.seconds_to_wakeup(timezone.now()))
@@ -0,0 +1,117 @@
+"""
+Full-text search in day descriptions and todo contents (FTS5 table api_journal_fts, migration 0007).
+
+The index is kept up to date by SQLite triggers (fts.py), so it covers bulk_create/update() as well.
+rowid = user_id << 36 | id << 1 | kind (0 = DayEntry, 1 = TodoItem), so one user's rows are
+a contiguous rowid range and limiting a query to the user costs no more than a BETWEEN.
+
+Every match of the user is ranked in SQLite with the built-in bm25() (ORDER BY rank);
+its IDF is computed over the whole index, i.e. over all users.
+"""
+import re
+import string
+import unicodedata
+
+from django.db import connection
+
+from .fts import MAX_USER_ID, USER_SHIFT
+from .models import DayEntry, TodoItem
+
+SEARCH_MAX_TERMS = 8
+SNIPPET_TOKENS = 12
+SNIPPET_MARKERS = ('**', '**')
+
+KIND_DAY, KIND_TODO = 0, 1
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+_SEPARATORS = string.punctuation + '\t\n\r\f\v'
+_PUNCTUATION = str.maketrans(_SEPARATORS, ' ' * len(_SEPARATORS))
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def normalize(text):
+    # close enough to unicode61 remove_diacritics: lowercase, no combining marks
+    text = text.lower().translate(_PUNCTUATION)
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return text
+
+
+def tokenize(text):
+    return _TERM_RE.findall(normalize(text))
+
+
+def user_rowid_range(user_id):
+    low = int(user_id) << USER_SHIFT
+    return low, low | ((1 << USER_SHIFT) - 1)
+
+
+def split_rowid(rowid):
+    return (rowid & ((1 << USER_SHIFT) - 1)) >> 1, rowid & 1
+
+
+def build_match(terms):
+    """
+    Turns the user's words into a safe MATCH expression: every word as a prefix.
+    """
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_journal(user_id, query, limit=20):
+    """
+    Searches the user's journal; every word has to occur (as a prefix).
+    """
+    terms = list(dict.fromkeys(tokenize(query)))[:SEARCH_MAX_TERMS]
+    if not terms or int(user_id) >= MAX_USER_ID:
+        return []
+    low, high = user_rowid_range(user_id)
+    match = build_match(terms)
+
+    with connection.cursor() as cursor:
+        # bm25() is negative, lower is better
+        cursor.execute(
+            'SELECT rowid, -bm25(api_journal_fts) FROM api_journal_fts '
+            'WHERE api_journal_fts MATCH %s AND rowid BETWEEN %s AND %s ORDER BY rank, rowid DESC LIMIT %s',
+            [match, low, high, limit],
+        )
+        scores = dict(cursor.fetchall())
+        if not scores:
+            return []
+        best = list(scores)
+        cursor.execute(
+            f"""
+            SELECT rowid, snippet(api_journal_fts, 0, %s, %s, '…', %s)
+            FROM api_journal_fts
+            WHERE api_journal_fts MATCH %s AND rowid IN ({', '.join(['%s'] * len(best))})
+            """,
+            [*SNIPPET_MARKERS, SNIPPET_TOKENS, match, *best],
+        )
+        snippets = dict(cursor.fetchall())
+
+    entry_ids = [pk for pk, kind in map(split_rowid, best) if kind == KIND_DAY]
+    todo_ids = [pk for pk, kind in map(split_rowid, best) if kind == KIND_TODO]
+    entries = dict(DayEntry.objects.filter(pk__in=entry_ids).values_list('pk', 'date')) if entry_ids else {}
+    todos = {
+        pk: (day_entry_id, date)
+        for pk, day_entry_id, date in TodoItem.objects.filter(pk__in=todo_ids)
+        .values_list('pk', 'day_entry_id', 'day_entry__date')
+    } if todo_ids else {}
+
+    results = []
+    for rowid in best:
+        pk, kind = split_rowid(rowid)
+        score = round(scores[rowid], 4)
+        if kind == KIND_DAY:
+            if pk not in entries:
+                continue
+            results.append({'type': 'day', 'id': pk, 'day_entry': pk, 'date': entries[pk], 'snippet': snippets.get(rowid, ''), 'score': score})
+        else:
+            if pk not in todos:
+                continue
+            day_entry_id, date = todos[pk]
+            results.append({'type': 'todo', 'id': pk, 'day_entry': day_entry_id, 'date': date, 'snippet': snippets.get(rowid, ''), 'score': score})
+    return results
@@ -1,8 +1,13 @@
 from django.contrib.auth.models import User
 from rest_framework import serializers
 from django.urls import reverse
-from django.core.mail import send_mail
-import re
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.encoding import smart_str, DjangoUnicodeDecodeError
+from django.utils.http import urlsafe_base64_decode
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.contrib.auth import password_validation
+from django.core.exceptions import ValidationError as DjangoValidationError
 
 # Jeśli masz własny model UserProfile, zaimportuj go:
 # from .models import UserProfile
@@ -11,6 +16,17 @@ import re
 from django.contrib.auth import get_user_model
 User = get_user_model()
 
+from .outbox import enqueue_email
+
+
+def validate_new_password(password, user=None):
+    # the rules and the breached passwords check of AUTH_PASSWORD_VALIDATORS, as DRF errors
+    try:
+        password_validation.validate_password(password, user)
+    except DjangoValidationError as exc:
+        raise serializers.ValidationError(list(exc.messages))
+    return password
+
 #user_register
 class RegisterSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True)
@@ -24,21 +40,13 @@ class RegisterSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("This email address is already in use.")
         return value
 
-    # password standards
+    # password standards, AUTH_PASSWORD_VALIDATORS (passwords.py)
     def validate_password(self, value):
-        if len(value) < 8:
-            raise serializers.ValidationError("Password must be at least 8 characters long.")
-        if not re.search(r'[A-Z]', value):
-            raise serializers.ValidationError("Password must contain an uppercase letter.")
-        if not re.search(r'[a-z]', value):
-            raise serializers.ValidationError("Password must contain a lowercase letter.")
-        if not re.search(r'\d', value):
-            raise serializers.ValidationError("Password must contain a digit.")
-        if not re.search(r'[^\w\s]', value):
-            raise serializers.ValidationError("Password must contain a special character.")
-        return value
+        user = User(username=self.initial_data.get('username', ''), email=self.initial_data.get('email', ''))
+        return validate_new_password(value, user)
 
     # user creation with activation link
+    @transaction.atomic
     def create(self, validated_data):
         user = User.objects.create_user(
             username=validated_data['username'],
@@ -60,7 +68,7 @@ class RegisterSerializer(serializers.ModelSerializer):
             'If this wasn’t you, please ignore this message.'
         )
 
-        send_mail(subject, message, None, [user.email])
+        enqueue_email(subject, message, [user.email])
         return user
 
 # resend activation link
@@ -69,7 +77,8 @@ class ResendActivationEmailSerializer(serializers.Serializer):
 
     def validate_email(self, value):
         try:
-            user = User.objects.get(email=value)
+            # accounts queued for deletion (purge.py) are gone for good
+            user = User.objects.get(email=value, purge__isnull=True)
         except User.DoesNotExist:
             raise serializers.ValidationError("No user is registered with this email address.")
 
@@ -97,7 +106,7 @@ class ResendActivationEmailSerializer(serializers.Serializer):
             'If this wasn’t you, please ignore this message.'
         )
 
-        send_mail(subject, message, None, [user.email])
+        enqueue_email(subject, message, [user.email])
 
 #user_login
 class UserSerializer(serializers.ModelSerializer):
@@ -106,110 +115,6 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'username', 'email')
 
 
-# password_reset_request
-class PasswordResetRequestSerializer(serializers.Serializer):
-    email = serializers.EmailField()
-
-    def validate_email(self, value):
-        if not User.objects.filter(email=value, is_active=True).exists():
-            raise serializers.ValidationError("User with this email does not exist or is not active.")
-        return value
-
-# password_reset_set
-class SetNewPasswordSerializer(serializers.Serializer):
-    uidb64 = serializers.CharField()
-    token = serializers.CharField()
-    new_password = serializers.CharField(write_only=True)
-    new_password_confirm = serializers.CharField(write_only=True)
-
-    def validate_password(self, value):
-        if len(value) < 8:
-            raise serializers.ValidationError("Password must be at least 8 characters long.")
-        if not re.search(r'[A-Z]', value):
-            raise serializers.ValidationError("Password must contain an uppercase letter.")
-        if not re.search(r'[a-z]', value):
-            raise serializers.ValidationError("Password must contain a lowercase letter.")
-        if not re.search(r'\d', value):
-            raise serializers.ValidationError("Password must contain a digit.")
-        if not re.search(r'[^\w\s]', value):
-            raise serializers.ValidationError("Password must contain a special character.")
-        return value
-
-    # validation if new password is the same as new password confirm
-    def validate(self, attrs):
-        if attrs['new_password'] != attrs['new_password_confirm']:
-            raise serializers.ValidationError("Passwords do not match.")
-        
-        self.validate_password(attrs['new_password'])
-        return attrs
-
-    #saving new password
-    def save(self):
-        from django.utils.encoding import smart_str, DjangoUnicodeDecodeError
-        from django.utils.http import urlsafe_base64_decode
-        from django.contrib.auth.tokens import PasswordResetTokenGenerator
-
-        uid = self.validated_data['uidb64']
-        token = self.validated_data['token']
-
-        try:
-            uid = smart_str(urlsafe_base64_decode(uid))
-            user = User.objects.get(pk=uid)
-        except (DjangoUnicodeDecodeError, User.DoesNotExist):
-            raise serializers.ValidationError("Invalid token or uid.")
-
-        if not PasswordResetTokenGenerator().check_token(user, token):
-            raise serializers.ValidationError("Token is expired or invalid.")
-
-        user.set_password(self.validated_data['new_password'])
-        user.save()
-        return user
-
-# password serializer
-class ChangePasswordSerializer(serializers.Serializer):
-    old_password = serializers.CharField(write_only=True)
-    new_password = serializers.CharField(write_only=True)
-    new_password_confirm = serializers.CharField(write_only=True)
-
-    def validate_old_password(self, value):
-        user = self.context['request'].user
-        if not user.check_password(value):
-            raise serializers.ValidationError("Old password is incorrect.")
-        return value
-
-    def validate_password(self, value):
-        if len(value) < 8:
-            raise serializers.ValidationError("Password must be at least 8 characters long.")
-        if not re.search(r'[A-Z]', value):
-            raise serializers.ValidationError("Password must contain an uppercase letter.")
-        if not re.search(r'[a-z]', value):
-            raise serializers.ValidationError("Password must contain a lowercase letter.")
-        if not re.search(r'\d', value):
-            raise serializers.ValidationError("Password must contain a digit.")
-        if not re.search(r'[^\w\s]', value):
-            raise serializers.ValidationError("Password must contain a special character.")
-        return value
-
-    def validate(self, attrs):
-        if attrs['new_password'] != attrs['new_password_confirm']:
-            raise serializers.ValidationError("Passwords do not match.")
-        
-        # Validate password strength
-        self.validate_password(attrs['new_password'])
-        
-        # Check if new password is different from old password
-        user = self.context['request'].user
-        if user.check_password(attrs['new_password']):
-            raise serializers.ValidationError("New password cannot be the same as the old password.")
-        
-        return attrs
-
-    def save(self):
-        user = self.context['request'].user
-        user.set_password(self.validated_data['new_password'])
-        user.save()
-        return user
-
 # --- Profile serializers ---
 
 from rest_framework.validators import UniqueValidator
@@ -230,34 +135,269 @@ class ProfileSerializer(serializers.ModelSerializer):
         # Jeśli User nie ma pola profile_picture, usuń je z poniższej listy
         fields = ['username', 'email']  # Dodaj 'profile_picture' jeśli istnieje
 
-# Jeśli masz model UserProfile z polem profile_picture, odkomentuj poniższy serializer
-# class ProfilePictureSerializer(serializers.ModelSerializer):
-#     class Meta:
-#         model = UserProfile
-#         fields = ['profile_picture']
-
-from .models import Mood, DayEntry, TodoItem, UserProfile
+from .models import Mood, DayEntry, TodoItem, UserProfile, MoodStat, Tombstone, RecurringTodo
+from .catalog import mood_catalog
+from .signals import bulk_write
+from .sync import SYNC_BATCH_SIZE, SYNC_MAX_BATCH_SIZE, delete_with_tombstones
+from .metrics import TimedListSerializer, TimedSerializerMixin
 
 class MoodSerializer(serializers.ModelSerializer):
     class Meta:
         model = Mood
         fields = ['id', 'name', 'icon']
 
-class TodoItemSerializer(serializers.ModelSerializer):
+# journal serializers time their output as the serialize span of the request metrics (metrics.py)
+class TodoItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = TodoItem
-        fields = ['id', 'user', 'day_entry', 'content', 'is_done']
+        fields = ['id', 'user', 'day_entry', 'content', 'is_done', 'remind_at']
+        list_serializer_class = TimedListSerializer
+
+# --- bulk todo sync ---
 
-class DayEntrySerializer(serializers.ModelSerializer):
-    mood = MoodSerializer(read_only=True)
-    mood_id = serializers.PrimaryKeyRelatedField(
-        queryset=Mood.objects.all(), source='mood', write_only=True, required=False
+class TodoItemListSerializer(TimedListSerializer):
+    # one INSERT for the whole list instead of one per item
+    def create(self, validated_data):
+        todos = [
+            TodoItem(
+                user=self.context['user'],
+                day_entry=self.context['day_entry'],
+                **attrs,
+            )
+            for attrs in validated_data
+        ]
+        return TodoItem.objects.bulk_create(todos)
+
+class TodoItemBulkSerializer(TodoItemSerializer):
+    class Meta(TodoItemSerializer.Meta):
+        read_only_fields = ['user', 'day_entry']
+        list_serializer_class = TodoItemListSerializer
+
+class TodoItemBulkUpdateSerializer(serializers.Serializer):
+    # edit and/or toggle, only the given fields are changed
+    id = serializers.IntegerField()
+    content = serializers.CharField(max_length=255, required=False)
+    is_done = serializers.BooleanField(required=False)
+    remind_at = serializers.DateTimeField(required=False, allow_null=True)
+
+class TodoBulkSerializer(serializers.Serializer):
+    create = TodoItemBulkSerializer(many=True, required=False)
+    update = TodoItemBulkUpdateSerializer(many=True, required=False)
+    delete = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+    def validate(self, attrs):
+        update_ids = [item['id'] for item in attrs.get('update', [])]
+        delete_ids = attrs.get('delete', [])
+        if len(set(update_ids)) != len(update_ids):
+            raise serializers.ValidationError("Each todo can be updated only once per request.")
+        if set(update_ids) & set(delete_ids):
+            raise serializers.ValidationError("A todo cannot be updated and deleted in the same request.")
+
+        ids = set(update_ids) | set(delete_ids)
+        self.existing = {
+            todo.pk: todo
+            for todo in TodoItem.objects.filter(day_entry=self.context['day_entry'], pk__in=ids)
+        }
+        missing = ids - self.existing.keys()
+        if missing:
+            raise serializers.ValidationError(
+                f"Todos not found for this day: {', '.join(map(str, sorted(missing)))}."
+            )
+        return attrs
+
+    @transaction.atomic
+    def save(self):
+        data = self.validated_data
+
+        with bulk_write(TodoItem, self.context['user'].pk) as dates:
+            dates.add(self.context['day_entry'].date)
+            if data.get('update'):
+                changed, fields = [], set()
+                for item in data['update']:
+                    todo = self.existing[item['id']]
+                    if 'remind_at' in item and item['remind_at'] != todo.remind_at:
+                        todo.reminder_sent_at = None
+                        fields.add('reminder_sent_at')
+                    for field in ('content', 'is_done', 'remind_at'):
+                        if field in item:
+                            setattr(todo, field, item[field])
+                            fields.add(field)
+                    changed.append(todo)
+                if fields:
+                    # bulk_update() skips auto_now, delta sync relies on it
+                    now = timezone.now()
+                    for todo in changed:
+                        todo.updated_at = now
+                    TodoItem.objects.bulk_update(changed, sorted(fields | {'updated_at'}))
+
+            if data.get('delete'):
+                delete_with_tombstones(TodoItem.objects.filter(pk__in=data['delete']), Tombstone.KIND_TODO)
+
+            if data.get('create'):
+                self.fields['create'].create(data['create'])
+
+        return TodoItem.objects.filter(day_entry=self.context['day_entry']).order_by('id')
+
+# mood fields served from the in-process catalog (catalog.py), no DB hit per entry
+class CachedMoodField(serializers.Field):
+    def __init__(self, **kwargs):
+        kwargs.setdefault('source', 'mood_id')
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return mood_catalog.representation(value)
+
+class MoodCatalogField(serializers.PrimaryKeyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        mood = mood_catalog.get(pk)
+        if mood is None:
+            self.fail('does_not_exist', pk_value=data)
+        return mood
+
+class DayEntrySerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    mood = CachedMoodField()
+    mood_id = MoodCatalogField(
+        queryset=Mood.objects.all(), source='mood', write_only=True, required=False, allow_null=True
     )
     todos = TodoItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = DayEntry
         fields = ['id', 'user', 'date', 'mood', 'mood_id', 'description', 'todos']
+        list_serializer_class = TimedListSerializer
+
+# create/update of the journal endpoints, the owner always comes from the request
+class DayEntryWriteSerializer(DayEntrySerializer):
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+
+    def save(self, **kwargs):
+        # the catalog of this worker may still hold a mood another worker deleted (catalog.py),
+        # the FK check at the commit is the first to know
+        try:
+            with transaction.atomic():
+                return super().save(**kwargs)
+        except IntegrityError:
+            mood = self.validated_data.get('mood')
+            if mood is None or mood.pk in mood_catalog.reload().moods:
+                raise
+            raise serializers.ValidationError({'mood_id': [f'Invalid pk "{mood.pk}" - object does not exist.']})
+
+class TodoItemWriteSerializer(TodoItemSerializer):
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+
+    def validate_day_entry(self, value):
+        # someone else's entry looks the same as a missing one
+        if value is not None and value.user_id != self.context['request'].user.pk:
+            raise serializers.ValidationError(f'Invalid pk "{value.pk}" - object does not exist.')
+        return value
+
+    def validate(self, attrs):
+        # a new reminder time is a new reminder (reminders.py)
+        if 'remind_at' in attrs and (self.instance is None or attrs['remind_at'] != self.instance.remind_at):
+            attrs['reminder_sent_at'] = None
+        return attrs
+
+# ?from=&to= query params of the calendar view
+class DayRangeSerializer(serializers.Serializer):
+    MAX_DAYS = 366
+
+    def get_fields(self):
+        # 'from' is a python keyword, so the fields can't be declared as attributes
+        return {
+            'from': serializers.DateField(),
+            'to': serializers.DateField(),
+        }
+
+    def validate(self, attrs):
+        if attrs['to'] < attrs['from']:
+            raise serializers.ValidationError("'to' must not be earlier than 'from'.")
+        if (attrs['to'] - attrs['from']).days >= self.MAX_DAYS:
+            raise serializers.ValidationError(f"Date range cannot exceed {self.MAX_DAYS} days.")
+        return attrs
+
+# ?period=month&from=&to= query params of the stats view
+class StatsQuerySerializer(serializers.Serializer):
+    period = serializers.ChoiceField(choices=MoodStat.PERIOD_CHOICES, default=MoodStat.PERIOD_MONTH)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        fields['from'] = serializers.DateField(required=False)
+        fields['to'] = serializers.DateField(required=False)
+        return fields
+
+# ?day_entry= query param of the todo list
+class TodoQuerySerializer(serializers.Serializer):
+    day_entry = serializers.IntegerField(required=False)
+
+# ?q=&limit= query params of the search view
+class SearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(max_length=200)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=20)
+
+# rows of the delta sync (sync.py), todos come as their own list
+class SyncDayEntrySerializer(DayEntrySerializer):
+    class Meta(DayEntrySerializer.Meta):
+        fields = ['id', 'date', 'mood', 'description', 'updated_at']
+
+class SyncTodoItemSerializer(TodoItemSerializer):
+    class Meta(TodoItemSerializer.Meta):
+        fields = ['id', 'day_entry', 'content', 'is_done', 'remind_at', 'updated_at']
+
+# ?since=&limit= query params of the sync view
+class SyncQuerySerializer(serializers.Serializer):
+    since = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(min_value=1, max_value=SYNC_MAX_BATCH_SIZE, default=SYNC_BATCH_SIZE)
+
+# --- repeating todos (recurrence.py) ---
+
+# [0, 2, 4] (Monday = 0) <-> the RecurringTodo.weekdays bitmask
+class WeekdaysField(serializers.ListField):
+    child = serializers.IntegerField(min_value=0, max_value=6)
+
+    def to_representation(self, value):
+        return [day for day in range(7) if value & (1 << day)]
+
+    def to_internal_value(self, data):
+        return sum(1 << day for day in set(super().to_internal_value(data)))
+
+class RecurringTodoSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    user = serializers.HiddenField(default=serializers.CurrentUserDefault())
+    weekdays = WeekdaysField(required=False)
+
+    class Meta:
+        model = RecurringTodo
+        fields = ['id', 'user', 'content', 'freq', 'interval', 'start_date', 'until', 'count', 'weekdays']
+        extra_kwargs = {
+            'interval': {'min_value': 1, 'max_value': 999},
+            'count': {'min_value': 1},
+        }
+        list_serializer_class = TimedListSerializer
+
+    def validate(self, attrs):
+        # partial updates are checked together with the stored values
+        def value(field):
+            return attrs[field] if field in attrs else getattr(self.instance, field, None)
+
+        if value('until') is not None and value('count') is not None:
+            raise serializers.ValidationError("Use either 'until' or 'count', not both.")
+        if value('until') is not None and value('until') < value('start_date'):
+            raise serializers.ValidationError("'until' must not be earlier than 'start_date'.")
+        if value('weekdays') and value('freq') != RecurringTodo.FREQ_WEEKLY:
+            raise serializers.ValidationError("'weekdays' can only be set for weekly repeats.")
+        return attrs
+
+# PUT of one occurrence, only the given fields change; content null = the rule's content again
+class OccurrenceOverrideSerializer(serializers.Serializer):
+    is_done = serializers.BooleanField(required=False)
+    is_skipped = serializers.BooleanField(required=False)
+    content = serializers.CharField(max_length=255, required=False, allow_null=True)
 
 class UserProfileSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
@@ -266,6 +406,11 @@ class UserProfileSerializer(serializers.ModelSerializer):
         model = UserProfile
         fields = ['user', 'profile_picture']
 
+class ProfilePictureSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UserProfile
+        fields = ['profile_picture']
+
 
 # password_reset_request
 class PasswordResetRequestSerializer(serializers.Serializer):
@@ -284,25 +429,12 @@ class SetNewPasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(write_only=True)
     new_password_confirm = serializers.CharField(write_only=True)
 
-    def validate_password(self, value):
-        if len(value) < 8:
-            raise serializers.ValidationError("Password must be at least 8 characters long.")
-        if not re.search(r'[A-Z]', value):
-            raise serializers.ValidationError("Password must contain an uppercase letter.")
-        if not re.search(r'[a-z]', value):
-            raise serializers.ValidationError("Password must contain a lowercase letter.")
-        if not re.search(r'\d', value):
-            raise serializers.ValidationError("Password must contain a digit.")
-        if not re.search(r'[^\w\s]', value):
-            raise serializers.ValidationError("Password must contain a special character.")
-        return value
-
     # validation if new password is the same as new password confirm
     def validate(self, attrs):
         if attrs['new_password'] != attrs['new_password_confirm']:
             raise serializers.ValidationError("Passwords do not match.")
         
-        self.validate_password(attrs['new_password'])
+        validate_new_password(attrs['new_password'])
         return attrs
 
     #saving new password
@@ -313,7 +445,7 @@ class SetNewPasswordSerializer(serializers.Serializer):
         try:
             uid = smart_str(urlsafe_base64_decode(uid))
             user = User.objects.get(pk=uid)
-        except (DjangoUnicodeDecodeError, User.DoesNotExist):
+        except (DjangoUnicodeDecodeError, ValueError, User.DoesNotExist):
             raise serializers.ValidationError("Invalid token or uid.")
 
         if not PasswordResetTokenGenerator().check_token(user, token):
@@ -335,29 +467,15 @@ class ChangePasswordSerializer(serializers.Serializer):
             raise serializers.ValidationError("Old password is incorrect.")
         return value
 
-    def validate_password(self, value):
-        if len(value) < 8:
-            raise serializers.ValidationError("Password must be at least 8 characters long.")
-        if not re.search(r'[A-Z]', value):
-            raise serializers.ValidationError("Password must contain an uppercase letter.")
-        if not re.search(r'[a-z]', value):
-            raise serializers.ValidationError("Password must contain a lowercase letter.")
-        if not re.search(r'\d', value):
-            raise serializers.ValidationError("Password must contain a digit.")
-        if not re.search(r'[^\w\s]', value):
-            raise serializers.ValidationError("Password must contain a special character.")
-        return value
-
     def validate(self, attrs):
         if attrs['new_password'] != attrs['new_password_confirm']:
             raise serializers.ValidationError("Passwords do not match.")
         
         # Validate password strength
-        self.validate_password(attrs['new_password'])
+        validate_new_password(attrs['new_password'], self.context['request'].user)
         
-        # Check if new password is different from old password
-        user = self.context['request'].user
-        if user.check_password(attrs['new_password']):
+        # old_password is already verified, comparing the plain texts saves a second hash
+        if attrs['new_password'] == attrs['old_password']:
             raise serializers.ValidationError("New password cannot be the same as the old password.")
         
         return attrs
@@ -365,6 +483,6 @@ class ChangePasswordSerializer(serializers.Serializer):
     def save(self):
         user = self.context['request'].user
         user.set_password(self.validated_data['new_password'])
-        user.save()
+        user.save(update_fields=['password'])
         return user
     
\ No newline at end of file
@@ -0,0 +1,340 @@
+import datetime
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from .authentication import user_cache
+from .catalog import mood_catalog
+from .live import live_hub
+from . import media
+from .models import DayEntry, Mood, MoodStat, RecurringTodo, RecurringTodoOverride, Tombstone, TodoItem, UserProfile
+from .stats import apply_delta, entry_todo_counts, rebuild_user_stats
+from .versioning import bump_data_version
+
+User = get_user_model()
+
+# sent by bulk writes (bulk_create/bulk_update/queryset.update) which skip model signals
+journal_changed = Signal()  # kwargs: user_id, dates (set of affected DayEntry dates)
+
+_bulk_write = ContextVar('bulk_write', default=False)
+
+
+@contextmanager
+def bulk_write(sender, user_id):
+    """
+    Turns off the per-row signal handling (e.g. for queryset.delete()) during a bulk operation
+    and sends a single journal_changed at the end if the operation succeeded.
+    Yields a set the caller adds the dates of the changed days to.
+    """
+    dates = set()
+    token = _bulk_write.set(True)
+    try:
+        yield dates
+    finally:
+        _bulk_write.reset(token)
+    journal_changed.send(sender=sender, user_id=user_id, dates=dates)
+
+
+@contextmanager
+def purging_account():
+    """
+    Like bulk_write, without journal_changed: the rows of an account being purged (purge.py) need no
+    statistics, versions, events or tombstones, just as when the user is deleted.
+    """
+    token = _bulk_write.set(True)
+    try:
+        yield
+    finally:
+        _bulk_write.reset(token)
+
+
+def _skip(origin):
+    # bulk operations report through journal_changed, rows of a deleted user need nothing
+    return _bulk_write.get() or isinstance(origin, User)
+
+
+def _deleted_with_entry(origin):
+    return isinstance(origin, DayEntry) or (isinstance(origin, QuerySet) and origin.model is DayEntry)
+
+
+@receiver([post_save, post_delete], sender=Mood)
+def invalidate_mood_catalog(sender, **kwargs):
+    # after the commit: invalidated earlier, a concurrent request could reload and keep the old rows
+    transaction.on_commit(mood_catalog.invalidate)
+
+
+@receiver([post_save, post_delete], sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # password change, deactivation, deletion, username/email edits
+    user_cache.invalidate(instance.pk)
+
+
+@receiver(post_init, sender=User)
+def remember_loaded_credentials(sender, instance, **kwargs):
+    # from __dict__, like remember_loaded_picture: deferred fields stay deferred
+    instance._loaded_credentials = (instance.__dict__.get('password'), instance.__dict__.get('is_active'))
+
+
+@receiver(post_save, sender=User)
+def revoke_cached_user(sender, instance, created=False, raw=False, **kwargs):
+    # tokens of a changed password or a deactivated account must fail in every process, not after the TTL
+    if raw or created or instance._loaded_credentials == (instance.password, instance.is_active):
+        return
+    instance._loaded_credentials = (instance.password, instance.is_active)
+    user_id = instance.pk
+    transaction.on_commit(lambda: user_cache.revoke(user_id))
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: user_cache.revoke(user_id))
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_cached_profile(sender, instance, **kwargs):
+    user_cache.invalidate(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=UserProfile)
+@receiver([post_save, post_delete], sender=DayEntry)
+@receiver([post_save, post_delete], sender=TodoItem)
+def bump_version_on_write(sender, instance, origin=None, **kwargs):
+    if _skip(origin):
+        return
+    bump_data_version(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=RecurringTodo)
+def bump_version_on_rule_write(sender, instance, origin=None, **kwargs):
+    # the version keys the expanded occurrences (recurrence.py)
+    if _skip(origin):
+        return
+    bump_data_version(instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=RecurringTodoOverride)
+def bump_version_on_override_write(sender, instance, origin=None, **kwargs):
+    # overrides deleted with their rule are covered by the rule's bump
+    if _skip(origin) or isinstance(origin, RecurringTodo):
+        return
+    bump_data_version(instance.rule.user_id)
+
+
+@receiver(post_save, sender=User)
+def bump_version_on_user_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    # username/email are part of the profile response, last_login is not
+    if raw or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    bump_data_version(instance.pk)
+
+
+@receiver(journal_changed)
+def bump_version_on_bulk_write(sender, user_id, **kwargs):
+    bump_data_version(user_id)
+
+
+# --- mood statistics rollup (stats.py) ---
+
+def _entry_bucket(day_entry_id):
+    return DayEntry.objects.filter(pk=day_entry_id).values_list('date', 'mood_id').first()
+
+
+@receiver(pre_save, sender=DayEntry)
+def remember_entry_bucket(sender, instance, raw=False, **kwargs):
+    instance._stats_bucket = None
+    if instance.pk and not raw and not _bulk_write.get():
+        instance._stats_bucket = _entry_bucket(instance.pk)
+
+
+@receiver(post_save, sender=DayEntry)
+def update_stats_on_entry_save(sender, instance, raw=False, **kwargs):
+    if raw or _bulk_write.get():
+        return
+    date = instance.date
+    if isinstance(date, str):
+        date = datetime.date.fromisoformat(date)
+    before = getattr(instance, '_stats_bucket', None)
+    after = (date, instance.mood_id)
+    if before == after:
+        return
+    if before is None:
+        apply_delta(instance.user_id, *after, entries=1)
+        return
+    total, done = entry_todo_counts(instance.pk)
+    apply_delta(instance.user_id, *before, entries=-1, todos_total=-total, todos_done=-done)
+    apply_delta(instance.user_id, *after, entries=1, todos_total=total, todos_done=done)
+
+
+@receiver(pre_delete, sender=DayEntry)
+def update_stats_on_entry_delete(sender, instance, origin=None, **kwargs):
+    # runs before the cascade, so the entry's todos are still there to count
+    if _skip(origin):
+        return
+    total, done = entry_todo_counts(instance.pk)
+    apply_delta(instance.user_id, instance.date, instance.mood_id, entries=-1, todos_total=-total, todos_done=-done)
+
+
+@receiver(pre_save, sender=TodoItem)
+def remember_todo_bucket(sender, instance, raw=False, **kwargs):
+    instance._stats_state = None
+    if instance.pk and not raw and not _bulk_write.get():
+        instance._stats_state = TodoItem.objects.filter(pk=instance.pk).values_list('day_entry_id', 'is_done').first()
+
+
+@receiver(post_save, sender=TodoItem)
+def update_stats_on_todo_save(sender, instance, raw=False, **kwargs):
+    if raw or _bulk_write.get():
+        return
+    before = getattr(instance, '_stats_state', None)
+    after = (instance.day_entry_id, bool(instance.is_done))
+    if before == after:
+        return
+    if before and before[0]:
+        bucket = _entry_bucket(before[0])
+        if bucket:
+            apply_delta(instance.user_id, *bucket, todos_total=-1, todos_done=-int(before[1]))
+    if after[0]:
+        bucket = _entry_bucket(after[0])
+        if bucket:
+            apply_delta(instance.user_id, *bucket, todos_total=1, todos_done=int(after[1]))
+
+
+@receiver(post_delete, sender=TodoItem)
+def update_stats_on_todo_delete(sender, instance, origin=None, **kwargs):
+    if _skip(origin) or _deleted_with_entry(origin) or not instance.day_entry_id:
+        return
+    bucket = _entry_bucket(instance.day_entry_id)
+    if bucket:
+        apply_delta(instance.user_id, *bucket, todos_total=-1, todos_done=-int(instance.is_done))
+
+
+@receiver(pre_delete, sender=Mood)
+def remember_mood_stat_users(sender, instance, **kwargs):
+    instance._stats_users = list(
+        MoodStat.objects.filter(mood=instance).values_list('user_id', flat=True).distinct()
+    )
+
+
+@receiver(post_delete, sender=Mood)
+def rebuild_stats_on_mood_delete(sender, instance, **kwargs):
+    # entries of a deleted mood fall back to "no mood"
+    for user_id in getattr(instance, '_stats_users', []):
+        rebuild_user_stats(user_id)
+
+
+@receiver(journal_changed)
+def rebuild_stats_on_bulk_write(sender, user_id, dates=None, **kwargs):
+    rebuild_user_stats(user_id, dates)
+
+
+# --- live updates for the user's other devices (live.py) ---
+
+def _publish(user_id, kind, data):
+    if not live_hub.listening(user_id):
+        return
+    # after commit, so a device refetching on the event sees the change; a failure must not fail the request
+    transaction.on_commit(lambda: live_hub.publish(user_id, kind, data), robust=True)
+
+
+@receiver([post_save, post_delete], sender=DayEntry)
+def publish_entry_change(sender, instance, signal, origin=None, raw=False, **kwargs):
+    if raw or _skip(origin):
+        return
+    op = 'deleted' if signal is post_delete else 'saved'
+    _publish(instance.user_id, 'day', {'op': op, 'id': instance.pk, 'date': instance.date})
+
+
+@receiver([post_save, post_delete], sender=TodoItem)
+def publish_todo_change(sender, instance, signal, origin=None, raw=False, **kwargs):
+    # todos deleted with their day are covered by the day's event
+    if raw or _skip(origin) or _deleted_with_entry(origin):
+        return
+    op = 'deleted' if signal is post_delete else 'saved'
+    _publish(instance.user_id, 'todo', {'op': op, 'id': instance.pk, 'day_entry': instance.day_entry_id})
+
+
+@receiver(journal_changed)
+def publish_bulk_change(sender, user_id, dates=None, **kwargs):
+    # import, bulk todo sync: the devices refetch these days (all of them without dates)
+    _publish(user_id, 'journal', {'op': 'changed', 'dates': sorted(dates) if dates else None})
+
+
+# --- delta sync (sync.py) ---
+
+@receiver(post_delete, sender=DayEntry)
+@receiver(post_delete, sender=TodoItem)
+def record_tombstone(sender, instance, origin=None, **kwargs):
+    # bulk deletes record theirs with sync.delete_with_tombstones(), a deleted user has no devices left
+    if _skip(origin):
+        return
+    kind = Tombstone.KIND_DAY if sender is DayEntry else Tombstone.KIND_TODO
+    Tombstone.objects.create(user_id=instance.user_id, kind=kind, object_id=instance.pk)
+
+
+@receiver(post_save, sender=User)
+def touch_profile_on_user_save(sender, instance, created=False, raw=False, update_fields=None, **kwargs):
+    # username/email are synced with the profile, a new user has none yet
+    if raw or created or (update_fields and set(update_fields) == {'last_login'}):
+        return
+    UserProfile.objects.filter(user_id=instance.pk).update(updated_at=timezone.now())
+
+
+@receiver(pre_delete, sender=Mood)
+def touch_entries_on_mood_delete(sender, instance, **kwargs):
+    # the entries fall back to "no mood" through an UPDATE without signals
+    DayEntry.objects.filter(mood=instance).update(updated_at=timezone.now())
+
+
+# --- content-addressed profile pictures (media.py) ---
+
+_UNCHANGED = object()
+
+
+def _picture_name(value):
+    return getattr(value, 'name', value) or ''
+
+
+@receiver(post_init, sender=UserProfile)
+def remember_loaded_picture(sender, instance, **kwargs):
+    # from __dict__: reading a deferred field here would query for every loaded profile
+    instance._loaded_picture = _picture_name(instance.__dict__.get('profile_picture'))
+
+
+@receiver(pre_save, sender=UserProfile)
+def remember_replaced_picture(sender, instance, raw=False, **kwargs):
+    instance._replaced_picture = _UNCHANGED
+    if raw:
+        return
+    picture = instance.profile_picture
+    if instance.pk is None:
+        instance._replaced_picture = None
+    elif not picture._committed or picture.name != instance._loaded_picture:
+        # a new upload or another name; read the stored one, the instance may come from the user cache
+        instance._replaced_picture = (
+            UserProfile.objects.filter(pk=instance.pk).values_list('profile_picture', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=UserProfile)
+def count_picture_references(sender, instance, **kwargs):
+    replaced = instance.__dict__.pop('_replaced_picture', _UNCHANGED)
+    name = instance.profile_picture.name
+    instance._loaded_picture = name
+    if replaced is _UNCHANGED or replaced == name:
+        return
+    media.retain(name)
+    if replaced:
+        media.release(replaced)
+
+
+@receiver(post_delete, sender=UserProfile)
+def release_picture_on_profile_delete(sender, instance, **kwargs):
+    # also when the profile goes with its user
+    media.release(instance.profile_picture.name)
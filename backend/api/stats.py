@@ -0,0 +1,173 @@
+"""
+Mood and todo completion statistics, maintained incrementally in the MoodStat table.
+
+Writes of single DayEntry/TodoItem rows move the counters (signals in signals.py),
+bulk operations (journal_changed) recompute only the periods they touched.
+The statistics endpoint reads MoodStat only.
+"""
+import datetime
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.functions import TruncMonth, TruncWeek, TruncYear
+
+from .catalog import mood_catalog
+from .models import DayEntry, MoodStat, TodoItem
+
+PERIODS = (MoodStat.PERIOD_WEEK, MoodStat.PERIOD_MONTH, MoodStat.PERIOD_YEAR)
+
+TRUNCATE = {
+    MoodStat.PERIOD_WEEK: TruncWeek,
+    MoodStat.PERIOD_MONTH: TruncMonth,
+    MoodStat.PERIOD_YEAR: TruncYear,
+}
+
+# above this many separate ranges a partial rebuild is not worth it
+MAX_PARTIAL_RANGES = 50
+
+
+def period_start(period, date):
+    if period == MoodStat.PERIOD_WEEK:
+        return date - datetime.timedelta(days=date.weekday())
+    if period == MoodStat.PERIOD_MONTH:
+        return date.replace(day=1)
+    return date.replace(month=1, day=1)
+
+
+def period_end(period, start):
+    # first day after the period
+    if period == MoodStat.PERIOD_WEEK:
+        return start + datetime.timedelta(days=7)
+    if period == MoodStat.PERIOD_MONTH:
+        return (start + datetime.timedelta(days=32)).replace(day=1)
+    return start.replace(year=start.year + 1)
+
+
+@transaction.atomic
+def apply_delta(user_id, date, mood_id, entries=0, todos_total=0, todos_done=0):
+    """
+    Moves the counters of every period (week/month/year) the date belongs to, all of them or none.
+    """
+    if not (entries or todos_total or todos_done):
+        return
+    delta = {
+        'entries': F('entries') + entries,
+        'todos_total': F('todos_total') + todos_total,
+        'todos_done': F('todos_done') + todos_done,
+    }
+    for period in PERIODS:
+        start = period_start(period, date)
+        rows = MoodStat.objects.filter(user_id=user_id, period=period, period_start=start, mood_id=mood_id)
+        if rows.update(**delta):
+            continue
+        try:
+            # a savepoint: the unique constraint stops a concurrent first write of the same counter here
+            with transaction.atomic():
+                MoodStat.objects.create(
+                    user_id=user_id, period=period, period_start=start, mood_id=mood_id,
+                    entries=entries, todos_total=todos_total, todos_done=todos_done,
+                )
+        except IntegrityError:
+            rows.update(**delta)
+
+
+def entry_todo_counts(day_entry_id):
+    counts = TodoItem.objects.filter(day_entry_id=day_entry_id).aggregate(
+        total=Count('id'), done=Count('id', filter=Q(is_done=True)),
+    )
+    return counts['total'], counts['done']
+
+
+def _ranges(period, dates):
+    # merged [start, end) ranges of the periods containing the given dates
+    ranges = []
+    for start in sorted({period_start(period, date) for date in dates}):
+        end = period_end(period, start)
+        if ranges and ranges[-1][1] == start:
+            ranges[-1][1] = end
+        else:
+            ranges.append([start, end])
+    return ranges
+
+
+@transaction.atomic
+def rebuild_user_stats(user_id, dates=None):
+    """
+    Recomputes the user's rollup from scratch: all of it (dates=None) or only the periods containing the dates.
+    """
+    for period in PERIODS:
+        rows = MoodStat.objects.filter(user_id=user_id, period=period)
+        entries = DayEntry.objects.filter(user_id=user_id)
+        if dates is not None:
+            ranges = _ranges(period, dates)
+            if not ranges:
+                continue
+            if len(ranges) <= MAX_PARTIAL_RANGES:
+                entry_ranges, row_ranges = Q(), Q()
+                for start, end in ranges:
+                    entry_ranges |= Q(date__gte=start, date__lt=end)
+                    row_ranges |= Q(period_start__gte=start, period_start__lt=end)
+                entries = entries.filter(entry_ranges)
+                rows = rows.filter(row_ranges)
+        rows.delete()
+
+        truncate = TRUNCATE[period]
+        stats = {}
+        counts = entries.annotate(start=truncate('date')).values('start', 'mood_id').annotate(count=Count('id'))
+        for row in counts:
+            stats[row['start'], row['mood_id']] = MoodStat(
+                user_id=user_id, period=period, period_start=row['start'], mood_id=row['mood_id'],
+                entries=row['count'],
+            )
+        todo_counts = (
+            TodoItem.objects.filter(day_entry__in=entries)
+            .annotate(start=truncate('day_entry__date'))
+            .values('start', 'day_entry__mood_id')
+            .annotate(total=Count('id'), done=Count('id', filter=Q(is_done=True)))
+        )
+        for row in todo_counts:
+            stat = stats.get((row['start'], row['day_entry__mood_id']))
+            if stat is not None:
+                stat.todos_total = row['total']
+                stat.todos_done = row['done']
+        MoodStat.objects.bulk_create(stats.values(), batch_size=1000)
+
+
+def user_stats(user_id, period, date_from=None, date_to=None):
+    """
+    Statistics from the rollup: a list of periods with their mood distribution and share of completed todos.
+    """
+    rows = MoodStat.objects.filter(user_id=user_id, period=period)
+    if date_from:
+        rows = rows.filter(period_start__gte=period_start(period, date_from))
+    if date_to:
+        rows = rows.filter(period_start__lte=date_to)
+    rows = (
+        rows.values('period_start', 'mood_id')
+        .annotate(entries=Sum('entries'), todos_total=Sum('todos_total'), todos_done=Sum('todos_done'))
+        .order_by('period_start', 'mood_id')
+    )
+
+    periods = {}
+    for row in rows:
+        if not (row['entries'] or row['todos_total']):
+            continue
+        item = periods.setdefault(row['period_start'], {
+            'period_start': row['period_start'],
+            'entries': 0,
+            'todos_total': 0,
+            'todos_done': 0,
+            'moods': [],
+        })
+        item['entries'] += row['entries']
+        item['todos_total'] += row['todos_total']
+        item['todos_done'] += row['todos_done']
+        item['moods'].append({
+            'mood': mood_catalog.representation(row['mood_id']) if row['mood_id'] else None,
+            'entries': row['entries'],
+            'todos_total': row['todos_total'],
+            'todos_done': row['todos_done'],
+        })
+    for item in periods.values():
+        item['completion_rate'] = round(item['todos_done'] / item['todos_total'], 4) if item['todos_total'] else None
+    return list(periods.values())
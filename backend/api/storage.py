@@ -0,0 +1,103 @@
+"""
+Content-addressed storage of profile pictures.
+
+A file is named by the SHA-256 of its content (profile_pictures/ab/<sha256>.jpg), so an image uploaded
+many times or by many users is stored once, and a name never gets other content: such files are
+served with `Cache-Control: immutable` (media_view, or the web server in production). Derived files
+(thumbnails, thumbnails.py) sit next to it under the original's name with a suffix, written by save_derived.
+
+Reference counts and deletion of unused files: media.py.
+"""
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+# Cache-Control max-age of media files (media_view in views.py, the web server in production),
+# content-addressed ones are immutable
+MEDIA_IMMUTABLE_MAX_AGE = getattr(settings, 'MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 3600)
+MEDIA_MAX_AGE = getattr(settings, 'MEDIA_MAX_AGE', 3600)
+
+# <sha256>.<ext> or a derived <sha256>_<suffix>.<ext>
+CONTENT_ADDRESSED_RE = re.compile(r'(?:^|/)[0-9a-f]{64}(?:_[\w-]+)?\.\w+$')
+
+
+def is_content_addressed(name):
+    return bool(name) and CONTENT_ADDRESSED_RE.search(name) is not None
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+@deconstructible(path='api.storage.ContentAddressedStorage')
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    FileSystemStorage that ignores the client's file name (except for the extension) and never overwrites files.
+    """
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()[:10]
+        digest = content_hash(content)
+        name = posixpath.join(directory, digest[:2], digest + extension)
+        if self.exists(name):
+            # already stored: refresh the mtime, media.collect() leaves recently saved files alone
+            os.utime(self.path(name))
+        else:
+            self._write(name, content)
+        return name
+
+    def save_derived(self, name, content):
+        # thumbnails and the like, stored under the name they are given
+        self._write(name, content)
+        return name
+
+    def derived_names(self, name):
+        if not is_content_addressed(name):
+            return []
+        directory, filename = posixpath.split(name)
+        prefix = posixpath.splitext(filename)[0] + '_'
+        try:
+            _, files = self.listdir(directory)
+        except FileNotFoundError:
+            return []
+        return [posixpath.join(directory, file) for file in files if file.startswith(prefix)]
+
+    def age(self, name):
+        # seconds since the file was last saved
+        return time.time() - os.path.getmtime(self.path(name))
+
+    def _write(self, name, content):
+        # a temporary file renamed into place: readers never see half a file, two writers of
+        # the same content just replace one copy with the other
+        path = self.path(name)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, temporary = tempfile.mkstemp(dir=directory, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                for chunk in content.chunks():
+                    file.write(chunk)
+            if self.file_permissions_mode is not None:
+                os.chmod(temporary, self.file_permissions_mode)
+            os.replace(temporary, path)
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+
+avatar_storage = ContentAddressedStorage()
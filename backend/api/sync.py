@@ -0,0 +1,123 @@
+"""
+Delta sync for offline clients: /api/sync/?since=<token>.
+
+Every kind of data (days, todos, profile, deletions) has its own (updated_at, id) cursor
+in the token; the query uses the (user, updated_at, id) index, so the cost depends on the number
+of changes since the last sync, not on the length of the history. A response holds at most `limit`
+rows of each kind; has_more = true means the client should ask again with `next` right away.
+
+Rows changed within the last SYNC_SETTLE_SECONDS are sent, but the cursor does not move past them:
+a transaction that set an earlier updated_at may not have committed yet.
+The client then gets them again and simply overwrites them.
+"""
+import base64
+import datetime
+import json
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DayEntry, TodoItem, Tombstone, UserProfile
+
+SYNC_BATCH_SIZE = getattr(settings, 'SYNC_BATCH_SIZE', 200)
+SYNC_MAX_BATCH_SIZE = 1000
+SYNC_SETTLE_SECONDS = getattr(settings, 'SYNC_SETTLE_SECONDS', 5)
+SYNC_TOMBSTONE_DAYS = getattr(settings, 'SYNC_TOMBSTONE_DAYS', 90)
+
+KINDS = ('days', 'todos', 'profile', 'deleted')
+
+
+class InvalidSyncToken(Exception):
+    pass
+
+
+class SyncTokenExpired(Exception):
+    pass
+
+
+def encode_token(cursors):
+    cursors = {kind: cursor for kind, cursor in cursors.items() if cursor is not None}
+    raw = json.dumps({kind: [at.isoformat(), pk] for kind, (at, pk) in cursors.items()}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_token(token):
+    if not token:
+        return {}
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return {kind: (datetime.datetime.fromisoformat(raw[kind][0]), int(raw[kind][1])) for kind in raw if kind in KINDS}
+    except (TypeError, ValueError, KeyError, IndexError, AttributeError):
+        raise InvalidSyncToken
+
+
+def changes_after(queryset, time_field, cursor, limit, horizon):
+    """
+    Returns (rows, new cursor, has_more) for the rows after `cursor` in (time_field, id) order.
+    """
+    if cursor is not None:
+        at, pk = cursor
+        # the redundant >= gives SQLite a range on the index, the OR alone scans all rows of the user
+        queryset = queryset.filter(**{f'{time_field}__gte': at}).filter(Q(**{f'{time_field}__gt': at}) | Q(id__gt=pk))
+    rows = list(queryset.order_by(time_field, 'id')[:limit + 1])
+    full = len(rows) > limit
+    rows = rows[:limit]
+    settled = [row for row in rows if getattr(row, time_field) <= horizon]
+    if settled:
+        cursor = (getattr(settled[-1], time_field), settled[-1].pk)
+    if not full and (cursor is None or cursor[0] < horizon):
+        # everything up to the horizon has been seen, the token ages with the last sync, not the last change
+        cursor = (horizon, 0)
+    # a full batch ending in unsettled rows: the rest is newer still, it comes with the next sync
+    return rows, cursor, full and len(settled) == len(rows)
+
+
+def sync_changes(user, token=None, limit=SYNC_BATCH_SIZE):
+    """
+    The user's changes after the token: {'days', 'todos', 'profile', 'deleted', 'next', 'has_more'} (models, not JSON).
+    """
+    cursors = decode_token(token)
+    now = timezone.now()
+    # tombstones are pruned, an older token could miss deletions
+    if 'deleted' in cursors and cursors['deleted'][0] < now - datetime.timedelta(days=SYNC_TOMBSTONE_DAYS):
+        raise SyncTokenExpired
+    horizon = now - datetime.timedelta(seconds=SYNC_SETTLE_SECONDS)
+    if not cursors:
+        # a first sync gets current rows, deletions from before it mean nothing to the client
+        cursors['deleted'] = (horizon, 0)
+    sources = {
+        'days': (DayEntry.objects.filter(user=user), 'updated_at'),
+        'todos': (TodoItem.objects.filter(user=user), 'updated_at'),
+        'profile': (UserProfile.objects.filter(user=user).select_related('user'), 'updated_at'),
+        'deleted': (Tombstone.objects.filter(user=user), 'deleted_at'),
+    }
+    result, has_more = {}, False
+    for kind, (queryset, time_field) in sources.items():
+        rows, cursors[kind], more = changes_after(queryset, time_field, cursors.get(kind), limit, horizon)
+        result[kind] = rows
+        has_more = has_more or more
+    result['next'] = encode_token(cursors)
+    result['has_more'] = has_more
+    return result
+
+
+def tombstones_for(queryset, kind):
+    """
+    Tombstones for rows deleted in bulk (queryset.delete() within bulk_write, where per-row signals are skipped).
+    """
+    now = timezone.now()
+    return [
+        Tombstone(user_id=user_id, kind=kind, object_id=pk, deleted_at=now)
+        for pk, user_id in queryset.values_list('pk', 'user_id')
+    ]
+
+
+def delete_with_tombstones(queryset, kind):
+    tombstones = tombstones_for(queryset, kind)
+    queryset.delete()
+    Tombstone.objects.bulk_create(tombstones, batch_size=1000)
+
+
+def prune_tombstones(days=SYNC_TOMBSTONE_DAYS):
+    return Tombstone.objects.filter(deleted_at__lt=timezone.now() - datetime.timedelta(days=days)).delete()[0]
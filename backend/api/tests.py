@@ -1,3 +1,1194 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from types import ModuleType
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.core import mail
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.db import OperationalError, connection
+from django.db.models import QuerySet
+from django.test import AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import path
+from django.utils import timezone
+from django.utils.encoding import force_bytes
+from django.utils.http import urlsafe_base64_encode
+from PIL import Image
+from rest_framework.request import Request
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import async_views, fts, live, media, metrics, outbox, passwords, recurrence, search, stats, sync, thumbnails
+from .authentication import UserCache, user_cache
+from .catalog import mood_catalog
+from .journal_io import IMPORT_BATCH_SIZE, JournalImporter, import_journal
+from .throttling import TokenBucketStore, TokenBucketThrottle
+from .purge import request_account_deletion
+from .reminders import ReminderScheduler, pending_reminders
+from .signals import bulk_write
+from .stats import rebuild_user_stats
+from .storage import avatar_storage, is_content_addressed
+from .models import (
+    DayEntry, LiveTicket, Mood, MoodStat, OutgoingEmail, RecurringTodo, RecurringTodoOverride, StoredFile, TodoItem,
+    Tombstone, UserProfile,
+)
+from .versioning import get_data_version
+
+
+class OutboxTests(TestCase):
+    def queue(self, count):
+        for i in range(count):
+            outbox.enqueue_email(f"Message {i}", "Body", [f"user{i}@example.com"])
+
+    def test_claimed_emails_are_not_due_for_other_workers(self):
+        self.queue(5)
+        first = outbox.claim_emails(batch_size=3)
+        second = outbox.claim_emails(batch_size=3)
+        self.assertEqual(len(first), 3)
+        self.assertEqual(len(second), 2)
+        self.assertFalse({email.pk for email in first} & {email.pk for email in second})
+        self.assertEqual(outbox.claim_emails(batch_size=3), [])
+
+    def test_each_email_is_marked_as_it_is_sent(self):
+        self.queue(3)
+        emails = outbox.claim_emails()
+        sends = 0
+
+        def send(*args, **kwargs):
+            nonlocal sends
+            sends += 1
+            if sends == 2:
+                raise KeyboardInterrupt  # the worker dies halfway through the batch
+            return 1
+
+        with mock.patch('django.core.mail.EmailMessage.send', side_effect=send):
+            with self.assertRaises(KeyboardInterrupt):
+                outbox.send_batch(emails, mail.get_connection())
+
+        self.assertEqual(OutgoingEmail.objects.filter(status=OutgoingEmail.STATUS_SENT).count(), 1)
+        # the rest stays claimed until the lease runs out
+        self.assertEqual(outbox.claim_emails(), [])
+
+    def test_drain_sends_everything_once(self):
+        self.queue(4)
+        stats = outbox.drain(batch_size=3)
+        self.assertEqual(stats['sent'], 4)
+        self.assertEqual(len(mail.outbox), 4)
+        self.assertFalse(OutgoingEmail.objects.exclude(status=OutgoingEmail.STATUS_SENT).exists())
+        self.assertEqual(outbox.drain()['sent'], 0)
+
+
+class DayEntryRangeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('alice', 'alice@example.com', 'Secret123!')
+        mood = Mood.objects.create(name='happy', icon=':)')
+        days = DayEntry.objects.bulk_create(
+            DayEntry(user=cls.user, date=datetime.date(2024, 2, 1) + datetime.timedelta(days=i), mood=mood)
+            for i in range(28)
+        )
+        TodoItem.objects.bulk_create(
+            TodoItem(user=cls.user, day_entry=day, content=f'Task {j}') for day in days for j in range(3)
+        )
+
+    def setUp(self):
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.user)}'
+        # warms the per-process user and mood caches
+        self.client.get('/api/days/', {'from': '2024-01-01', 'to': '2024-01-31'})
+
+    def test_query_count_does_not_grow_with_the_range(self):
+        for to, entries in (('2024-02-03', 3), ('2024-02-29', 28)):
+            # data version (conditional GET), entries, todos
+            with self.assertNumQueries(3):
+                response = self.client.get('/api/days/', {'from': '2024-02-01', 'to': to})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.json()), entries)
+            self.assertEqual(len(response.json()[-1]['todos']), 3)
+
+
+class MoodCatalogTests(TestCase):
+    def setUp(self):
+        # the catalog lives for the whole process, other tests may have filled it
+        mood_catalog.invalidate()
+
+    def test_invalidated_after_commit(self):
+        mood_catalog.snapshot()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            Mood.objects.create(name='calm', icon='~')
+            # a request reading now would still see the committed rows
+            self.assertNotIn('calm', [item['name'] for item in mood_catalog.snapshot().data])
+        self.assertEqual(len(callbacks), 1)
+        self.assertIn('calm', [item['name'] for item in mood_catalog.snapshot().data])
+
+    def test_miss_reloads_a_mood_added_by_another_worker(self):
+        mood_catalog.snapshot()
+        # bulk_create sends no signal, like a write through another process
+        mood = Mood.objects.bulk_create([Mood(name='calm', icon='~')])[0]
+        with mock.patch('api.catalog.MOOD_CATALOG_MISS_RELOAD', 60):
+            self.assertIsNone(mood_catalog.get(mood.pk))
+        with mock.patch('api.catalog.MOOD_CATALOG_MISS_RELOAD', 0):
+            self.assertEqual(mood_catalog.get(mood.pk), mood)
+            self.assertEqual(mood_catalog.get_by_name(' Calm '), mood)
+
+
+# the FK check of SQLite is deferred to the commit, which a TestCase never reaches
+class MoodCatalogDeletedMoodTests(TransactionTestCase):
+    def test_write_with_a_mood_deleted_by_another_worker(self):
+        user = User.objects.create_user('stale', 'stale@example.com', 'password')
+        mood = Mood.objects.create(name='calm', icon='~')
+        mood_catalog.invalidate()
+        mood_catalog.snapshot()
+        with connection.cursor() as cursor:
+            # no signal, the catalog of this process keeps the mood
+            cursor.execute('DELETE FROM api_mood WHERE id = %s', [mood.pk])
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(user)}'
+
+        response = self.client.post('/api/days/', {'date': '2024-05-01', 'mood_id': mood.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('mood_id', response.json())
+        self.assertIsNone(mood_catalog.get(mood.pk))
+        self.assertFalse(DayEntry.objects.exists())
+
+
+class JournalExportTests(TestCase):
+    ENTRIES = 100_000
+    # the whole NDJSON export is ~11 MB
+    PEAK_BYTES = 4 * 1024 * 1024
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('bob', 'bob@example.com', 'Secret123!')
+        mood = Mood.objects.create(name='happy', icon=':)')
+        DayEntry.objects.bulk_create(
+            (
+                DayEntry(
+                    user=cls.user,
+                    date=datetime.date(1800, 1, 1) + datetime.timedelta(days=i),
+                    mood=mood,
+                    description=f'Day {i}: walked the dog, read a book and planned the week.',
+                )
+                for i in range(cls.ENTRIES)
+            ),
+            batch_size=5000,
+        )
+
+    def setUp(self):
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def measure(self, consume):
+        tracemalloc.start()
+        try:
+            lines = consume()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(lines, self.ENTRIES)
+        self.assertLess(peak, self.PEAK_BYTES)
+
+    def test_wsgi_export_streams_in_bounded_memory(self):
+        def consume():
+            response = self.client.get('/api/export/ndjson/', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            return sum(chunk.count(b'\n') for chunk in response.streaming_content)
+
+        self.measure(consume)
+
+    def test_asgi_export_streams_in_bounded_memory(self):
+        async def request():
+            response = await self.async_client.get('/api/export/ndjson/', headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.is_async)
+            return sum([chunk.count(b'\n') async for chunk in response])
+
+        self.measure(async_to_sync(request))
+
+
+class JournalImportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('carol', 'carol@example.com', 'Secret123!')
+        self.entry = DayEntry.objects.create(user=self.user, date=datetime.date(2024, 3, 1), description='old')
+        TodoItem.objects.create(user=self.user, day_entry=self.entry, content='keep me')
+
+    def run_import(self, *records, batch_size=IMPORT_BATCH_SIZE):
+        lines = ''.join(json.dumps(record) + '\n' for record in records)
+        return import_journal(self.user, io.BytesIO(lines.encode()), 'ndjson', batch_size=batch_size)
+
+    def test_days_without_todos_in_the_file_keep_theirs(self):
+        self.run_import({'date': '2024-03-01', 'description': 'new'})
+        self.entry.refresh_from_db()
+        self.assertEqual(self.entry.description, 'new')
+        self.assertEqual(list(self.entry.todos.values_list('content', flat=True)), ['keep me'])
+
+    def test_days_with_todos_in_the_file_get_exactly_those(self):
+        record = {'date': '2024-03-01', 'todos': [{'content': 'a'}, {'content': 'b', 'is_done': True}]}
+        self.run_import(record)
+        self.run_import(record)
+        self.assertEqual(sorted(self.entry.todos.values_list('content', flat=True)), ['a', 'b'])
+
+    def test_a_chunk_rejected_by_the_database_is_reported(self):
+        records = [{'date': f'2024-04-0{day}'} for day in range(1, 5)]
+        write = JournalImporter.write
+
+        def fail_second_chunk(importer, batch):
+            if batch[0][0] == 3:
+                raise OperationalError('database is locked')
+            return write(importer, batch)
+
+        with mock.patch.object(JournalImporter, 'write', fail_second_chunk):
+            report = self.run_import(*records, batch_size=2)
+        self.assertEqual(report['entries'], 2)
+        self.assertEqual(report['errors'], [{'line': 3, 'error': 'Lines 3-4 were not imported: database is locked'}])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('dave', 'dave@example.com', 'Secret123!')
+
+    def test_older_better_matches_rank_first(self):
+        start = datetime.date(2020, 1, 1)
+        best = DayEntry.objects.create(user=self.user, date=start, description='hiking hiking hiking')
+        DayEntry.objects.bulk_create(
+            DayEntry(
+                user=self.user,
+                date=start + datetime.timedelta(days=i),
+                description=f'day {i}: groceries, laundry, a short hiking trip and an early night',
+            )
+            for i in range(1, 400)
+        )
+        results = search.search_journal(self.user.pk, 'hiking', limit=5)
+        self.assertEqual(len(results), 5)
+        self.assertEqual(results[0]['id'], best.pk)
+
+    def test_ids_that_do_not_fit_the_rowid_are_not_indexed(self):
+        DayEntry.objects.create(user=self.user, date=datetime.date(2020, 1, 1), description='kayak')
+        DayEntry.objects.create(id=fts.MAX_ID, user=self.user, date=datetime.date(2020, 1, 2), description='kayak')
+        self.assertEqual(len(search.search_journal(self.user.pk, 'kayak')), 1)
+
+    def test_migrations_leave_the_current_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE '%_fts_%'")
+            installed = {' '.join(sql.split()) for sql, in cursor.fetchall()}
+        self.assertEqual(installed, {' '.join(sql.split()) for sql in fts.TRIGGERS})
+
+
+class _TestBucketThrottle(TokenBucketThrottle):
+    scope = 'test'
+    rate = '20/hour'
+
+
+def _consume_tokens(attempts, results):
+    request = Request(RequestFactory().post('/api/token/', REMOTE_ADDR='203.0.113.7'))
+    results.put(sum(_TestBucketThrottle().allow_request(request, None) for _ in range(attempts)))
+
+
+class TokenBucketThrottleTests(SimpleTestCase):
+    def test_limit_holds_across_processes(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = TokenBucketStore(os.path.join(directory, 'throttle.sqlite3'))
+            context = multiprocessing.get_context('fork')
+            results = context.Queue()
+            with mock.patch.object(_TestBucketThrottle, 'store', store):
+                workers = [context.Process(target=_consume_tokens, args=(25, results)) for _ in range(4)]
+                for worker in workers:
+                    worker.start()
+                allowed = [results.get(timeout=30) for _ in workers]
+                for worker in workers:
+                    worker.join()
+        # 100 attempts in 4 processes against one bucket of 20; a token refilled during the run at most
+        self.assertIn(sum(allowed), (20, 21))
+
+
+class PasswordResetThrottleTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        store = mock.patch.object(TokenBucketThrottle, 'store', TokenBucketStore(os.path.join(directory.name, 'throttle.sqlite3')))
+        store.start()
+        self.addCleanup(store.stop)
+
+    def test_confirm_has_its_own_bucket(self):
+        for _ in range(5):
+            response = self.client.post('/api/password-reset-request/', {'email': 'nobody@example.com'})
+            self.assertNotEqual(response.status_code, 429)
+        self.assertEqual(self.client.post('/api/password-reset-request/', {'email': 'nobody@example.com'}).status_code, 429)
+        # the link from the mail still works
+        response = self.client.post('/api/password-reset-confirm/', {'uidb64': 'x', 'token': 'x'})
+        self.assertEqual(response.status_code, 400)
+
+
+class CachedUserTests(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('erin', 'erin@example.com', 'Secret123!')
+        UserProfile.objects.create(user=user)
+        self.entry = user_cache.load(user.pk)
+
+    def test_request_copies_share_nothing_with_the_cache(self):
+        user = self.entry.copy()
+        self.assertIs(user.profile.user, user)
+        user.first_name = 'changed'
+        user.profile.user.last_name = 'changed'
+        user.profile.profile_picture.name = 'changed.png'
+        self.assertEqual(self.entry.user.first_name, '')
+        self.assertEqual(self.entry.user.last_name, '')
+        self.assertIsNot(self.entry.profile.user, user)
+        self.assertNotEqual(self.entry.profile.profile_picture.name, 'changed.png')
+
+    def test_missing_profile_is_cached_too(self):
+        UserProfile.objects.all().delete()
+        entry = user_cache.load(self.entry.user.pk)
+        with self.assertNumQueries(0), self.assertRaises(UserProfile.DoesNotExist):
+            entry.copy().profile
+
+
+class RevocationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('gina', 'gina@example.com', 'Secret123!')
+        path = os.path.join(tempfile.mkdtemp(), 'revocations')
+        # the log of a host that has seen revocations before, read by two workers
+        UserCache(revocations_path=path).revoke(0)
+        self.here, self.other = UserCache(revocations_path=path), UserCache(revocations_path=path)
+
+    def test_revocation_reaches_other_processes(self):
+        self.other.load(self.user.pk)
+        self.here.revoke(self.user.pk)
+        self.assertIsNone(self.other.get(self.user.pk))
+        self.other.load(self.user.pk)
+        self.assertIsNotNone(self.other.get(self.user.pk))
+
+    def test_only_the_revoked_user_is_dropped(self):
+        bystander = User.objects.create_user('hal', 'hal@example.com', 'Secret123!')
+        self.other.load(self.user.pk)
+        self.other.load(bystander.pk)
+        self.here.revoke(self.user.pk)
+        self.assertIsNone(self.other.get(self.user.pk))
+        self.assertIsNotNone(self.other.get(bystander.pk))
+
+    def test_log_is_started_anew(self):
+        with mock.patch('api.authentication.AUTH_REVOCATIONS_MAX_SIZE', 64):
+            for _ in range(50):
+                self.here.revoke(self.user.pk)
+            self.assertLessEqual(os.path.getsize(self.here.revocations_path), 64 + 10)
+            # missed the replaced logs: drops everything once, like a request would before loading
+            self.assertIsNone(self.other.get(self.user.pk))
+            self.other.load(self.user.pk)
+            self.assertIsNotNone(self.other.get(self.user.pk))
+            # the log is replaced by the next revocations, they still reach the other process
+            for _ in range(20):
+                self.here.revoke(self.user.pk + 1)
+            self.here.revoke(self.user.pk)
+        self.assertIsNone(self.other.get(self.user.pk))
+
+    def test_account_deletion_revokes_at_commit(self):
+        with mock.patch.object(user_cache, 'revoke') as revoke:
+            with self.captureOnCommitCallbacks(execute=True):
+                request_account_deletion(User.objects.get(pk=self.user.pk))
+            revoke.assert_called_once_with(self.user.pk)
+            revoke.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                User.objects.get(pk=self.user.pk).save(update_fields=['last_login'])
+            revoke.assert_not_called()
+
+
+class LiveTicketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', 'frank@example.com', 'Secret123!')
+        token = AccessToken.for_user(self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {token}'
+
+    def test_ticket_opens_one_stream(self):
+        response = self.client.post('/api/live/ticket/')
+        self.assertEqual(response.status_code, 201)
+        ticket = response.json()['ticket']
+        self.assertEqual(async_to_sync(live.aconsume_ticket)(ticket), self.user.pk)
+        self.assertIsNone(async_to_sync(live.aconsume_ticket)(ticket))
+
+    def test_expired_ticket_is_rejected(self):
+        ticket = live.issue_ticket(self.user)
+        LiveTicket.objects.update(expires_at=datetime.datetime(2000, 1, 1, tzinfo=datetime.timezone.utc))
+        self.assertIsNone(async_to_sync(live.aconsume_ticket)(ticket))
+
+    def test_nothing_is_published_without_listeners(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for backend in (live.LocalBackend(), live.SQLiteNotifyBackend(os.path.join(directory, 'live.sqlite3'))):
+                with mock.patch.object(live.live_hub, 'backend', backend), \
+                        mock.patch.object(live.live_hub, 'publish') as publish, \
+                        self.captureOnCommitCallbacks(execute=True):
+                    DayEntry.objects.create(user=self.user, date=datetime.date(2026, 1, 1))
+                publish.assert_not_called()
+                DayEntry.objects.all().delete()
+
+    def test_listeners_of_another_process(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'live.sqlite3')
+            # two processes: an ASGI one with the stream, a WSGI worker that writes
+            server, writer = live.BroadcastHub(live.SQLiteNotifyBackend(path)), live.BroadcastHub(live.SQLiteNotifyBackend(path))
+
+            async def stream():
+                subscription = await server.subscribe(self.user.pk)
+                try:
+                    listening = await sync_to_async(writer.listening, thread_sensitive=False)(self.user.pk)
+                    await sync_to_async(writer.publish, thread_sensitive=False)(self.user.pk, 'day', {'op': 'saved'})
+                    return listening, await asyncio.wait_for(subscription.queue.get(), 5)
+                finally:
+                    server.unsubscribe(subscription)
+
+            self.assertFalse(writer.listening(self.user.pk))
+            listening, event = async_to_sync(stream)()
+            self.assertTrue(listening)
+            self.assertEqual(event[1:], ('day', {'op': 'saved'}))
+            # the renewal of the hub thread drops users without streams
+            server._listen()
+            self.assertFalse(writer.listening(self.user.pk))
+
+    def test_stream_ends_after_a_password_change(self):
+        hub = live.BroadcastHub(live.LocalBackend())
+
+        async def stream():
+            events = live.event_stream(hub, self.user.pk, authorized=live.stream_authorization(self.user))
+            self.assertTrue((await events.__anext__()).startswith('retry:'))
+            hub._send(list(hub._subscriptions[self.user.pk]), live.PING)
+            self.assertEqual(await events.__anext__(), ': ping\n\n')
+            user = await User.objects.aget(pk=self.user.pk)
+            user.set_password('Another123!')
+            await user.asave()
+            hub._send(list(hub._subscriptions[self.user.pk]), live.PING)
+            last = await events.__anext__()
+            with self.assertRaises(StopAsyncIteration):
+                await events.__anext__()
+            return last
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(async_to_sync(stream)(), 'event: revoked\ndata: {}\n\n')
+        self.assertEqual(hub.connection_count(), 0)
+
+
+class RequestMetricsTests(TestCase):
+    # the middleware stays on in production; generous against noise, a real regression costs far more
+    OVERHEAD_BUDGET = 0.0005
+
+    @classmethod
+    def setUpTestData(cls):
+        Mood.objects.create(name='happy', icon=':)')
+
+    def median_request_time(self, url, rounds=5, per_round=40):
+        self.client.get(url)  # loads the middleware chain
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            for _ in range(per_round):
+                self.client.get(url)
+            samples.append((time.perf_counter() - started) / per_round)
+        return statistics.median(samples)
+
+    def test_overhead_per_request(self):
+        on = self.median_request_time('/api/moods/')
+        middleware = [name for name in settings.MIDDLEWARE if name != 'api.metrics.RequestMetricsMiddleware']
+        connection.execute_wrappers.remove(metrics.record_query)
+        try:
+            with override_settings(MIDDLEWARE=middleware):
+                off = self.median_request_time('/api/moods/')
+        finally:
+            connection.execute_wrappers.append(metrics.record_query)
+        self.assertLess(on - off, self.OVERHEAD_BUDGET)
+
+    def test_server_timing_header_is_opt_in(self):
+        self.assertNotIn('Server-Timing', self.client.get('/api/moods/'))
+        with mock.patch.object(metrics, 'SERVER_TIMING_HEADER', True):
+            self.assertIn('app;dur=', self.client.get('/api/moods/')['Server-Timing'])
+
+    def test_serializers_are_timed_apart_from_queries(self):
+        user = User.objects.create_user('kim', 'kim@example.com', 'Secret123!')
+        day = DayEntry.objects.create(user=user, date=datetime.date(2024, 1, 1), mood=Mood.objects.get())
+        TodoItem.objects.create(user=user, day_entry=day, content='read')
+        with mock.patch.object(metrics, 'SERVER_TIMING_HEADER', True):
+            response = self.client.get(
+                '/api/days/', {'from': '2024-01-01', 'to': '2024-01-31'},
+                headers={'Authorization': f'Bearer {AccessToken.for_user(user)}'},
+            )
+        durations = {name: float(value) for name, value in re.findall(r'(\w+);dur=([\d.]+)', response['Server-Timing'])}
+        self.assertGreater(durations['serialize'], 0)
+        # the components do not overlap: they add up to the total (header values are rounded to 0.01 ms)
+        parts = durations['db'] + durations['auth'] + durations['serialize'] + durations['app']
+        self.assertAlmostEqual(parts, durations['total'], delta=0.05)
+
+    def test_metrics_endpoint_needs_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with mock.patch.object(metrics, 'METRICS_TOKEN', 'scrape'):
+            self.assertEqual(self.client.get('/metrics').status_code, 401)
+            response = self.client.get('/metrics', headers={'Authorization': 'Bearer scrape'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'api_request_duration_seconds_bucket{view="metrics"', response.content)
+
+
+class SyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('erin', 'erin@example.com', 'Secret123!')
+
+    def sync(self, token=None, limit=sync.SYNC_BATCH_SIZE, settle=0):
+        # settle=0: everything the test wrote before the call has settled
+        with mock.patch.object(sync, 'SYNC_SETTLE_SECONDS', settle):
+            return sync.sync_changes(self.user, token, limit)
+
+    def test_deletions_come_back_as_tombstones(self):
+        day = DayEntry.objects.create(user=self.user, date=datetime.date(2024, 1, 1))
+        todo = TodoItem.objects.create(user=self.user, day_entry=day, content='water the plants')
+        first = self.sync()
+        self.assertEqual([row.pk for row in first['todos']], [todo.pk])
+        self.assertEqual(first['deleted'], [])
+
+        todo_pk = todo.pk
+        todo.delete()
+        second = self.sync(first['next'])
+        self.assertEqual(second['todos'], [])
+        self.assertEqual([(row.kind, row.object_id) for row in second['deleted']], [(Tombstone.KIND_TODO, todo_pk)])
+        self.assertEqual(self.sync(second['next'])['deleted'], [])
+
+    def test_first_sync_skips_older_deletions(self):
+        DayEntry.objects.create(user=self.user, date=datetime.date(2024, 1, 1)).delete()
+        self.assertEqual(self.sync()['deleted'], [])
+
+    def test_cursor_stays_behind_unsettled_rows(self):
+        day = DayEntry.objects.create(user=self.user, date=datetime.date(2024, 1, 1))
+        # written just now: sent, but the next sync sends it again
+        first = self.sync(settle=60)
+        self.assertEqual(first['days'], [day])
+        second = self.sync(first['next'], settle=60)
+        self.assertEqual(second['days'], [day])
+        # settled: sent once more, then the cursor moves past it
+        third = self.sync(second['next'])
+        self.assertEqual(third['days'], [day])
+        self.assertEqual(self.sync(third['next'])['days'], [])
+
+    def test_has_more_pages_through_every_change_once(self):
+        days = DayEntry.objects.bulk_create(
+            DayEntry(user=self.user, date=datetime.date(2024, 1, 1) + datetime.timedelta(days=i)) for i in range(5)
+        )
+        seen, pages, token = [], 0, None
+        while True:
+            changes = self.sync(token, limit=2)
+            seen += [row.pk for row in changes['days']]
+            pages += 1
+            token = changes['next']
+            if not changes['has_more']:
+                break
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, [day.pk for day in days])
+        self.assertEqual(self.sync(token, limit=2)['days'], [])
+
+    def test_invalid_and_expired_tokens(self):
+        with self.assertRaises(sync.InvalidSyncToken):
+            self.sync('not-a-token')
+        expired = timezone.now() - datetime.timedelta(days=sync.SYNC_TOMBSTONE_DAYS + 1)
+        with self.assertRaises(sync.SyncTokenExpired):
+            self.sync(sync.encode_token({'deleted': (expired, 0)}))
+
+
+class RecurrenceTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('frank', 'frank@example.com', 'Secret123!')
+
+    def rule(self, freq, start_date, **fields):
+        return RecurringTodo(user=self.user, content='stretch', freq=freq, start_date=start_date, **fields)
+
+    def dates(self, rule, start, end):
+        return list(recurrence.occurrence_dates(rule, start, end))
+
+    def test_daily_rule_from_the_middle(self):
+        rule = self.rule(RecurringTodo.FREQ_DAILY, datetime.date(2024, 1, 1), interval=3)
+        self.assertEqual(
+            self.dates(rule, datetime.date(2024, 1, 5), datetime.date(2024, 1, 12)),
+            [datetime.date(2024, 1, 7), datetime.date(2024, 1, 10)],
+        )
+
+    def test_weekly_rule_on_two_weekdays(self):
+        # Mondays and Thursdays every other week, starting on a Thursday
+        rule = self.rule(RecurringTodo.FREQ_WEEKLY, datetime.date(2024, 1, 4), interval=2, weekdays=0b1001)
+        self.assertEqual(
+            self.dates(rule, datetime.date(2024, 1, 1), datetime.date(2024, 2, 1)),
+            [datetime.date(2024, 1, d) for d in (4, 15, 18, 29)] + [datetime.date(2024, 2, 1)],
+        )
+
+    def test_monthly_rule_skips_months_without_the_day(self):
+        year = (datetime.date(2024, 1, 1), datetime.date(2024, 12, 31))
+        on_31st = self.rule(RecurringTodo.FREQ_MONTHLY, datetime.date(2024, 1, 31))
+        self.assertEqual([d.month for d in self.dates(on_31st, *year)], [1, 3, 5, 7, 8, 10, 12])
+        on_30th = self.rule(RecurringTodo.FREQ_MONTHLY, datetime.date(2024, 1, 30))
+        self.assertEqual([d.month for d in self.dates(on_30th, *year)], [1, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12])
+        on_29th = self.rule(RecurringTodo.FREQ_MONTHLY, datetime.date(2023, 1, 29), interval=13)
+        self.assertEqual(
+            self.dates(on_29th, datetime.date(2023, 1, 1), datetime.date(2030, 12, 31)),
+            # interval 13 moves on a month a year, its only February (2024) is in a leap year
+            [datetime.date(2023, 1, 29), datetime.date(2024, 2, 29), datetime.date(2025, 3, 29),
+             datetime.date(2026, 4, 29), datetime.date(2027, 5, 29), datetime.date(2028, 6, 29),
+             datetime.date(2029, 7, 29), datetime.date(2030, 8, 29)],
+        )
+
+    def test_count_and_until(self):
+        daily = self.rule(RecurringTodo.FREQ_DAILY, datetime.date(2024, 1, 1), count=5)
+        self.assertEqual(
+            self.dates(daily, datetime.date(2024, 1, 3), datetime.date(2024, 1, 31)),
+            [datetime.date(2024, 1, d) for d in (3, 4, 5)],
+        )
+        # January, March, May, July: months without a 31st do not use up the count
+        monthly = self.rule(RecurringTodo.FREQ_MONTHLY, datetime.date(2024, 1, 31), count=4)
+        self.assertEqual(self.dates(monthly, datetime.date(2024, 6, 1), datetime.date(2024, 12, 31)), [datetime.date(2024, 7, 31)])
+        weekly = self.rule(RecurringTodo.FREQ_WEEKLY, datetime.date(2024, 1, 1), until=datetime.date(2024, 1, 20))
+        self.assertEqual(
+            self.dates(weekly, datetime.date(2024, 1, 1), datetime.date(2024, 12, 31)),
+            [datetime.date(2024, 1, d) for d in (1, 8, 15)],
+        )
+
+    def test_windows_of_old_rules_match_the_full_expansion(self):
+        window = (datetime.date(2031, 1, 1), datetime.date(2034, 12, 31))
+        for day in (28, 29, 30, 31):
+            for interval in (1, 5, 12, 13):
+                rule = self.rule(RecurringTodo.FREQ_MONTHLY, datetime.date(1996, 1, day), interval=interval, count=300)
+                full = [d for d in self.dates(rule, rule.start_date, window[1]) if d >= window[0]]
+                self.assertEqual(self.dates(rule, *window), full, (day, interval))
+
+    def test_override_is_stored_only_while_it_differs(self):
+        rule = self.rule(RecurringTodo.FREQ_DAILY, datetime.date(2024, 1, 1))
+        rule.save()
+        date = datetime.date(2024, 1, 2)
+        occurrence = recurrence.override_occurrence(rule, date, {'is_done': True})
+        self.assertEqual((occurrence['is_done'], occurrence['overridden']), (True, True))
+        occurrence = recurrence.override_occurrence(rule, date, {'is_done': False, 'content': rule.content})
+        self.assertEqual((occurrence['is_done'], occurrence['overridden']), (False, False))
+        self.assertFalse(RecurringTodoOverride.objects.exists())
+        self.assertIsNone(recurrence.override_occurrence(rule, date, {'is_skipped': True}))
+        self.assertEqual(self.dates(rule, date, date), [date])  # the rule itself is unchanged
+
+    def test_cache_follows_the_data_version(self):
+        rule = self.rule(RecurringTodo.FREQ_DAILY, datetime.date(2024, 1, 1))
+        rule.save()
+        cache, span = recurrence.OccurrenceCache(), (datetime.date(2024, 1, 1), datetime.date(2024, 1, 3))
+        version = get_data_version(self.user.pk)[0]
+        self.assertEqual(len(cache.occurrences(self.user.pk, version, *span)), 3)
+        with self.assertNumQueries(0):
+            cache.occurrences(self.user.pk, version, *span)
+
+        recurrence.override_occurrence(rule, datetime.date(2024, 1, 2), {'is_done': True})
+        new_version = get_data_version(self.user.pk)[0]
+        self.assertNotEqual(new_version, version)
+        done = [occurrence['is_done'] for occurrence in cache.occurrences(self.user.pk, new_version, *span)]
+        self.assertEqual(done, [False, True, False])
+
+
+class ReminderSchedulerTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('grace', 'grace@example.com', 'Secret123!')
+        self.now = timezone.now()
+
+    def todo(self, minutes, **fields):
+        return TodoItem.objects.create(
+            user=self.user, content=f'in {minutes} min', remind_at=self.now + datetime.timedelta(minutes=minutes), **fields,
+        )
+
+    def test_overdue_reminders_are_delivered_once(self):
+        overdue = [self.todo(-minutes) for minutes in (90, 30, 5, 1, 0)]
+        self.todo(-10, reminder_sent_at=self.now - datetime.timedelta(minutes=9))
+        self.todo(5)
+        self.todo(24 * 60)  # outside the window
+        scheduler = ReminderScheduler(batch_size=2)
+
+        self.assertEqual(scheduler.tick(self.now), len(overdue))
+        self.assertEqual(OutgoingEmail.objects.count(), len(overdue))
+        self.assertEqual(scheduler.tick(self.now), 0)
+        # a second process, e.g. after a restart, finds nothing left either
+        self.assertEqual(ReminderScheduler().tick(self.now), 0)
+        self.assertEqual(scheduler.tick(self.now + datetime.timedelta(minutes=5)), 1)
+        self.assertEqual(OutgoingEmail.objects.count(), len(overdue) + 1)
+
+    def test_moved_reminder_waits_for_its_new_time(self):
+        todo = self.todo(1)
+        scheduler = ReminderScheduler()
+        scheduler.tick(self.now)
+        TodoItem.objects.filter(pk=todo.pk).update(remind_at=self.now + datetime.timedelta(minutes=20))
+        self.assertEqual(scheduler.tick(self.now + datetime.timedelta(minutes=2)), 0)
+        self.assertEqual(scheduler.tick(self.now + datetime.timedelta(minutes=21)), 1)
+
+    def test_failed_batch_is_not_marked_as_sent(self):
+        todos = [self.todo(-minutes) for minutes in (3, 2, 1)]
+        scheduler = ReminderScheduler()
+        with mock.patch.object(OutgoingEmail.objects, 'bulk_create', side_effect=OperationalError('disk I/O error')):
+            with self.assertRaises(OperationalError):
+                scheduler.tick(self.now)
+        self.assertEqual(pending_reminders().count(), len(todos))
+        self.assertFalse(OutgoingEmail.objects.exists())
+        # run() reloads right after a failure, the popped reminders are queued again
+        scheduler.next_reload = self.now
+        self.assertEqual(scheduler.tick(self.now), len(todos))
+        self.assertEqual(OutgoingEmail.objects.count(), len(todos))
+
+
+def png(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (4, 4), color).save(buffer, 'PNG')
+    return ContentFile(buffer.getvalue(), name='me.png')
+
+
+class ContentAddressedMediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        # files saved within the grace period are kept, here everything was just saved
+        grace = mock.patch.object(media, 'MEDIA_GC_GRACE_SECONDS', 0)
+        grace.start()
+        self.addCleanup(grace.stop)
+        self.first, self.second = (
+            UserProfile.objects.create(user=User.objects.create_user(name, f'{name}@example.com', 'Secret123!'))
+            for name in ('heidi', 'ivan')
+        )
+
+    def upload(self, profile, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.profile_picture.save('me.png', content)
+        return profile.profile_picture.name
+
+    def refcount(self, name):
+        return StoredFile.objects.filter(name=name).values_list('refcount', flat=True).first()
+
+    def test_same_content_is_stored_once(self):
+        name = self.upload(self.first, png('red'))
+        self.assertEqual(self.upload(self.second, png('red')), name)
+        self.assertTrue(is_content_addressed(name))
+        self.assertEqual(self.refcount(name), 2)
+        self.assertEqual(os.listdir(os.path.dirname(avatar_storage.path(name))), [os.path.basename(name)])
+
+    def test_replaced_picture_is_released_and_deleted_when_unused(self):
+        shared = self.upload(self.first, png('red'))
+        self.upload(self.second, png('red'))
+        self.upload(self.first, png('blue'))
+        self.assertEqual(self.refcount(shared), 1)
+        self.assertTrue(avatar_storage.exists(shared))
+
+        self.upload(self.second, png('green'))
+        self.assertIsNone(self.refcount(shared))
+        self.assertFalse(avatar_storage.exists(shared))
+
+    def test_deleted_profile_releases_its_picture(self):
+        name = self.upload(self.first, png('red'))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.user.delete()
+        self.assertIsNone(self.refcount(name))
+        self.assertFalse(avatar_storage.exists(name))
+
+
+def mood_rollup(user_id):
+    # incremental updates may leave rows at zero where a rebuild has none
+    rows = MoodStat.objects.filter(user_id=user_id).exclude(entries=0, todos_total=0, todos_done=0)
+    return sorted(
+        rows.values_list('period', 'period_start', 'mood_id', 'entries', 'todos_total', 'todos_done'),
+        key=lambda row: (row[0], row[1], row[2] or 0),
+    )
+
+
+class TodoBulkTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('judy', 'judy@example.com', 'Secret123!')
+        mood = Mood.objects.create(name='happy', icon=':)')
+        self.day = DayEntry.objects.create(user=self.user, date=datetime.date(2024, 5, 6), mood=mood)
+        self.todos = [TodoItem.objects.create(user=self.user, day_entry=self.day, content=f'Task {i}') for i in range(3)]
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.user)}'
+
+    def bulk(self, payload):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(f'/api/days/{self.day.pk}/todos/bulk/', payload, content_type='application/json')
+
+    def sync(self, token=None):
+        with mock.patch.object(sync, 'SYNC_SETTLE_SECONDS', 0):
+            return sync.sync_changes(self.user, token)
+
+    def test_create_update_and_delete_in_one_request(self):
+        keep, toggle, drop = self.todos
+        token = self.sync()['next']
+        version = get_data_version(self.user.pk)[0]
+
+        response = self.bulk({
+            'create': [{'content': 'New', 'is_done': True}],
+            'update': [{'id': toggle.pk, 'content': 'Toggled', 'is_done': True}],
+            'delete': [drop.pk],
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(todo['content'], todo['is_done']) for todo in response.json()],
+            [('Task 0', False), ('Toggled', True), ('New', True)],
+        )
+        created = response.json()[-1]['id']
+
+        self.assertGreater(get_data_version(self.user.pk)[0], version)
+        changes = self.sync(token)
+        self.assertEqual(sorted(todo.pk for todo in changes['todos']), [toggle.pk, created])
+        self.assertEqual([(row.kind, row.object_id) for row in changes['deleted']], [(Tombstone.KIND_TODO, drop.pk)])
+
+        month = MoodStat.objects.get(user=self.user, period=MoodStat.PERIOD_MONTH)
+        self.assertEqual((month.entries, month.todos_total, month.todos_done), (1, 3, 2))
+        rollup = mood_rollup(self.user.pk)
+        rebuild_user_stats(self.user.pk)
+        self.assertEqual(rollup, mood_rollup(self.user.pk))
+
+    def test_rejected_request_writes_nothing(self):
+        other_day = DayEntry.objects.create(user=self.user, date=datetime.date(2024, 5, 7))
+        foreign = TodoItem.objects.create(user=self.user, day_entry=other_day, content='elsewhere')
+        version = get_data_version(self.user.pk)[0]
+        for payload in (
+            {'create': [{'content': 'x'}], 'update': [{'id': foreign.pk, 'is_done': True}]},
+            {'update': [{'id': self.todos[0].pk, 'is_done': True}], 'delete': [self.todos[0].pk]},
+            {'update': [{'id': self.todos[0].pk, 'is_done': True}, {'id': self.todos[0].pk, 'content': 'twice'}]},
+        ):
+            self.assertEqual(self.bulk(payload).status_code, 400)
+        self.assertEqual(TodoItem.objects.count(), 4)
+        self.assertFalse(TodoItem.objects.filter(is_done=True).exists())
+        self.assertEqual(get_data_version(self.user.pk)[0], version)
+
+
+class ConditionalGetTests(TestCase):
+    URL = '/api/days/?from=2024-01-01&to=2024-01-31'
+
+    def setUp(self):
+        self.user = User.objects.create_user('ivy', 'ivy@example.com', 'Secret123!')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.user)}'
+        DayEntry.objects.create(user=self.user, date=datetime.date(2024, 1, 1))
+
+    def test_unchanged_data_is_not_modified(self):
+        response = self.client.get(self.URL)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+        response = self.client.get(self.URL, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+        # another range of the same data is another representation
+        other = self.client.get('/api/days/?from=2024-02-01&to=2024-02-28', headers={'If-None-Match': etag})
+        self.assertEqual(other.status_code, 200)
+
+    def test_write_in_the_same_second_changes_the_etag(self):
+        etag = self.client.get(self.URL)['ETag']
+        # well within the second of the first response: only the ETag tells them apart
+        DayEntry.objects.create(user=self.user, date=datetime.date(2024, 1, 2))
+        response = self.client.get(
+            self.URL, headers={'If-None-Match': etag, 'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        self.assertNotEqual(response['ETag'], etag)
+        # without an ETag the date alone is never trusted
+        response = self.client.get(self.URL, headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_mood_changes_change_the_etag_of_entries(self):
+        mood_catalog.invalidate()
+        etag = self.client.get(self.URL)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            Mood.objects.create(name='calm', icon='~')
+        self.assertEqual(self.client.get(self.URL, headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_profile(self):
+        etag = self.client.get('/api/profile/')['ETag']
+        self.assertEqual(self.client.get('/api/profile/', headers={'If-None-Match': etag}).status_code, 304)
+        self.user.email = 'ivy@example.org'
+        self.user.save(update_fields=['email'])
+        self.assertEqual(self.client.get('/api/profile/', headers={'If-None-Match': etag}).status_code, 200)
+
+
+class DayEntryHistoryTests(TestCase):
+    URL = '/api/days/history/'
+
+    def setUp(self):
+        self.user = User.objects.create_user('jo', 'jo@example.com', 'Secret123!')
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.user)}'
+        start = datetime.date(2024, 1, 1)
+        DayEntry.objects.bulk_create(
+            [DayEntry(user=self.user, date=start + datetime.timedelta(days=i)) for i in range(25)]
+        )
+
+    def page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_cursor_round_trip(self):
+        page = self.page(self.URL, limit=10)
+        self.assertEqual(set(page), {'next', 'results'})
+        dates = [entry['date'] for entry in page['results']]
+        while page['next']:
+            page = self.page(page['next'])
+            dates += [entry['date'] for entry in page['results']]
+        expected = DayEntry.objects.filter(user=self.user).order_by('-date').values_list('date', flat=True)
+        self.assertEqual(dates, [date.isoformat() for date in expected])
+
+    def test_insert_between_pages_does_not_shift_the_next_page(self):
+        first = self.page(self.URL, limit=10)
+        second = self.page(first['next'])
+        DayEntry.objects.create(user=self.user, date=datetime.date(2024, 6, 1))
+        DayEntry.objects.filter(date=datetime.date(2024, 1, 25)).delete()
+        self.assertEqual(self.page(first['next']), second)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not-a-cursor', 'W251bGwsIDFd', 'WzFd'):  # garbage, [null, 1], [1]
+            response = self.client.get(self.URL, {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'detail': 'Invalid cursor'})
+
+    def test_limit_is_capped(self):
+        DayEntry.objects.bulk_create(
+            [DayEntry(user=self.user, date=datetime.date(2020, 1, 1) + datetime.timedelta(days=i)) for i in range(300)]
+        )
+        self.assertEqual(len(self.page(self.URL, limit=1000)['results']), 200)
+        self.assertEqual(len(self.page(self.URL, limit='x')['results']), 50)
+
+
+class ThumbnailTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root, ignore_errors=True)
+        media_settings = override_settings(MEDIA_ROOT=media_root)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.user = User.objects.create_user('kai', 'kai@example.com', 'Secret123!')
+        self.profile = UserProfile.objects.create(user=self.user)
+        self.client.defaults['HTTP_AUTHORIZATION'] = f'Bearer {AccessToken.for_user(self.user)}'
+        # jobs run right away in this thread, on the test's connection
+        executor = mock.patch.object(thumbnails._executor, 'submit', side_effect=lambda fn, *args: fn(*args))
+        executor.start()
+        self.addCleanup(executor.stop)
+        close = mock.patch.object(thumbnails.connections, 'close_all')
+        close.start()
+        self.addCleanup(close.stop)
+        self.addCleanup(thumbnails._retry_after.clear)
+
+    def thumbnails(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.get('/api/profile/').json()['profile_picture_thumbnails']
+
+    def test_job_lost_with_its_process_is_redone_on_read(self):
+        # uploaded, then the process went away before the job ran
+        with mock.patch.object(thumbnails, 'submit'), self.captureOnCommitCallbacks(execute=True):
+            self.profile.profile_picture.save('me.png', png('red'))
+            thumbnails.schedule_thumbnails(self.profile)
+        self.assertEqual(self.thumbnails(), {})
+        urls = self.thumbnails()
+        self.assertEqual(sorted(urls), sorted(str(size) for size in thumbnails.THUMBNAIL_SIZES))
+        name = self.profile.profile_picture.name
+        for size in thumbnails.THUMBNAIL_SIZES:
+            self.assertTrue(avatar_storage.exists(thumbnails.thumbnail_name(name, size)))
+
+    def test_failed_job_waits_before_the_next_try(self):
+        with mock.patch.object(thumbnails, 'submit'), self.captureOnCommitCallbacks(execute=True):
+            self.profile.profile_picture.save('me.png', ContentFile(b'not an image', name='me.png'))
+        with mock.patch.object(thumbnails, 'process_profile_picture', wraps=thumbnails.process_profile_picture) as process, \
+                self.assertLogs('api.thumbnails', 'ERROR'):
+            self.assertEqual(self.thumbnails(), {})
+            self.assertEqual(self.thumbnails(), {})
+            self.assertEqual(process.call_count, 1)
+            with mock.patch.object(thumbnails.time, 'monotonic', return_value=time.monotonic() + thumbnails.THUMBNAIL_RETRY_DELAY + 1):
+                self.thumbnails()
+            self.assertEqual(process.call_count, 2)
+        self.assertEqual(thumbnails._in_flight, set())
+
+
+class MoodStatTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('lee', 'lee@example.com', 'Secret123!')
+        self.happy, self.sad = Mood.objects.create(name='happy', icon=':)'), Mood.objects.create(name='sad', icon=':(')
+
+    def assertMatchesRebuild(self):
+        incremental = mood_rollup(self.user.pk)
+        rebuild_user_stats(self.user.pk)
+        self.assertEqual(incremental, mood_rollup(self.user.pk))
+
+    def test_single_writes(self):
+        # across a week, a month and a year boundary
+        days = [
+            DayEntry.objects.create(user=self.user, date=datetime.date(2024, 12, 30), mood=self.happy),
+            DayEntry.objects.create(user=self.user, date=datetime.date(2025, 1, 1), mood=self.sad),
+            DayEntry.objects.create(user=self.user, date=datetime.date(2025, 1, 2)),
+        ]
+        todos = [TodoItem.objects.create(user=self.user, day_entry=day, content='x') for day in days for _ in range(2)]
+        todos[0].is_done = True
+        todos[0].save()
+        todos[1].day_entry = days[2]
+        todos[1].save()
+        days[1].mood = None
+        days[1].save()
+        days[2].mood = self.happy
+        days[2].date = datetime.date(2025, 2, 1)
+        days[2].save()
+        todos[3].delete()
+        days[0].delete()
+        self.assertMatchesRebuild()
+
+    def test_bulk_writes(self):
+        DayEntry.objects.create(user=self.user, date=datetime.date(2024, 3, 1), mood=self.sad)
+        lines = '\n'.join(
+            json.dumps({'date': f'2024-03-{day:02d}', 'mood': 'happy' if day % 2 else 'sad', 'todos': [
+                {'content': 'a', 'is_done': day % 3 == 0}, {'content': 'b'},
+            ]})
+            for day in range(1, 29)
+        )
+        import_journal(self.user, io.BytesIO(lines.encode()), 'ndjson', batch_size=10)
+        with bulk_write(TodoItem, self.user.pk) as dates:
+            done = TodoItem.objects.filter(user=self.user, content='b', day_entry__date__day__lte=10)
+            dates.update(done.values_list('day_entry__date', flat=True))
+            done.update(is_done=True)
+        self.assertMatchesRebuild()
+
+    def test_concurrent_first_write_of_a_counter(self):
+        date = datetime.date(2024, 5, 6)
+        # inserted by another request...
+        stats.apply_delta(self.user.pk, date, self.happy.pk, entries=1)
+        update, calls = QuerySet.update, []
+
+        def update_before_the_insert(queryset, **kwargs):
+            # ...which committed right after the first UPDATE of every counter here found nothing
+            calls.append(queryset)
+            return 0 if len(calls) % 2 else update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, 'update', autospec=True, side_effect=update_before_the_insert):
+            stats.apply_delta(self.user.pk, date, self.happy.pk, entries=1)
+        self.assertEqual(len(calls), 6)
+        rows = MoodStat.objects.filter(user=self.user)
+        self.assertEqual(sorted(rows.values_list('period', 'entries')), [('month', 2), ('week', 2), ('year', 2)])
+
+
+# the async views hash in a pool thread with its own connection, it only sees committed rows
+class AsyncAuthViewTests(TransactionTestCase):
+    PASSWORD = 'Secret123!'
+    NEW_PASSWORD = 'Quite-Another-Secret-42'
+
+    def setUp(self):
+        self.user = User.objects.create_user('mel', 'mel@example.com', self.PASSWORD)
+        urlconf = ModuleType('async_auth_urls')
+        urlconf.urlpatterns = [
+            path('login/', async_views.AsyncTokenObtainPairView.as_view(throttle_classes=[])),
+            path('password-change/', async_views.AsyncChangePasswordView.as_view(throttle_classes=[])),
+            path('password-reset-confirm/', async_views.AsyncSetNewPasswordView.as_view(throttle_classes=[])),
+        ]
+        urls = override_settings(ROOT_URLCONF=urlconf)
+        urls.enable()
+        self.addCleanup(urls.disable)
+        self.client = AsyncClient()
+
+    def hashing_threads(self):
+        # names of the threads that verified a password
+        threads = []
+        check_password = User.check_password
+
+        def recorded(user, raw_password):
+            threads.append(threading.current_thread().name)
+            return check_password(user, raw_password)
+
+        return threads, mock.patch.object(User, 'check_password', autospec=True, side_effect=recorded)
+
+    async def test_login(self):
+        threads, patch = self.hashing_threads()
+        with patch:
+            response = await self.client.post('/login/', {'username': 'mel', 'password': self.PASSWORD}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()), {'access', 'refresh'})
+        self.assertEqual(len(threads), 1)
+        self.assertTrue(threads[0].startswith('password-hasher'))
+
+        response = await self.client.post('/login/', {'username': 'mel', 'password': 'wrong'}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+        self.assertIn('detail', response.json())
+
+    async def test_change_password(self):
+        token = str(AccessToken.for_user(self.user))
+        headers = {'Authorization': f'Bearer {token}'}
+        change = {'old_password': 'wrong', 'new_password': self.NEW_PASSWORD, 'new_password_confirm': self.NEW_PASSWORD}
+        response = await self.client.post('/password-change/', change, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('old_password', response.json())
+
+        threads, patch = self.hashing_threads()
+        with patch:
+            response = await self.client.post(
+                '/password-change/', {**change, 'old_password': self.PASSWORD}, content_type='application/json', headers=headers,
+            )
+        self.assertEqual(response.status_code, 200)
+        # the old password is verified once, "same as the old one" compares the plain texts
+        self.assertEqual(len(threads), 1)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.check_password(self.NEW_PASSWORD))
+        # the token carries the old password's hash
+        response = await self.client.post('/password-change/', change, content_type='application/json', headers=headers)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+
+    async def test_change_password_needs_a_token(self):
+        response = await self.client.post('/password-change/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 401)
+
+    async def test_reset_confirm(self):
+        payload = {
+            'uidb64': urlsafe_base64_encode(force_bytes(self.user.pk)),
+            'token': await sync_to_async(PasswordResetTokenGenerator().make_token)(self.user),
+            'new_password': self.NEW_PASSWORD,
+            'new_password_confirm': self.NEW_PASSWORD,
+        }
+        response = await self.client.post('/password-reset-confirm/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        user = await User.objects.aget(pk=self.user.pk)
+        self.assertTrue(user.check_password(self.NEW_PASSWORD))
+        # the token was bound to the old password
+        response = await self.client.post('/password-reset-confirm/', payload, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class BreachedPasswordValidatorTests(SimpleTestCase):
+    BREACHED = ['Summer2024!', 'P@ssw0rd123', 'Qwerty!2345']
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'breached.bloom')
+        self.validator = passwords.BreachedPasswordValidator(self.path)
+
+    def build(self, words):
+        passwords.build_bloom_filter((passwords.password_digest(word) for word in words), len(words), self.path)
+
+    def test_listed_password_is_rejected(self):
+        self.build(self.BREACHED)
+        for word in self.BREACHED:
+            with self.assertRaises(ValidationError) as raised:
+                self.validator.validate(word)
+            self.assertEqual(raised.exception.code, 'password_breached')
+
+    def test_other_password_passes(self):
+        self.build(self.BREACHED)
+        self.validator.validate('Unlisted#Horse42')
+
+    def test_common_passwords_without_a_filter(self):
+        with self.assertRaises(ValidationError) as raised:
+            self.validator.validate('password')
+        self.assertEqual(raised.exception.code, 'password_too_common')
+        self.validator.validate('Unlisted#Horse42')
+
+    def test_replaced_filter_is_picked_up_and_the_map_before_closed(self):
+        self.build(self.BREACHED[:1])
+        first = self.validator.passwords.get()
+        self.validator.validate(self.BREACHED[1])
+        for words in (self.BREACHED[:2], self.BREACHED):
+            time.sleep(0.01)  # another mtime
+            self.build(words)
+            self.validator.passwords.get()
+        with self.assertRaises(ValidationError):
+            self.validator.validate(self.BREACHED[2])
+        self.assertTrue(first.data.closed)
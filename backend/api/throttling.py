@@ -0,0 +1,116 @@
+"""
+Throttling shared by all processes (gunicorn workers) without an external service.
+
+The limits live in a separate SQLite file (THROTTLE_DB_PATH) with one row per key:
+a token bucket holding num_requests, refilled at num_requests / duration.
+A check is one atomic INSERT ... ON CONFLICT DO UPDATE ... RETURNING,
+so the cost does not grow with the number of requests, and the limit holds globally.
+"""
+import os
+import sqlite3
+import threading
+
+from django.conf import settings
+from rest_framework.throttling import SimpleRateThrottle
+
+THROTTLE_DB_PATH = getattr(settings, 'THROTTLE_DB_PATH', os.path.join(settings.BASE_DIR, 'throttle.sqlite3'))
+THROTTLE_DB_TIMEOUT = getattr(settings, 'THROTTLE_DB_TIMEOUT', 5)
+# buckets untouched for a day are full again, so their rows can go
+THROTTLE_IDLE_SECONDS = 86400
+THROTTLE_PRUNE_EVERY = 1000
+
+_REFILLED = 'min(:capacity, tokens + max(:now - updated_at, 0) * :rate)'
+
+_CONSUME = f"""
+    INSERT INTO token_bucket (key, tokens, updated_at, allowed) VALUES (:key, :capacity - 1, :now, 1)
+    ON CONFLICT (key) DO UPDATE SET
+        tokens = CASE WHEN {_REFILLED} >= 1 THEN {_REFILLED} - 1 ELSE {_REFILLED} END,
+        allowed = {_REFILLED} >= 1,
+        updated_at = max(:now, updated_at)
+    RETURNING allowed, tokens
+"""
+
+
+class TokenBucketStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def connection(self):
+        # one connection per thread, opened again after a fork
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=THROTTLE_DB_TIMEOUT, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            # losing the last few updates on power loss is fine for rate limits
+            conn.execute('PRAGMA synchronous=OFF')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS token_bucket ('
+                'key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL, allowed INTEGER NOT NULL'
+                ') WITHOUT ROWID'
+            )
+            local.conn, local.pid, local.calls = conn, os.getpid(), 0
+        return local.conn
+
+    def consume(self, key, capacity, rate, now):
+        """
+        Takes one token from the bucket `key`; returns (allowed, tokens left).
+        """
+        conn = self.connection()
+        allowed, tokens = conn.execute(_CONSUME, {'key': key, 'capacity': capacity, 'rate': rate, 'now': now}).fetchone()
+        self._local.calls += 1
+        if self._local.calls % THROTTLE_PRUNE_EVERY == 0:
+            conn.execute('DELETE FROM token_bucket WHERE updated_at < ?', [now - THROTTLE_IDLE_SECONDS])
+        return bool(allowed), tokens
+
+    def reset(self):
+        self.connection().execute('DELETE FROM token_bucket')
+
+
+token_buckets = TokenBucketStore(THROTTLE_DB_PATH)
+
+
+class TokenBucketThrottle(SimpleRateThrottle):
+    """
+    SimpleRateThrottle with a token bucket in a shared SQLite file instead of a list
+    of timestamps in the process cache. The rate comes from DEFAULT_THROTTLE_RATES[scope], e.g. '5/minute'.
+    Key: the authenticated user or the IP address.
+    """
+    store = token_buckets
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+        return self.cache_format % {'scope': self.scope, 'ident': ident}
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+        self.refill_rate = self.num_requests / self.duration
+        allowed, self.tokens = self.store.consume(self.key, self.num_requests, self.refill_rate, self.timer())
+        return allowed
+
+    def wait(self):
+        return max(0.0, (1 - self.tokens) / self.refill_rate)
+
+
+class LoginRateThrottle(TokenBucketThrottle):
+    scope = 'login'
+
+
+class RegisterRateThrottle(TokenBucketThrottle):
+    scope = 'register'
+
+
+class PasswordResetRateThrottle(TokenBucketThrottle):
+    scope = 'password_reset'
+
+
+# own bucket: the link from the mail must work after the requests that sent it used up theirs
+class PasswordResetConfirmRateThrottle(TokenBucketThrottle):
+    scope = 'password_reset_confirm'
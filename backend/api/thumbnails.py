@@ -0,0 +1,143 @@
+"""
+Thumbnails of profile pictures, generated in a thread pool after the upload commits.
+
+The profile row is the record of the work: thumbnails_for differs from profile_picture until the
+thumbnails exist. A job lost with its process (restart, crash) or failed is submitted again by the
+next read of the profile (thumbnail_urls), at most once per THUMBNAIL_RETRY_DELAY after a failure;
+`manage.py generate_thumbnails` does the pictures nobody reads.
+"""
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import DEFAULT_AVATAR, UserProfile
+from .storage import ContentAddressedStorage, is_content_addressed
+from .versioning import bump_data_version
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_SIZES = getattr(settings, 'THUMBNAIL_SIZES', (64, 128, 256))
+THUMBNAIL_FORMAT = getattr(settings, 'THUMBNAIL_FORMAT', 'WEBP')
+THUMBNAIL_QUALITY = getattr(settings, 'THUMBNAIL_QUALITY', 80)
+THUMBNAIL_WORKERS = getattr(settings, 'THUMBNAIL_WORKERS', 2)
+THUMBNAIL_RETRY_DELAY = getattr(settings, 'THUMBNAIL_RETRY_DELAY', 300)
+
+_executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix='thumbnails')
+# (profile id, picture name) of this process: submitted and not done, failed -> monotonic time of the next try
+_in_flight = set()
+_retry_after = {}
+_lock = threading.Lock()
+
+
+def thumbnail_name(name, size):
+    # profile_pictures/me.jpg -> profile_pictures/me_64.webp
+    root, _ = os.path.splitext(name)
+    return f'{root}_{size}.{THUMBNAIL_FORMAT.lower()}'
+
+
+def generate_thumbnails(name, storage):
+    content_addressed = isinstance(storage, ContentAddressedStorage)
+    if content_addressed and is_content_addressed(name) and all(
+        storage.exists(thumbnail_name(name, size)) for size in THUMBNAIL_SIZES
+    ):
+        # the same picture was uploaded before, its thumbnails are there already
+        return
+    with storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+
+    for size in THUMBNAIL_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, THUMBNAIL_FORMAT, quality=THUMBNAIL_QUALITY, method=6)
+        target = thumbnail_name(name, size)
+        if content_addressed:
+            # stored next to the original under its hash, see storage.py
+            storage.save_derived(target, ContentFile(buffer.getvalue()))
+            continue
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+
+
+def process_profile_picture(profile_id, name):
+    """
+    Generates the thumbnails of a profile picture and marks the profile as done.
+    Returns False if that failed.
+    """
+    try:
+        profile = UserProfile.objects.filter(pk=profile_id).first()
+        if profile is None or profile.profile_picture.name != name:
+            # the picture was replaced or the profile removed in the meantime
+            return True
+        generate_thumbnails(name, profile.profile_picture.storage)
+        updated = UserProfile.objects.filter(pk=profile_id, profile_picture=name).update(
+            thumbnails_for=name, updated_at=timezone.now(),
+        )
+        if updated:
+            bump_data_version(profile.user_id)
+        return True
+    except Exception:
+        logger.exception("Thumbnail generation failed for %s", name)
+        return False
+
+
+def _run(key):
+    done = False
+    try:
+        done = process_profile_picture(*key)
+    finally:
+        connections.close_all()
+        with _lock:
+            _in_flight.discard(key)
+            if not done:
+                _retry_after[key] = time.monotonic() + THUMBNAIL_RETRY_DELAY
+    return done
+
+
+def submit(profile_id, name):
+    """
+    Queues the thumbnails of the picture unless this process is on it already or it failed recently.
+    """
+    key = (profile_id, name)
+    with _lock:
+        if key in _in_flight or time.monotonic() < _retry_after.get(key, 0):
+            return
+        _retry_after.pop(key, None)
+        _in_flight.add(key)
+    _executor.submit(_run, key)
+
+
+def schedule_thumbnails(profile):
+    name = profile.profile_picture.name
+    if not name or name == DEFAULT_AVATAR:
+        return
+    transaction.on_commit(lambda: submit(profile.pk, name))
+
+
+def thumbnail_urls(profile, request):
+    name = profile.profile_picture.name if profile.profile_picture else None
+    if not name:
+        return {}
+    # the default avatar variants are pre-generated by `manage.py generate_thumbnails`
+    if name != DEFAULT_AVATAR and profile.thumbnails_for != name:
+        # still pending: the job may have been lost, see the module docstring
+        transaction.on_commit(lambda: submit(profile.pk, name))
+        return {}
+    storage = profile.profile_picture.storage
+    return {
+        str(size): request.build_absolute_uri(storage.url(thumbnail_name(name, size)))
+        for size in THUMBNAIL_SIZES
+    }
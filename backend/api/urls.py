@@ -1,10 +1,55 @@
+from django.conf import settings
 from django.urls import path
-from rest_framework_simplejwt.views import TokenObtainPairView
 from . import views
+from .async_views import LiveEventsView
+
+if getattr(settings, 'ASYNC_AUTH_VIEWS', False):
+    # ASGI: password hashing off the event loop, see async_views.py
+    from . import async_views
+    login_view = async_views.AsyncTokenObtainPairView.as_view()
+    set_new_password_view = async_views.AsyncSetNewPasswordView.as_view()
+    change_password_view = async_views.AsyncChangePasswordView.as_view()
+else:
+    login_view = views.ThrottledTokenObtainPairView.as_view()
+    set_new_password_view = views.SetNewPasswordAPI.as_view()
+    change_password_view = views.ChangePasswordAPI.as_view()
 
 urlpatterns = [
-    path('api/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),  # logowanie
+    path('api/token/', login_view, name='token_obtain_pair'),  # logowanie
     path('api/register/', views.RegisterView.as_view(), name='register'),         # rejestracja
+    path('api/activate/<int:uid>/<str:token>/', views.ActivateAccount.as_view(), name='activate-account'),
     path('api/password-reset-request/', views.PasswordResetRequestView.as_view(), name='password_reset_request'),
+    path('api/password-reset-confirm/', set_new_password_view, name='password_reset_confirm'),
+    path('api/password-change/', change_password_view, name='password_change'),
+    path('api/profile/', views.ProfileView.as_view(), name='profile'),
+    path('api/days/', views.DayEntryRangeView.as_view(), name='day_entry_range'),
+    path('api/days/<int:pk>/', views.DayEntryDetailView.as_view(), name='day_entry_detail'),
+    path('api/days/history/', views.DayEntryHistoryView.as_view(), name='day_entry_history'),
+    path('api/days/<int:pk>/todos/bulk/', views.TodoBulkView.as_view(), name='todo_bulk'),
+    path('api/todos/', views.TodoItemListView.as_view(), name='todo_list'),
+    path('api/todos/<int:pk>/', views.TodoItemDetailView.as_view(), name='todo_detail'),
+    path('api/moods/', views.MoodListView.as_view(), name='mood_list'),
+    path('api/export/<str:kind>/', views.JournalExportView.as_view(), name='journal_export'),
+    path('api/import/', views.JournalImportView.as_view(), name='journal_import'),
+    path('api/stats/', views.StatsView.as_view(), name='stats'),
+    path('api/search/', views.SearchView.as_view(), name='search'),
+    path('api/sync/', views.SyncView.as_view(), name='sync'),
+    path('api/recurring/', views.RecurringTodoListView.as_view(), name='recurring_list'),
+    path('api/recurring/<int:pk>/', views.RecurringTodoDetailView.as_view(), name='recurring_detail'),
+    path('api/recurring/occurrences/', views.RecurringOccurrenceListView.as_view(), name='recurring_occurrences'),
+    path(
+        'api/recurring/<int:pk>/occurrences/<str:date>/',
+        views.RecurringOccurrenceDetailView.as_view(),
+        name='recurring_occurrence',
+    ),
+    path('api/live/', LiveEventsView.as_view(), name='live_events'),  # SSE, ASGI only
+    path('api/live/ticket/', views.LiveTicketView.as_view(), name='live_ticket'),
+    path('metrics', views.metrics_view, name='metrics'),  # Prometheus
     # Dodaj kolejne endpointy według potrzeb...
-]
\ No newline at end of file
+]
+
+if settings.DEBUG:
+    # development only, in production the web server serves MEDIA_ROOT (README, profile pictures)
+    urlpatterns.append(
+        path(f"{settings.MEDIA_URL.strip('/')}/<path:path>", views.media_view, name='media'),  # see storage.py
+    )
\ No newline at end of file
@@ -0,0 +1,58 @@
+import hashlib
+
+from django.db.models import F
+from django.utils import timezone
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+from .models import UserDataVersion
+
+
+def bump_data_version(user_id):
+    """
+    Called by the signals for every write to the user's data (signals.py): one UPDATE of the user's
+    row, two more queries the first time. The row is also a lock, concurrent writes of one user
+    wait for each other's commit there; bulk writes bump once (journal_changed).
+    """
+    now = timezone.now()
+    updated = UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now)
+    if not updated:
+        _, created = UserDataVersion.objects.get_or_create(
+            user_id=user_id, defaults={'version': 1, 'updated_at': now}
+        )
+        if not created:
+            UserDataVersion.objects.filter(user_id=user_id).update(version=F('version') + 1, updated_at=now)
+
+
+def get_data_version(user_id):
+    """
+    Returns (version, updated_at) of the user's data, (0, None) if nothing was written yet.
+    """
+    row = UserDataVersion.objects.filter(user_id=user_id).values_list('version', 'updated_at').first()
+    return row or (0, None)
+
+
+class DataVersionConditionalMixin:
+    """
+    Conditional GET for views of the user's data.
+    The view calls `self.not_modified(request)` at the start of `get` and returns the result unless it is None;
+    the ETag is added to the response in `finalize_response`. No Last-Modified: its one-second resolution
+    would answer If-Modified-Since with 304 after a second write within the same second.
+    """
+
+    def get_version_key(self, request):
+        # extra state the response depends on besides the user's data
+        return ''
+
+    def not_modified(self, request):
+        version = get_data_version(request.user.pk)[0]
+        self.data_version = version
+        key = f'{request.user.pk}:{version}:{request.get_full_path()}:{self.get_version_key(request)}'
+        self.etag = '"%s"' % hashlib.sha256(key.encode()).hexdigest()[:32]
+        return get_conditional_response(request, etag=self.etag)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'etag', None) and response.status_code in (200, 304):
+            response['ETag'] = self.etag
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -2,11 +2,46 @@ from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import generics
-from .serializers import RegisterSerializer, PasswordResetRequestSerializer, SetNewPasswordSerializer
+from .serializers import RegisterSerializer, PasswordResetRequestSerializer, SetNewPasswordSerializer, ChangePasswordSerializer
+from .serializers import DayEntrySerializer, DayRangeSerializer, TodoBulkSerializer, TodoItemSerializer
+from .serializers import ProfilePictureSerializer, StatsQuerySerializer, SearchQuerySerializer
+from .serializers import DayEntryWriteSerializer, TodoItemWriteSerializer, TodoQuerySerializer
+from .serializers import SyncDayEntrySerializer, SyncQuerySerializer, SyncTodoItemSerializer
+from .serializers import OccurrenceOverrideSerializer, RecurringTodoSerializer
+from .models import DayEntry, RecurringTodo, TodoItem
+from .versioning import DataVersionConditionalMixin
+from .pagination import DayEntryKeysetPagination
+from .thumbnails import schedule_thumbnails, thumbnail_urls
+from .stats import user_stats
+from . import search
+from . import sync
+from .recurrence import is_occurrence, occurrence_cache, override_occurrence
+from .journal_io import EXPORT_FORMATS, aiterate, export_journal, import_journal
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.contrib.auth.models import User
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView
-from rest_framework.throttling import UserRateThrottle
+from rest_framework import status
+from django.contrib.auth.tokens import PasswordResetTokenGenerator
+from django.utils.encoding import smart_bytes
+from django.utils.http import urlsafe_base64_encode
+from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.static import serve
+from django.conf import settings
+from .catalog import mood_catalog
+from .outbox import enqueue_email
+from .tokens import account_activation_token
+from .authentication import get_profile
+from .purge import request_account_deletion
+from .live import LIVE_TICKET_TTL, issue_ticket
+from .storage import MEDIA_IMMUTABLE_MAX_AGE, MEDIA_MAX_AGE, is_content_addressed
+from .throttling import LoginRateThrottle, PasswordResetConfirmRateThrottle, PasswordResetRateThrottle, RegisterRateThrottle
+from . import metrics
+import datetime
+import secrets
 
 # user view
 class RegisterAPI(generics.CreateAPIView):
@@ -18,7 +53,8 @@ class ActivateAccount(APIView):
     permission_classes = []
 
     def get(self, request, uid, token):
-        user = get_object_or_404(User, pk=uid)
+        # an account queued for deletion stays closed
+        user = get_object_or_404(User, pk=uid, purge__isnull=True)
         if account_activation_token.check_token(user, token):
             user.is_active = True
             user.save()
@@ -35,10 +71,7 @@ class ResendActivationEmailView(APIView):
             return Response({"detail": "Activation link sent."}, status=status.HTTP_200_OK)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
-# throttling
-class LoginRateThrottle(UserRateThrottle):
-    scope = 'login'
-
+# login, limited across all worker processes (api/throttling.py)
 class ThrottledTokenObtainPairView(TokenObtainPairView):
     permission_classes = [AllowAny]
     throttle_classes = [LoginRateThrottle]
@@ -47,6 +80,7 @@ class ThrottledTokenObtainPairView(TokenObtainPairView):
 class PasswordResetRequestView(generics.GenericAPIView):
     serializer_class = PasswordResetRequestSerializer
     permission_classes = []  # AllowAny
+    throttle_classes = [PasswordResetRateThrottle]
 
     def post(self, request, *args, **kwargs):
         ser = self.get_serializer(data=request.data)
@@ -59,20 +93,21 @@ class PasswordResetRequestView(generics.GenericAPIView):
         uidb64 = urlsafe_base64_encode(smart_bytes(user.pk))
         frontend_reset_url = f"{request.scheme}://{request.get_host()}/reset-password/{uidb64}/{token}/"
 
-        #end mail
+        # mail goes through the outbox, see send_outbox_emails
         subject = "Password reset"
         message = (
             f"Hi {user.username},\n\n"
             f"Click the link to reset your password:\n{frontend_reset_url}\n\n"
              "If this wasn’t you, please ignore this message."
         )
-        send_mail(subject, message, None, [user.email], fail_silently=False)
+        enqueue_email(subject, message, [user.email])
 
         return Response({"status": "reset link sent"}, status=status.HTTP_200_OK)
 
 class SetNewPasswordAPI(generics.GenericAPIView):
     serializer_class = SetNewPasswordSerializer
     permission_classes = []  # AllowAny
+    throttle_classes = [PasswordResetConfirmRateThrottle]
 
     def post(self, request, *args, **kwargs):
         ser = self.get_serializer(data=request.data)
@@ -91,44 +126,342 @@ class ChangePasswordAPI(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
-class ProfileView(APIView):
+class ProfileView(DataVersionConditionalMixin, APIView):
     permission_classes = [IsAuthenticated]
 
     def get(self, request):
-        user = request.user
-        profile, _ = UserProfile.objects.get_or_create(user=user)
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        user, profile, created = get_profile(request.user, self.data_version)
+        if created:
+            # creating the profile bumped the version, send the current validators
+            self.not_modified(request)
         data = {
             "username": user.username,
             "email": user.email,
             "profile_picture": request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None,
+            "profile_picture_thumbnails": thumbnail_urls(profile, request),
         }
         return Response(data)
 
     def patch(self, request):
-        user = request.user
-        profile, _ = UserProfile.objects.get_or_create(user=user)
+        user, profile, _ = get_profile(request.user)
         data = {}
         if 'email' in request.data:
             user.email = request.data['email']
-            user.save()
+            user.save(update_fields=['email'])
             data['email'] = user.email
         if 'username' in request.data:
             user.username = request.data['username']
-            user.save()
+            user.save(update_fields=['username'])
             data['username'] = user.username
         # obsługa zdjęcia profilowego jak wcześniej
         serializer = ProfilePictureSerializer(profile, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            if 'profile_picture' in request.FILES:
+                # resizing runs in the background, thumbnails show up once they are ready
+                schedule_thumbnails(profile)
             data['profile_picture'] = request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None
+            data['profile_picture_thumbnails'] = thumbnail_urls(profile, request)
         return Response(data)
 
     def delete(self, request):
-        user = request.user
-        user.delete()
+        # the journal is deleted in batches by `purge_accounts` (purge.py), the account is closed now
+        request_account_deletion(request.user)
         return Response({"detail": "Account deleted."}, status=status.HTTP_204_NO_CONTENT)
 
 class RegisterView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = RegisterSerializer
+    throttle_classes = [RegisterRateThrottle]
+
+# calendar: /api/days/?from=2025-07-01&to=2025-07-31, POST creates an entry
+class DayEntryRangeView(DataVersionConditionalMixin, generics.ListCreateAPIView):
+    serializer_class = DayEntrySerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return DayEntryWriteSerializer if self.request.method == 'POST' else DayEntrySerializer
+
+    def get_version_key(self, request):
+        # entries embed mood name/icon
+        return mood_catalog.snapshot().etag
+
+    def list(self, request, *args, **kwargs):
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        return super().list(request, *args, **kwargs)
+
+    def get_queryset(self):
+        params = DayRangeSerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        # constant number of queries: entries in one, todos in one (moods come from the catalog)
+        return (
+            DayEntry.objects
+            .filter(
+                user=self.request.user,
+                date__gte=params.validated_data['from'],
+                date__lte=params.validated_data['to'],
+            )
+            .prefetch_related('todos')
+            .order_by('date')
+        )
+
+class DayEntryDetailView(generics.RetrieveUpdateAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return DayEntrySerializer if self.request.method == 'GET' else DayEntryWriteSerializer
+
+    def get_queryset(self):
+        return DayEntry.objects.filter(user=self.request.user).prefetch_related('todos')
+
+# todos of the user, optionally of one day: /api/todos/?day_entry=12
+class TodoItemListView(generics.ListCreateAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return TodoItemWriteSerializer if self.request.method == 'POST' else TodoItemSerializer
+
+    def get_queryset(self):
+        params = TodoQuerySerializer(data=self.request.query_params)
+        params.is_valid(raise_exception=True)
+        todos = TodoItem.objects.filter(user=self.request.user)
+        if 'day_entry' in params.validated_data:
+            todos = todos.filter(day_entry_id=params.validated_data['day_entry'])
+        return todos.order_by('id')
+
+class TodoItemDetailView(generics.RetrieveUpdateAPIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_serializer_class(self):
+        return TodoItemSerializer if self.request.method == 'GET' else TodoItemWriteSerializer
+
+    def get_queryset(self):
+        return TodoItem.objects.filter(user=self.request.user)
+
+# full history, newest first: /api/days/history/?cursor=...&limit=50
+class DayEntryHistoryView(generics.ListAPIView):
+    serializer_class = DayEntrySerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = DayEntryKeysetPagination
+
+    def get_queryset(self):
+        return DayEntry.objects.filter(user=self.request.user).prefetch_related('todos')
+
+# batched todo sync for one day: {"create": [...], "update": [...], "delete": [ids]}
+class TodoBulkView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        day_entry = get_object_or_404(DayEntry, pk=pk, user=request.user)
+        serializer = TodoBulkSerializer(
+            data=request.data,
+            context={'request': request, 'user': request.user, 'day_entry': day_entry},
+        )
+        serializer.is_valid(raise_exception=True)
+        todos = serializer.save()
+        return Response(TodoItemSerializer(todos, many=True).data, status=status.HTTP_200_OK)
+
+# mood catalog, clients revalidate with If-None-Match
+class MoodListView(APIView):
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        snapshot = mood_catalog.snapshot()
+        response = get_conditional_response(request, etag=snapshot.etag)
+        if response is None:
+            response = Response(snapshot.data)
+        response['ETag'] = snapshot.etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+# journal download: /api/export/ndjson/ or /api/export/csv/, streamed in constant memory
+class JournalExportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, kind):
+        if kind not in EXPORT_FORMATS:
+            raise Http404
+        chunks = export_journal(request.user, kind)
+        if isinstance(request._request, ASGIRequest):
+            chunks = aiterate(chunks)
+        response = StreamingHttpResponse(chunks, content_type=EXPORT_FORMATS[kind])
+        response['Content-Disposition'] = f'attachment; filename="journal.{kind}"'
+        return response
+
+# journal upload (e.g. from another diary app): multipart 'file', optional 'kind' (ndjson/csv)
+class JournalImportView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'file': ['No file was submitted.']}, status=status.HTTP_400_BAD_REQUEST)
+        kind = request.data.get('kind') or ('csv' if upload.name.lower().endswith('.csv') else 'ndjson')
+        if kind not in EXPORT_FORMATS:
+            return Response({'kind': [f"Unsupported format '{kind}'."]}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            report = import_journal(request.user, upload.file, kind)
+        except UnicodeDecodeError:
+            return Response({'file': ['The file must be UTF-8 encoded.']}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report, status=status.HTTP_200_OK)
+
+# mood distribution and todo completion per week/month/year, read from the MoodStat rollup
+class StatsView(DataVersionConditionalMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_version_key(self, request):
+        return mood_catalog.snapshot().etag
+
+    def get(self, request):
+        params = StatsQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        data = params.validated_data
+        return Response({
+            'period': data['period'],
+            'results': user_stats(request.user.pk, data['period'], data.get('from'), data.get('to')),
+        })
+
+# full-text search in day descriptions and todos: /api/search/?q=dog walk
+class SearchView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        if not search.is_available():
+            return Response({'detail': 'Search is not available on this database.'}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        params = SearchQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        results = search.search_journal(request.user.pk, params.validated_data['q'], params.validated_data['limit'])
+        return Response({'results': results})
+
+# repeating todos: /api/recurring/, their occurrences are computed, not stored
+class RecurringTodoListView(generics.ListCreateAPIView):
+    serializer_class = RecurringTodoSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return RecurringTodo.objects.filter(user=self.request.user).order_by('id')
+
+class RecurringTodoDetailView(generics.RetrieveUpdateDestroyAPIView):
+    serializer_class = RecurringTodoSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return RecurringTodo.objects.filter(user=self.request.user)
+
+# occurrences of all repeating todos in a window: /api/recurring/occurrences/?from=2025-01-01&to=2025-12-31
+class RecurringOccurrenceListView(DataVersionConditionalMixin, APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = DayRangeSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        not_modified = self.not_modified(request)
+        if not_modified is not None:
+            return not_modified
+        # expanded per month and cached under the data version the conditional check just read
+        occurrences = occurrence_cache.occurrences(
+            request.user.pk, self.data_version, params.validated_data['from'], params.validated_data['to'],
+        )
+        return Response(occurrences)
+
+# one occurrence: PUT {"is_done": true} / {"is_skipped": true} / {"content": "..."}, DELETE restores the rule's values
+class RecurringOccurrenceDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get_occurrence(self, request, pk, date):
+        rule = get_object_or_404(RecurringTodo, pk=pk, user=request.user)
+        try:
+            date = datetime.date.fromisoformat(date)
+        except ValueError:
+            raise Http404
+        if not is_occurrence(rule, date):
+            raise Http404
+        return rule, date
+
+    @transaction.atomic
+    def put(self, request, pk, date):
+        rule, date = self.get_occurrence(request, pk, date)
+        serializer = OccurrenceOverrideSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        occurrence = override_occurrence(rule, date, serializer.validated_data)
+        if occurrence is None:
+            return Response({'rule': rule.pk, 'date': date, 'is_skipped': True})
+        return Response(occurrence)
+
+    def delete(self, request, pk, date):
+        rule, date = self.get_occurrence(request, pk, date)
+        rule.overrides.filter(date=date).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+# offline clients: changes since the last sync, /api/sync/?since=<next of the previous response>
+class SyncView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        params = SyncQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        token = params.validated_data.get('since')
+        if not token:
+            # the profile row is created lazily, a first sync has to see it
+            get_profile(request.user)
+        try:
+            changes = sync.sync_changes(request.user, token, params.validated_data['limit'])
+        except sync.InvalidSyncToken:
+            return Response({'detail': 'Invalid sync token.'}, status=status.HTTP_400_BAD_REQUEST)
+        except sync.SyncTokenExpired:
+            # deletions older than the token were pruned, the client starts over without 'since'
+            return Response({'detail': 'Sync token expired, full resync required.'}, status=status.HTTP_410_GONE)
+        profile = changes['profile'][0] if changes['profile'] else None
+        return Response({
+            'days': SyncDayEntrySerializer(changes['days'], many=True).data,
+            'todos': SyncTodoItemSerializer(changes['todos'], many=True).data,
+            'profile': profile and {
+                'username': profile.user.username,
+                'email': profile.user.email,
+                'profile_picture': request.build_absolute_uri(profile.profile_picture.url) if profile.profile_picture else None,
+                'profile_picture_thumbnails': thumbnail_urls(profile, request),
+                'updated_at': profile.updated_at,
+            },
+            'deleted': [
+                {'type': tombstone.kind, 'id': tombstone.object_id, 'deleted_at': tombstone.deleted_at}
+                for tombstone in changes['deleted']
+            ],
+            'next': changes['next'],
+            'has_more': changes['has_more'],
+        })
+
+# ticket for the EventSource of /api/live/ (async_views.LiveEventsView), the access token stays out of its URL
+class LiveTicketView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        return Response({'ticket': issue_ticket(request.user), 'expires_in': LIVE_TICKET_TTL}, status=status.HTTP_201_CREATED)
+
+# Prometheus scrape endpoint: histograms of this worker process, see metrics.py
+def metrics_view(request):
+    token = metrics.METRICS_TOKEN
+    if not token:
+        # denied until a scrape token is configured
+        return HttpResponse(status=status.HTTP_403_FORBIDDEN)
+    if not secrets.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(metrics.registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
+# uploaded media with DEBUG (django.views.static.serve is not meant for production, see urls.py);
+# a content-addressed name (storage.py) never gets other content, so clients keep it for good
+def media_view(request, path):
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=MEDIA_IMMUTABLE_MAX_AGE, immutable=True)
+    else:
+        # the default avatar and older uploads can change under the same name
+        patch_cache_control(response, public=True, max_age=MEDIA_MAX_AGE)
+    return response
@@ -12,5 +12,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mojprojekt.settings')
+# login and password endpoints hash off the event loop (api/async_views.py)
+os.environ.setdefault('ASYNC_AUTH_VIEWS', '1')
+# persistent connections are per thread, Django recommends against them under ASGI
+os.environ.setdefault('DB_CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
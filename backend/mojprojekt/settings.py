@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -79,6 +81,24 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # WAL: readers never wait for a writer; synchronous=NORMAL is still safe in WAL
+            # (a power loss can only drop the last commits), 20 MB page cache, 128 MB mmap
+            'init_command': (
+                'PRAGMA journal_mode=WAL;'
+                'PRAGMA synchronous=NORMAL;'
+                'PRAGMA cache_size=-20000;'
+                'PRAGMA mmap_size=134217728;'
+                'PRAGMA temp_store=MEMORY;'
+            ),
+            # take the write lock at BEGIN: two transactions that read first can no longer deadlock
+            # on the lock upgrade (an immediate "database is locked"), they wait up to `timeout`
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,  # busy_timeout, seconds
+        },
+        # keep the connection (and its page cache) between requests
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 600)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
@@ -86,18 +106,17 @@ DATABASES = {
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
+# used by the register/reset/change password serializers; the rules cover length and all-numeric passwords,
+# the breached passwords filter (api/passwords.py) the common ones (Django's list until a filter is built)
 AUTH_PASSWORD_VALIDATORS = [
     {
-        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
-    },
-    {
-        'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator',
+        'NAME': 'api.passwords.PasswordRulesValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.CommonPasswordValidator',
+        'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
     },
     {
-        'NAME': 'django.contrib.auth.password_validation.NumericPasswordValidator',
+        'NAME': 'api.passwords.BreachedPasswordValidator',
     },
 ]
 
@@ -119,6 +138,10 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Uploaded files (profile pictures)
+MEDIA_URL = 'media/'
+MEDIA_ROOT = BASE_DIR / 'media'
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -126,12 +149,84 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_THROTTLE_CLASSES': [
         'rest_framework.throttling.UserRateThrottle',
     ],
     'DEFAULT_THROTTLE_RATES': {
+        'user': '1000/hour',
         'login': '5/minute',  # 5 prób logowania na minutę
+        'register': '10/hour',
+        'password_reset': '5/hour',  # reset links sent
+        'password_reset_confirm': '10/hour',  # new passwords set with a link
     }
 }
+
+SIMPLE_JWT = {
+    # tokens carry a hash of the password, changing it logs out every session; tokens issued before this
+    # was switched on have no hash and are all rejected, every user logs in again once after that deploy
+    'CHECK_REVOKE_TOKEN': True,
+}
+
+# Authenticated user + profile cache (api/authentication.py), seconds before other workers see changes
+AUTH_USER_CACHE_TTL = 30
+# password changes, deactivations and deletions reach the caches of all workers of this host at once through
+# this file; workers on other hosts only see them after AUTH_USER_CACHE_TTL
+AUTH_REVOCATIONS_PATH = BASE_DIR / 'auth_revocations'
+
+# Async views for the ASGI deployment (api/async_views.py): login/password; hashing threads
+ASYNC_AUTH_VIEWS = os.environ.get('ASYNC_AUTH_VIEWS') == '1'
+PASSWORD_HASHER_POOL_SIZE = 4
+
+# Token buckets of the login/register/password reset throttles (api/throttling.py), shared by all workers
+THROTTLE_DB_PATH = BASE_DIR / 'throttle.sqlite3'
+
+# Outbox (api/outbox.py), drained by `python manage.py send_outbox_emails --loop`
+OUTBOX_BATCH_SIZE = 100
+OUTBOX_MAX_ATTEMPTS = 6
+OUTBOX_LEASE_SECONDS = 300
+
+# Mood catalog cache (api/catalog.py), seconds before other workers pick up mood changes
+MOOD_CATALOG_TTL = 300
+
+# Profile picture thumbnails (api/thumbnails.py), generated off the request thread
+THUMBNAIL_SIZES = (64, 128, 256)
+THUMBNAIL_FORMAT = 'WEBP'
+THUMBNAIL_WORKERS = 2
+
+# Request timing (api/metrics.py): Prometheus histograms at /metrics, Server-Timing header on request
+SERVER_TIMING_HEADER = os.environ.get('SERVER_TIMING_HEADER') == '1'
+# scrapers send "Authorization: Bearer <token>"; unset = /metrics is denied
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Live journal updates over SSE (api/live.py): 'sqlite' carries events from every process that writes (WSGI
+# workers, commands) to the ASGI ones that serve the streams; 'local' only when a single process does everything
+LIVE_BACKEND = os.environ.get('LIVE_BACKEND', 'sqlite')
+LIVE_DB_PATH = BASE_DIR / 'live.sqlite3'
+
+# Delta sync for offline clients (api/sync.py); tombstones are pruned by `python manage.py prune_tombstones`
+SYNC_BATCH_SIZE = 200
+SYNC_TOMBSTONE_DAYS = 90
+
+# Repeating todos (api/recurrence.py): expanded months kept per worker process
+RECURRENCE_CACHE_SIZE = 2048
+
+# Todo reminders (api/reminders.py), queued into the outbox by `python manage.py run_reminders`
+REMINDER_WINDOW = 3600
+REMINDER_RELOAD_SECONDS = 30
+REMINDER_BATCH_SIZE = 500
+
+# Account deletion (api/purge.py): closed accounts are deleted in batches by `python manage.py purge_accounts --loop`,
+# registrations never activated within UNACTIVATED_ACCOUNT_DAYS by `python manage.py purge_unactivated_accounts`
+ACCOUNT_PURGE_BATCH_SIZE = 500
+UNACTIVATED_ACCOUNT_DAYS = 7
+
+# Profile pictures are stored once per content (api/storage.py) and served from /media/ with Cache-Control: immutable;
+# unused ones are deleted right away, leftovers by `python manage.py collect_media`
+MEDIA_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+MEDIA_GC_GRACE_SECONDS = 600
+
+# Breached passwords filter, built by `python manage.py build_breached_passwords <list>`; no file = no check
+BREACHED_PASSWORDS_FILE = BASE_DIR / 'breached_passwords.bloom'
+BREACHED_PASSWORDS_FP_RATE = 0.001